@@ -1,15 +1,40 @@
-import os, datetime, subprocess, json, random, string, uuid
-from dotenv import load_dotenv 
+import os, datetime, shutil, subprocess, random, string, time, uuid, base64, hashlib, json
 from flask import (
     Flask, render_template, request, jsonify,
-    send_from_directory, make_response
+    make_response, Response, g, abort, redirect
 )
-from flask_mail import Mail, Message
+from flask_mail import Mail
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 
-print("DEBUG: app.py is being loaded!")
+from config import (
+    RECDIR, FFMPEG_PATH, FFPROBE_PATH, UPLOADS_DIR, JOBS_DIR, DERIVED_DIR, MP4_DIR, METRICS_DIR,
+    DERIVED_CACHE_BYTES, DERIVED_CACHE_POLICY, LINKS_FILE, SESSIONS_FILE, DATABASE_PATH,
+    RETENTION_MAX_AGE, RECORDINGS_QUOTA_BYTES, RETENTION_INTERVAL,
+)
+from clipper import BATCH_FORMATS, CLIP_MODES, batch_clip, clip_recording, probe_keyframes, probe_streams
+from cooperative import run_blocking
+from derived_cache import DerivedCache
+from mailer import Mailer
+from hls import HLS_LADDER, HLS_MIMETYPES, HLS_SEGMENT_SECONDS, package_hls
+from serving import CACHE_POLICIES, send_media
+from store import FILE_SORTS, Store
+from thumbnails import (
+    MAX_TILES, MIN_INTERVAL, POSTER_POSITION, POSTER_WIDTH, SPRITE_COLUMNS, THUMBNAIL_MIMETYPES, TILE_WIDTH,
+    make_thumbnails,
+)
+from chunked_upload import ChunkedUploads, UploadError, copy_stream, link_new
+from planner import DEFAULT_PROFILE, load_profiles, plan_mp4
+from media import (
+    pipe_ffmpeg_to_file, probe_media, progress_seconds, remux_with_cues, run_ffmpeg_progress,
+    set_process_observer,
+)
+from metrics import (
+    DB_SECONDS_BUCKETS, PROCESS_SECONDS_BUCKETS, RSS_BUCKETS, THROUGHPUT_BUCKETS, Metrics,
+)
+from retention import Retention
+from transcode_jobs import TranscodeJobs
 
-load_dotenv() 
+print("DEBUG: app.py is being loaded!")
 
 app = Flask(__name__) # Only one app = Flask(__name__) needed here
 
@@ -25,13 +50,15 @@ if not app.logger.handlers:
 # --- END NEW Logging Configuration ---
 
 # --- App Configuration ---
+# Server settings can be overridden, e.g. to test against a local SMTP stand-in (see mailer.py).
 app.config.update(
-    MAIL_SERVER="smtp.gmail.com",
-    MAIL_PORT=587,
-    MAIL_USE_TLS=True,
+    MAIL_SERVER=os.getenv("MAIL_SERVER", "smtp.gmail.com"),
+    MAIL_PORT=int(os.getenv("MAIL_PORT", 587)),
+    MAIL_USE_TLS=os.getenv("MAIL_USE_TLS", "1") == "1",
+    MAIL_USE_SSL=os.getenv("MAIL_USE_SSL", "0") == "1",
     MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
     MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_DEFAULT_SENDER=("GrabScreen", os.getenv("MAIL_USERNAME")),
+    MAIL_DEFAULT_SENDER=("GrabScreen", os.getenv("MAIL_SENDER", os.getenv("MAIL_USERNAME"))),
 )
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-secret")
 
@@ -40,33 +67,11 @@ serializer = URLSafeTimedSerializer(app.config["SECRET_KEY"])
 TOKEN_EXPIRY_SECONDS = 15 * 60
 mail = Mail(app)
 
-# --- Dynamic Path Configuration based on OS ---
-IS_WINDOWS = os.name == 'nt' # 'nt' for Windows, 'posix' for Linux/macOS
-
-if IS_WINDOWS:
-    # --- Paths for Windows Local Development ---
-    # IMPORTANT: VERIFY THESE PATHS ON YOUR MACHINE!
-    # RECDIR should be where you want recordings to be saved locally
-    RECDIR = "E:\\GrabScreen_Recordings" # <--- Ensure this path exists and is accessible locally
-    # FFMPEG_DIR should be the path to the 'bin' folder containing ffmpeg.exe
-    FFMPEG_DIR = "C:\\ffmpeg-7.1.1-essentials_build\\bin" # <--- e.g., "C:\\ffmpeg-7.0.2-full_build\\bin" (VERIFY!)
-    FFMPEG_PATH = os.path.join(FFMPEG_DIR, "ffmpeg.exe") # Add .exe for Windows
-else:
-    # --- Paths for Linux/Render Deployment ---
-    # RECDIR must point to your Render Persistent Disk mount path + a subdirectory for your files
-    RECDIR = "/var/data/recordings" # <--- CHANGED THIS TO USE RENDER'S PERSISTENT DISK
-    # On Render, FFmpeg is usually installed system-wide (e.g., via apt-get).
-    # If it's in the system's PATH, just "ffmpeg" is enough.
-    FFMPEG_PATH = "ffmpeg" # Assumes 'ffmpeg' is in the system's PATH on Render
-    # If you put a static ffmpeg build on the persistent disk, the path would be:
-    # FFMPEG_PATH = "/var/data/ffmpeg-7.0.2-amd64-static/ffmpeg" 
-    # (assuming you extracted 'ffmpeg-7.0.2-amd64-static' into /var/data/)
-
-MP4_DIR = os.path.join(RECDIR, "mp4_converted")
-
 # Ensure directories exist (will now create them inside /var/data/recordings)
 os.makedirs(RECDIR, exist_ok=True)
-os.makedirs(MP4_DIR, exist_ok=True) 
+
+chunked_uploads = ChunkedUploads(UPLOADS_DIR)
+transcode_jobs = TranscodeJobs(JOBS_DIR, logger=app.logger)
 
 # --- FFmpeg Path Verification (for better debugging) ---
 # This check is more effective for absolute paths.
@@ -77,27 +82,107 @@ if os.path.isabs(FFMPEG_PATH) and not os.path.exists(FFMPEG_PATH):
 elif not os.path.isabs(FFMPEG_PATH):
     app.logger.info(f"FFmpeg path '{FFMPEG_PATH}' is relative/assumed in PATH. Not performing direct file existence check.")
 
+MP4_CONVERT_TIMEOUT = 30 * 60 # Upper bound for one background MP4 conversion
+
+# --- Metrics (Prometheus, aggregated across workers; see metrics.py) ---
+metrics = Metrics(METRICS_DIR)
+metrics.histogram("http_request_duration_seconds", "Time to produce a response, by endpoint.")
+metrics.gauge("http_requests_in_flight", "Requests currently being handled, by endpoint.")
+metrics.counter("ffmpeg_runs_total", "ffmpeg/ffprobe processes run, by operation and outcome.")
+metrics.histogram("ffmpeg_wall_seconds", "Wall time of each ffmpeg/ffprobe process.", PROCESS_SECONDS_BUCKETS)
+metrics.histogram("ffmpeg_cpu_seconds", "CPU time (user+sys) of each ffmpeg/ffprobe process.", PROCESS_SECONDS_BUCKETS)
+metrics.counter("ffmpeg_cpu_seconds_total", "CPU time used by ffmpeg/ffprobe processes, by mode.")
+metrics.histogram("ffmpeg_max_rss_bytes", "Peak resident memory of each ffmpeg/ffprobe process.", RSS_BUCKETS)
+metrics.counter("ffmpeg_runs_unmeasured_total", "ffmpeg/ffprobe processes whose CPU time and peak RSS couldn't be read (not in the cpu/rss series).")
+metrics.counter("upload_bytes_total", "Bytes received in uploads.")
+metrics.counter("upload_seconds_total", "Time spent receiving upload bodies.")
+metrics.histogram("upload_throughput_bytes_per_second", "Receive rate of each upload request.", THROUGHPUT_BUCKETS)
+metrics.counter("mail_attempts_total", "Outgoing mail delivery attempts, by result (sent, retry, failed).")
+metrics.histogram("store_operation_seconds", "SQLite store reads (queries) and writes (transactions).", DB_SECONDS_BUCKETS)
+
+def observe_process(op, wall, cpu_user, cpu_system, max_rss, returncode):
+    metrics.inc("ffmpeg_runs_total", op=op, outcome="ok" if returncode == 0 else "error")
+    metrics.observe("ffmpeg_wall_seconds", wall, op=op)
+    if cpu_user is not None:
+        metrics.observe("ffmpeg_cpu_seconds", cpu_user + cpu_system, op=op)
+        metrics.inc("ffmpeg_cpu_seconds_total", cpu_user, op=op, mode="user")
+        metrics.inc("ffmpeg_cpu_seconds_total", cpu_system, op=op, mode="system")
+        metrics.observe("ffmpeg_max_rss_bytes", max_rss, op=op)
+    else:
+        metrics.inc("ffmpeg_runs_unmeasured_total", op=op)
+
+set_process_observer(observe_process)
+
+def observe_upload(kind, nbytes, seconds):
+    metrics.inc("upload_bytes_total", nbytes, kind=kind)
+    metrics.inc("upload_seconds_total", seconds, kind=kind)
+    if seconds > 0:
+        metrics.observe("upload_throughput_bytes_per_second", nbytes / seconds, kind=kind)
+
+store = Store(DATABASE_PATH, observe=lambda kind, seconds: metrics.observe("store_operation_seconds", seconds, op=kind))
+if store.migrate_from_json(SESSIONS_FILE, LINKS_FILE):
+    app.logger.info(f"Migrated {SESSIONS_FILE} and {LINKS_FILE} into {DATABASE_PATH}.")
+if store.backfill_file_index():
+    app.logger.info("Added existing session recordings to the gallery file index.")
+
+derived_cache = DerivedCache(DERIVED_DIR, store, DERIVED_CACHE_BYTES,
+                             policy=DERIVED_CACHE_POLICY, logger=app.logger)
+
+# Expiry-indexed cleanup of old recordings (replaces the cleanup.py directory sweep).
+retention = Retention(RECDIR, store, RETENTION_MAX_AGE, RECORDINGS_QUOTA_BYTES,
+                      derived_cache=derived_cache, uploads=chunked_uploads, jobs=transcode_jobs,
+                      legacy_dirs=[MP4_DIR], logger=app.logger)
+if RETENTION_INTERVAL > 0:
+    retention.start(RETENTION_INTERVAL)
+
+# Outgoing mail is queued and sent in the background over one pooled SMTP connection.
+mailer = Mailer(app, mail, store, os.path.join(RECDIR, ".mailer.lock"), logger=app.logger,
+                observe=lambda result: metrics.inc("mail_attempts_total", result=result))
+mailer.start()
+
+def mail_configured():
+    return bool(app.config.get("MAIL_USERNAME") and app.config.get("MAIL_PASSWORD"))
+
+def mail_queued_response(mail_id, message):
+    return jsonify({"status": "ok", "message": message, "mail_id": mail_id,
+                    "status_url": f"/mail/{mail_id}"}), 202
+
+@metrics.collector
+def disk_metrics():
+    recordings_bytes, recordings = store.recordings_usage()
+    cache = derived_cache.stats()
+    disk = shutil.disk_usage(RECDIR)
+    return [
+        ("recordings_bytes", "gauge", "Size of the recordings in RECDIR.", [({}, recordings_bytes)]),
+        ("recordings", "gauge", "Number of recordings in RECDIR.", [({}, recordings)]),
+        ("derived_cache_bytes", "gauge", "Size of the derived media cache.", [({}, cache["bytes"])]),
+        ("derived_cache_budget_bytes", "gauge", "Byte budget of the derived media cache.", [({}, cache["max_bytes"])]),
+        ("derived_cache_events_total", "counter", "Derived media cache lookups and evictions.",
+         [({"event": e}, cache.get(e, 0)) for e in ("hits", "misses", "evictions")]),
+        ("disk_free_bytes", "gauge", "Free space on the recordings volume.", [({}, disk.free)]),
+        ("disk_total_bytes", "gauge", "Size of the recordings volume.", [({}, disk.total)]),
+    ]
 
-LINKS_FILE = "public_links.json"
-SESSIONS_FILE = "user_sessions.json"
-
-# --- Helper Functions ---
-def load_json(file_path):
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                app.logger.warning(f"Corrupt or empty JSON file: {file_path}. Returning empty dict.")
-                return {} # Return empty dict if file is corrupt or empty
-    return {}
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or "unmatched"
+    metrics.add("http_requests_in_flight", 1, endpoint=g.metrics_endpoint)
 
-def save_json(data, file_path):
-    with open(file_path, "w") as f:
-        json.dump(data, f, indent=2)
+@app.after_request
+def record_status(response):
+    g.response_status = response.status_code
+    return response
 
-public_links = load_json(LINKS_FILE)
-user_sessions = load_json(SESSIONS_FILE)
+@app.teardown_request
+def record_request(exc):
+    if "request_started" not in g:
+        return
+    metrics.add("http_requests_in_flight", -1, endpoint=g.metrics_endpoint)
+    status = g.get("response_status", 500)
+    # For streamed bodies this is the time to the first byte (headers), not the full transfer.
+    metrics.observe("http_request_duration_seconds", time.perf_counter() - g.request_started,
+                    endpoint=g.metrics_endpoint, method=request.method, status=str(status))
 
 # ─────────────────────────────────────────────────────────
 # Routes
@@ -107,64 +192,310 @@ user_sessions = load_json(SESSIONS_FILE)
 def index():
     return render_template("index.html", year=datetime.datetime.now().year)
 
-# In app.py
+def recording_names(prefix="recording", ext=".webm"):
+    """Candidate names for a new recording: timestamped, then _1, _2, ..."""
+    base = datetime.datetime.now().strftime(f"{prefix}_%Y%m%d_%H%M%S")
+    yield f"{base}{ext}"
+    n = 1
+    while True:
+        yield f"{base}_{n}{ext}"
+        n += 1
+
+def open_new_recording(prefix="recording", ext=".webm"):
+    """Creates an empty recording file; returns (name, file). Opening with "xb"
+    fails when the name exists, so two uploads in the same second can't share it."""
+    for fname in recording_names(prefix, ext):
+        try:
+            return fname, open(os.path.join(RECDIR, fname), "xb")
+        except FileExistsError:
+            continue
+
+def recording_mimetype(fname):
+    # Batch clips can be exported as MP4; everything else is WebM.
+    return "video/mp4" if fname.endswith(".mp4") else "video/webm"
+
+def add_to_session(fname):
+    """Adds fname to the caller's magic_token session, creating one if needed. Returns the token."""
+    token = request.cookies.get("magic_token")
+    if not store.session_exists(token):
+        token = uuid.uuid4().hex[:16]
+
+    store.add_session_files(token, [fname])
+    return token
+
+# --- Media metadata cache ---
+META_BATCH_LIMIT = 200
+
+def media_meta(fnames, probe=True):
+    """Returns {fname: metadata or None} for recordings in RECDIR. Served from the
+    store while the file's size/mtime match; otherwise ffprobe runs once and the
+    result is cached."""
+    cached = store.get_media_meta(fnames)
+    result = {}
+    for fname in fnames:
+        path = os.path.join(RECDIR, fname)
+        try:
+            st = os.stat(path)
+        except OSError:
+            result[fname] = None
+            continue
+        entry = cached.get(fname)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            result[fname] = entry[2]
+            continue
+        if not probe:
+            result[fname] = None
+            continue
+        try:
+            meta = probe_media(FFPROBE_PATH, path)
+        except (subprocess.SubprocessError, OSError, ValueError) as e:
+            app.logger.warning(f"ffprobe failed for {fname}: {e}")
+            result[fname] = None
+            continue
+        meta["size"] = st.st_size
+        store.save_media_meta(fname, st.st_size, st.st_mtime_ns, meta)
+        result[fname] = meta
+    return result
+
+def get_media_meta(fname):
+    return media_meta([fname])[fname]
+
+def is_valid_name(fname):
+    return bool(fname) and os.path.basename(fname) == fname and not fname.startswith(".")
+
+@app.route("/meta/<fname>", endpoint="get_meta")
+def get_meta(fname):
+    if not is_valid_name(fname) or not os.path.isfile(os.path.join(RECDIR, fname)):
+        return jsonify({"status": "fail", "error": "File not found"}), 404
+    meta = get_media_meta(fname)
+    if meta is None:
+        return jsonify({"status": "fail", "error": "Could not read media information"}), 500
+    return jsonify({"status": "ok", "filename": fname, "meta": meta})
+
+@app.route("/meta", methods=["POST"], endpoint="get_meta_batch")
+def get_meta_batch():
+    data = request.get_json(silent=True) or {}
+    files = data.get("files")
+    if not isinstance(files, list) or not all(isinstance(f, str) for f in files):
+        return jsonify({"status": "fail", "error": "Expected {\"files\": [...]}"}), 400
+    if len(files) > META_BATCH_LIMIT:
+        return jsonify({"status": "fail", "error": f"At most {META_BATCH_LIMIT} files per request"}), 400
+    files = [f for f in dict.fromkeys(files) if is_valid_name(f)]
+    return jsonify({"status": "ok", "meta": media_meta(files)})
+
+# --- Post-upload indexing ---
+def index_recording(fname, report, remux=True):
+    """Job body: remuxes a fresh upload (stream copy) so it gets Duration and Cues,
+    swaps it in atomically and stores its keyframe index. Clips skip the remux:
+    ffmpeg already wrote both, and replacing the file would break its hard link
+    to the derived cache (storing the clip twice)."""
+    path = os.path.join(RECDIR, fname)
+    if remux:
+        tmp_path = path + ".remux"
+        try:
+            remux_with_cues(FFMPEG_PATH, path, tmp_path)
+            if not os.path.exists(path):
+                return {"skipped": "deleted during remux"} # Don't resurrect a deleted recording
+            if os.path.getsize(tmp_path) > 0:
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    report(progress=0.5)
+    keyframes = probe_keyframes(FFPROBE_PATH, path)
+    meta = get_media_meta(fname) # Fills the metadata cache for the remuxed file
+    duration = meta["duration"] if meta else None
+    st = os.stat(path)
+    store.save_media_index(fname, st.st_size, st.st_mtime_ns, duration, keyframes)
+    retention.track(fname) # The remux changed its size
+    derived_cache.source_hash(path) # Cache key for later conversions, hashed off the request path
+    if meta and meta.get("video"):
+        submit_thumbnail_job(fname) # Poster and scrub sprite for the gallery and trimmer
+    return {"duration": duration, "keyframes": len(keyframes)}
+
+def submit_index_job(fname, remux=True):
+    job_id = TranscodeJobs.job_id("index", fname)
+    return transcode_jobs.submit(job_id, lambda report: index_recording(fname, report, remux),
+                                 {"kind": "index", "source": fname})
 
 @app.route("/upload", methods=["POST"])
 def upload():
+    # Compatibility path: the whole recording in one multipart POST.
     video_file = request.files.get("video")
     if not video_file:
         return jsonify({"status": "fail", "error": "No file"}), 400
 
-    fname = datetime.datetime.now().strftime("recording_%Y%m%d_%H%M%S.webm")
-    save_path = os.path.join(RECDIR, fname)
-
     try:
-        # --- NEW: Memory-efficient streaming save ---
-        CHUNK_SIZE = 4096  # Process in 4KB chunks
-        with open(save_path, "wb") as f:
-            while True:
-                chunk = video_file.stream.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-                f.write(chunk)
+        started = time.perf_counter()
+        fname, f = open_new_recording()
+        save_path = os.path.join(RECDIR, fname)
+        with f:
+            copy_stream(video_file.stream, f)
+            observe_upload("single", f.tell(), time.perf_counter() - started)
         app.logger.info(f"Successfully saved uploaded video to {save_path} by streaming.")
-        # --- END NEW ---
     except Exception as e:
         app.logger.error(f"Failed to save uploaded video file: {e}")
         return jsonify({"status": "fail", "error": str(e)}), 500
 
+    token = add_to_session(fname)
+    retention.track(fname, time.time())
+    submit_index_job(fname)
+
+    response = jsonify({"status": "ok", "filename": fname})
+    response.set_cookie("magic_token", token, max_age=365*24*60*60)
+    return response
+
+# --- Chunked (resumable) uploads ---
+# POST /upload/chunked                      -> create an upload session
+# PUT  /upload/chunked/<id>/<seq>           -> store chunk <seq> (raw body, idempotent)
+# GET  /upload/chunked/<id>                 -> which chunks arrived (for resuming)
+# POST /upload/chunked/<id>/finalize        -> assemble the recording
+
+@app.errorhandler(UploadError)
+def handle_upload_error(e):
+    return jsonify({"status": "fail", "error": str(e)}), e.status
+
+def check_upload_owner(upload_id):
+    owner = chunked_uploads.owner(upload_id)
+    if owner and owner != request.cookies.get("magic_token"):
+        raise UploadError("Upload session belongs to another session", 403)
+
+@app.route("/upload/chunked", methods=["POST"], endpoint="create_chunked_upload")
+def create_chunked_upload():
     token = request.cookies.get("magic_token")
-    if not token or token not in user_sessions:
+    if not store.session_exists(token):
         token = uuid.uuid4().hex[:16]
-        user_sessions[token] = []
+        store.create_session(token)
+
+    chunked_uploads.expire()
+    upload_id = chunked_uploads.create(token)
+    response = jsonify({"status": "ok", "upload_id": upload_id})
+    response.set_cookie("magic_token", token, max_age=365*24*60*60)
+    return response
 
-    user_sessions[token].append(fname)
-    save_json(user_sessions, SESSIONS_FILE)
+@app.route("/upload/chunked/<upload_id>/<int:seq>", methods=["PUT"], endpoint="put_upload_chunk")
+def put_upload_chunk(upload_id, seq):
+    check_upload_owner(upload_id)
+    started = time.perf_counter()
+    created = chunked_uploads.put_chunk(upload_id, seq, request.stream, request.content_length)
+    if created:
+        observe_upload("chunked", request.content_length or 0, time.perf_counter() - started)
+    return jsonify({"status": "ok", "seq": seq, "duplicate": not created})
+
+@app.route("/upload/chunked/<upload_id>", methods=["GET"], endpoint="chunked_upload_status")
+def chunked_upload_status(upload_id):
+    check_upload_owner(upload_id)
+    return jsonify({"status": "ok", **chunked_uploads.status(upload_id)})
+
+@app.route("/upload/chunked/<upload_id>/finalize", methods=["POST"], endpoint="finalize_chunked_upload")
+def finalize_chunked_upload(upload_id):
+    check_upload_owner(upload_id)
+    data = request.get_json(silent=True) or {}
+    expected = data.get("chunks")
+    try:
+        expected = int(expected) if expected is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"status": "fail", "error": "Invalid chunk count"}), 400
+
+    # Concatenating the chunks is disk-bound; keep it off the gevent loop. The
+    # name is picked in there too, right where the file is written.
+    fname, created = run_blocking(chunked_uploads.finalize, upload_id, RECDIR, recording_names(), expected)
+    if created:
+        app.logger.info(f"Assembled chunked upload {upload_id} into {fname}.")
+        token = add_to_session(fname)
+        retention.track(fname, time.time())
+        submit_index_job(fname)
+    else:
+        token = request.cookies.get("magic_token")
 
     response = jsonify({"status": "ok", "filename": fname})
-    response.set_cookie("magic_token", token, max_age=365*24*60*60)
+    if token:
+        response.set_cookie("magic_token", token, max_age=365*24*60*60)
     return response
 
 @app.route("/session/files")
 def session_files():
     token = request.cookies.get("magic_token")
-    if not token or token not in user_sessions:
+    if not store.session_exists(token):
         return jsonify({"status": "empty", "files": []})
-    
-    # Ensure all files in the session actually exist on disk
-    existing_files = [f for f in user_sessions.get(token, []) if os.path.exists(os.path.join(RECDIR, f))]
-    if len(existing_files) != len(user_sessions.get(token, [])):
-        user_sessions[token] = existing_files
-        save_json(user_sessions, SESSIONS_FILE)
 
-    return jsonify({"status": "ok", "files": existing_files})
+    # Retention removes expired files from their sessions, so the store is authoritative.
+    return jsonify({"status": "ok", "files": store.session_files(token)})
+
+# --- Gallery listing ---
+SESSION_LIST_LIMIT = 50
+SESSION_LIST_MAX_LIMIT = 200
+
+def encode_cursor(sort, descending, row):
+    raw = json.dumps([sort, descending, row["sort_value"], row["filename"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, sort, descending):
+    """Returns (sort value, filename) of the row a cursor points after. Raises
+    ValueError if it's malformed or was made for another sort order."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, cursor_descending, value, fname = json.loads(raw)
+    except (TypeError, ValueError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or cursor_descending != descending:
+        raise ValueError("Cursor belongs to a different sort order")
+    return value, fname
+
+def gallery_item(row):
+    fname = row["filename"]
+    link = row["public_link"]
+    return {
+        "filename": fname,
+        "url": f"/recordings/{fname}",
+        "created": row["created"],
+        "size": row["size"],
+        "duration": row["duration"],
+        "mp4": row["mp4"],
+        "mp4_url": mp4_download_url(fname, DEFAULT_PROFILE) if fname.endswith(".webm") else None, # Batch clips may already be .mp4
+        "public_url": request.url_root.rstrip("/") + "/public/" + link if link else None,
+        "thumbnail_url": row["thumbnail"],
+    }
+
+@app.route("/session/list", endpoint="session_list")
+def session_list():
+    """The caller's recordings with their metadata, a page at a time, straight from
+    the file index (no filesystem access). ?sort=created|size|duration|name,
+    ?order=desc|asc, ?limit=1..200, ?cursor=<next_cursor of the previous page>.
+    Answers 304 when the session hasn't changed since the ETag the client has."""
+    token = request.cookies.get("magic_token")
+    sort = request.args.get("sort", "created")
+    order = request.args.get("order", "desc")
+    cursor = request.args.get("cursor")
+    if sort not in FILE_SORTS or order not in ("asc", "desc"):
+        return jsonify({"status": "fail", "error": f"Sort by one of: {', '.join(FILE_SORTS)}; order asc or desc."}), 400
+    try:
+        limit = min(max(int(request.args.get("limit", SESSION_LIST_LIMIT)), 1), SESSION_LIST_MAX_LIMIT)
+        after = decode_cursor(cursor, sort, order == "desc") if cursor else None
+    except ValueError as e:
+        return jsonify({"status": "fail", "error": str(e)}), 400
+    if not store.session_exists(token):
+        return jsonify({"status": "empty", "files": [], "next_cursor": None, "total": 0})
+
+    version = store.session_files_version(token)
+    etag = hashlib.sha1(json.dumps([token, version, sort, order, cursor, limit, request.url_root]).encode()).hexdigest()
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "private, no-cache"}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+
+    rows = store.list_session_files(token, sort, order == "desc", after, limit + 1)
+    next_cursor = encode_cursor(sort, order == "desc", rows[limit - 1]) if len(rows) > limit else None
+    response = jsonify({"status": "ok", "files": [gallery_item(r) for r in rows[:limit]],
+                        "next_cursor": next_cursor, "total": version[0]})
+    response.headers.update(headers)
+    return response
 
 @app.route("/session/forget", methods=["POST"])
 def forget_session():
     token = request.cookies.get("magic_token")
-    if token and token in user_sessions:
-        del user_sessions[token]
-        save_json(user_sessions, SESSIONS_FILE)
+    if token:
+        store.forget_session(token)
     response = jsonify({"status": "ok"})
     response.set_cookie("magic_token", "", expires=0)
     return response
@@ -175,38 +506,57 @@ def clip(orig):
         data = request.get_json(force=True)
         start = float(data["start"])
         end = float(data["end"])
+        mode = data.get("mode", "exact")
     except Exception as e:
         return jsonify({"status": "fail", "error": f"Invalid JSON: {str(e)}"}), 400
 
     if start >= end:
         return jsonify({"status": "fail", "error": "Start time must be less than end time"}), 400
+    if start < 0:
+        return jsonify({"status": "fail", "error": "Start time cannot be negative"}), 400
+    if mode not in CLIP_MODES:
+        return jsonify({"status": "fail", "error": f"Invalid mode. Use one of: {', '.join(CLIP_MODES)}"}), 400
 
     in_path = os.path.join(RECDIR, orig)
     if not os.path.exists(in_path):
         return jsonify({"status": "fail", "error": "Original file not found"}), 404
 
-    clip_name = datetime.datetime.now().strftime("clip_%Y%m%d_%H%M%S.webm")
-    out_path = os.path.join(RECDIR, clip_name)
-    duration = end - start
+    meta = get_media_meta(orig)
+    duration = meta and meta.get("duration")
+    if duration and end > duration + 0.05:
+        return jsonify({"status": "fail", "error": f"End time is past the end of the recording ({duration:.2f}s)"}), 400
+    video, audio = (meta or {}).get("video"), (meta or {}).get("audio")
+    streams = ((video or {}).get("codec"), (audio or {}).get("codec"), (video or {}).get("pix_fmt")) if meta else None
+
+    # Keyframes from the post-upload index; None makes the clipper probe them itself.
+    index = store.get_media_index(orig, os.stat(in_path))
+    if index is None:
+        submit_index_job(orig)
 
-    cmd = [
-        FFMPEG_PATH, "-hide_banner", "-loglevel", "error",
-        "-ss", str(start), "-t", str(duration), "-i", in_path,
-        "-c:v", "libvpx-vp9", "-b:v", "1M",
-        "-c:a", "libopus", "-b:a", "128k",
-        "-y", out_path
-    ]
     try:
-        # For cross-platform, it's safer to rely on FFMPEG_PATH being an absolute path or in system PATH.
-        subprocess.run(cmd, check=True, capture_output=True, text=True) 
+        # The same cut of the same content is made once; repeats are hard links to the cached clip.
+        clip_key = derived_cache.key(in_path, "clip", {"start": start, "end": end, "mode": mode})
+        entry = derived_cache.get(clip_key, source=orig)
+        if entry is None:
+            staged = derived_cache.staging_path(clip_key, ".webm", unique=True)
+            # "exact" stream-copies from a keyframe or smart-cuts; "fast" snaps to the previous keyframe.
+            result = clip_recording(FFMPEG_PATH, FFPROBE_PATH, in_path, staged, start, end, mode,
+                                    keyframes=index["keyframes"] if index else None, streams=streams)
+            entry = derived_cache.put(clip_key, orig, "clip", staged, ".webm", info=result)
+        result = entry["info"]
+        clip_name = link_new(entry["abspath"], RECDIR, recording_names("clip"))
+        app.logger.info(f"Clipped {orig} [{start}-{end}] into {clip_name} ({result['strategy']}).")
+        retention.track(clip_name, time.time())
+        submit_index_job(clip_name, remux=False) # Keeps the hard link to the cached clip
         token = request.cookies.get("magic_token")
-        if token and token in user_sessions:
-            user_sessions[token].append(clip_name)
-            save_json(user_sessions, SESSIONS_FILE)
-        return jsonify({"status": "ok", "clip": clip_name})
+        if store.session_exists(token):
+            store.add_session_files(token, [clip_name])
+        return jsonify({"status": "ok", "clip": clip_name, "strategy": result["strategy"],
+                        "start": result["start"], "end": result["end"]})
     except subprocess.CalledProcessError as e:
-        app.logger.error(f"FFmpeg clipping failed for {orig}: {e.stderr}")
-        return jsonify({"status": "fail", "error": e.stderr}), 500
+        stderr = (e.stderr or "")[-2000:] # ffmpeg's last lines carry the actual error
+        app.logger.error(f"FFmpeg clipping failed for {orig}: {stderr}")
+        return jsonify({"status": "fail", "error": stderr}), 500
     except FileNotFoundError:
         app.logger.error(f"FFmpeg command not found during clip operation. Path used: {FFMPEG_PATH}")
         return jsonify({"status": "fail", "error": "Server error: FFmpeg not found for video clipping."}), 500
@@ -214,84 +564,383 @@ def clip(orig):
         app.logger.error(f"Unexpected error during clipping for {orig}: {e}")
         return jsonify({"status": "fail", "error": f"An unexpected error occurred during clipping: {str(e)}"}), 500
 
-@app.route("/recordings/<fname>", endpoint="get_recording_webm")
-def recordings(fname):
-    # This serves WEBM files for preview and default download
-    return send_from_directory(RECDIR, fname, mimetype="video/webm")
+# --- Batch clips ---
+# POST /clip/<orig>/batch  {"segments": [{"start", "end", "format"?}, ...], "format"?: "webm" | "mp4"}
+# All segments that aren't cached yet are cut by one ffmpeg process (one decode of the source).
+MAX_BATCH_SEGMENTS = 20
+
+def parse_batch_segments(data, duration):
+    """Returns ([(start, end, format)], None) or (None, error message)."""
+    if not isinstance(data, dict):
+        return None, "Expected a JSON object: {\"segments\": [...]}"
+    segments = data.get("segments")
+    default_format = data.get("format", "webm")
+    if not isinstance(segments, list) or not segments:
+        return None, "Expected a non-empty \"segments\" list"
+    if len(segments) > MAX_BATCH_SEGMENTS:
+        return None, f"At most {MAX_BATCH_SEGMENTS} segments per request"
+    parsed = []
+    for i, segment in enumerate(segments):
+        try:
+            start, end = float(segment["start"]), float(segment["end"])
+            fmt = segment.get("format", default_format)
+        except (TypeError, KeyError, ValueError, AttributeError):
+            return None, f"Segment {i}: expected {{\"start\": seconds, \"end\": seconds}}"
+        if fmt not in BATCH_FORMATS:
+            return None, f"Segment {i}: invalid format. Use one of: {', '.join(BATCH_FORMATS)}"
+        if start < 0 or start >= end:
+            return None, f"Segment {i}: start must be >= 0 and less than end"
+        if duration and end > duration + 0.05:
+            return None, f"Segment {i}: end is past the end of the recording ({duration:.2f}s)"
+        parsed.append((start, end, fmt))
+    return parsed, None
+
+@app.route("/clip/<orig>/batch", methods=["POST"], endpoint="clip_batch")
+def clip_batch(orig):
+    in_path = os.path.join(RECDIR, orig)
+    if not is_valid_name(orig) or not os.path.isfile(in_path):
+        return jsonify({"status": "fail", "error": "Original file not found"}), 404
 
-@app.route("/download/<fname>", endpoint="download_webm")
-def download(fname):
-    # This is the default WEBM download
-    return send_from_directory(RECDIR, fname, as_attachment=True, mimetype="video/webm")
+    meta = get_media_meta(orig)
+    segments, error = parse_batch_segments(request.get_json(silent=True) or {}, meta and meta.get("duration"))
+    if error:
+        return jsonify({"status": "fail", "error": error}), 400
 
-@app.route("/download/mp4/<filename>", endpoint="download_mp4")
-def download_mp4(filename):
-    app.logger.info(f"DEBUG: Entering download_mp4 function for {filename}")
+    try:
+        if meta:
+            has_video, has_audio = bool(meta.get("video")), bool(meta.get("audio"))
+        else:
+            video_codec, audio_codec, _ = probe_streams(FFPROBE_PATH, in_path)
+            has_video, has_audio = bool(video_codec), bool(audio_codec)
+
+        # Segments cut before (same content, range and format) come from the derived cache.
+        keys = [derived_cache.key(in_path, "clip", {"start": s, "end": e, "format": fmt}) for s, e, fmt in segments]
+        entries = {key: derived_cache.get(key, source=orig) for key in dict.fromkeys(keys)}
+        todo = {key: segment for key, segment in zip(keys, segments) if entries[key] is None}
+        if todo:
+            staged = [derived_cache.staging_path(key, BATCH_FORMATS[fmt]["ext"], unique=True)
+                      for key, (_, _, fmt) in todo.items()]
+            batch_clip(FFMPEG_PATH, in_path, list(todo.values()), staged, has_video, has_audio)
+            for (key, (start, end, fmt)), path in zip(todo.items(), staged):
+                entries[key] = derived_cache.put(key, orig, "clip", path, BATCH_FORMATS[fmt]["ext"],
+                                                 info={"start": start, "end": end, "format": fmt})
+    except subprocess.CalledProcessError as e:
+        stderr = (e.stderr or "")[-2000:]
+        app.logger.error(f"FFmpeg batch clipping failed for {orig}: {stderr}")
+        return jsonify({"status": "fail", "error": stderr}), 500
+    except FileNotFoundError:
+        app.logger.error(f"FFmpeg command not found during batch clip. Path used: {FFMPEG_PATH}")
+        return jsonify({"status": "fail", "error": "Server error: FFmpeg not found for video clipping."}), 500
 
-    if not filename.endswith(".webm"):
-        return jsonify({"status": "fail", "error": "Invalid file type. Only .webm allowed for conversion input."}), 400
+    clips, names = [], []
+    for i, (key, (start, end, fmt)) in enumerate(zip(keys, segments)):
+        name = link_new(entries[key]["abspath"], RECDIR, recording_names("clip", BATCH_FORMATS[fmt]["ext"]))
+        names.append(name)
+        clips.append({"index": i, "clip": name, "start": start, "end": end, "format": fmt, "cached": key not in todo})
+    app.logger.info(f"Batch-clipped {orig} into {len(names)} clips ({len(todo)} encoded in one pass).")
 
-    webm_path = os.path.join(RECDIR, filename)
-    if not os.path.exists(webm_path):
-        app.logger.error(f"❌ Original WEBM file not found at path: {webm_path}")
-        return jsonify({"status": "fail", "error": "Original WEBM file not found"}), 404
+    # One write for the whole batch: session entries, then the retention index.
+    token = request.cookies.get("magic_token")
+    if not store.session_exists(token):
+        token = uuid.uuid4().hex[:16]
+    store.add_session_files(token, names)
+    retention.track_many(names, time.time())
+    for name in names:
+        if name.endswith(".webm"):
+            submit_index_job(name, remux=False) # Keyframe index, so batch clips can be clipped again
+
+    response = jsonify({"status": "ok", "clips": clips})
+    response.set_cookie("magic_token", token, max_age=365*24*60*60)
+    return response
 
-    mp4_filename = filename.replace(".webm", ".mp4")
-    mp4_path = os.path.join(MP4_DIR, mp4_filename)
+def recording_cache_policy(fname):
+    # Until the post-upload remux has replaced the file its bytes can still change,
+    # so only indexed recordings are marked immutable.
+    path = os.path.join(RECDIR, fname)
+    indexed = os.path.isfile(path) and store.get_media_index(fname, os.stat(path)) is not None
+    return "immutable" if indexed else "revalidate"
 
-    # Check if MP4 already exists and is not empty
-    if os.path.exists(mp4_path) and os.path.getsize(mp4_path) > 0:
-        app.logger.info(f"Serving existing MP4: {mp4_filename}")
-        return send_from_directory(MP4_DIR, mp4_filename, as_attachment=True, mimetype="video/mp4")
+@app.route("/recordings/<fname>", endpoint="get_recording_webm")
+def recordings(fname):
+    # This serves WEBM files for preview and default download.
+    return send_media(RECDIR, fname, mimetype=recording_mimetype(fname), accel_root=RECDIR,
+                      cache=recording_cache_policy(fname))
 
-    app.logger.info(f"Attempting to convert {filename} to MP4...")
+@app.route("/download/<fname>", endpoint="download_webm")
+def download(fname):
+    # This is the default WEBM download
+    return send_media(RECDIR, fname, as_attachment=True, mimetype=recording_mimetype(fname), accel_root=RECDIR,
+                      cache=recording_cache_policy(fname))
+
+# --- MP4 conversion (background jobs) ---
+# Targets: "compatibility" (default, plays everywhere) or "fast" (modern browsers;
+# lets VP9/Opus recordings be remuxed instead of re-encoded). See planner.py.
+MP4_PROFILES = load_profiles(os.getenv("MP4_PROFILES_FILE"))
+
+def mp4_cache_key(filename, target=DEFAULT_PROFILE):
+    # The profile's settings are part of the key, so editing a profile never serves old conversions.
+    return derived_cache.key(os.path.join(RECDIR, filename), "mp4",
+                             {"target": target, "profile": MP4_PROFILES[target]})
+
+def mp4_job_id(key):
+    return TranscodeJobs.job_id("mp4", key)
+
+def send_cached_mp4(entry, filename):
+    return send_media(derived_cache.root, entry["path"], as_attachment=True, mimetype="video/mp4",
+                      cache="revalidate", accel_root=RECDIR,
+                      download_name=filename.replace(".webm", ".mp4"))
+
+def convert_to_mp4(webm_path, key, target, report):
+    """Job body: converts webm_path into the cache entry `key` the cheapest way the
+    target allows (remux, audio-only or full transcode), reporting ffmpeg progress."""
+    meta = get_media_meta(os.path.basename(webm_path))
+    duration = (meta or {}).get("duration")
+    plan = plan_mp4(meta, MP4_PROFILES[target])
+    tmp_path = derived_cache.staging_path(key, ".mp4")
 
     ffmpeg_cmd = [
         FFMPEG_PATH,
         "-y",                 # Overwrite output file without asking
         "-i", webm_path,      # Input WEBM file
-        "-r", "30",           # Force output framerate to 30 FPS
-        "-c:v", "libx264",
-        "-preset", "ultrafast", # Faster encoding, lower quality/larger file for quick conversions
-        "-crf", "28",         # Constant Rate Factor (0-51), higher means lower quality/smaller file
-        "-c:a", "aac",
-        "-b:a", "64k",
-        mp4_path,
+        *plan["args"],
+        "-f", "mp4",          # Explicit, since the temp file has no .mp4 extension
+        tmp_path,
     ]
 
-    app.logger.info(f"DEBUG: FFmpeg command list: {ffmpeg_cmd}")
-    app.logger.info(f"DEBUG: Checking FFMPEG_PATH existence: {os.path.exists(FFMPEG_PATH)}")
+    def on_progress(block):
+        seconds = progress_seconds(block)
+        progress = min(seconds / duration, 0.99) if (seconds is not None and duration) else None
+        report(progress=progress, out_time=seconds, speed=block.get("speed"))
 
+    report(duration=duration, strategy=plan["strategy"])
     try:
-        result = subprocess.run(ffmpeg_cmd, check=True, capture_output=True, text=True, timeout=120) # Increased timeout to 120s
-
-        app.logger.info(f"DEBUG: subprocess.run completed. Return code: {result.returncode}")
-        app.logger.info(f"✅ FFmpeg stdout for {filename}:\n{result.stdout}")
-        if result.stderr:
-            app.logger.warning(f"⚠️ FFmpeg stderr (might be warnings) for {filename}:\n{result.stderr}")
-
-        if not os.path.exists(mp4_path) or os.path.getsize(mp4_path) == 0:
-            app.logger.error(f"❌ Converted MP4 is 0 bytes or missing after conversion: {mp4_path}")
-            return jsonify({
-                "status": "fail",
-                "error": "Converted video is empty or corrupt. Try re-uploading or trimming the recording."
-            }), 500
-
-        app.logger.info(f"✅ Successfully converted and serving new MP4: {mp4_filename}")
-        return send_from_directory(MP4_DIR, mp4_filename, as_attachment=True, mimetype="video/mp4")
-
-    except subprocess.TimeoutExpired as e:
-        app.logger.error(f"❌ FFmpeg conversion timed out for {filename} after {e.timeout} seconds. Stderr from partial output: {e.stderr}")
-        return jsonify({"status": "fail", "error": f"Video conversion timed out ({e.timeout}s). Try a shorter clip or simpler conversion. Server might be under heavy load or resource constraints."}), 500
-    except subprocess.CalledProcessError as e:
-        app.logger.error(f"❌ FFmpeg conversion failed for {filename} with error code {e.returncode}:\n{e.stderr}")
-        return jsonify({"status": "fail", "error": f"Video conversion failed: {e.stderr}"}), 500
-    except FileNotFoundError:
-        app.logger.error(f"❌ FFmpeg command not found. Ensure FFmpeg is installed on the server at '{FFMPEG_PATH}' or is in the system's PATH.")
-        return jsonify({"status": "fail", "error": "Server error: FFmpeg not found for video conversion."}), 500
-    except Exception as e:
-        app.logger.error(f"❌ Unexpected error during conversion for {filename}: {e}")
-        return jsonify({"status": "fail", "error": f"An unexpected error occurred during conversion: {str(e)}"}), 500
+        run_ffmpeg_progress(ffmpeg_cmd, on_progress, timeout=MP4_CONVERT_TIMEOUT, op=f"mp4_{plan['strategy']}")
+        if not os.path.exists(tmp_path) or os.path.getsize(tmp_path) == 0:
+            raise RuntimeError("Converted video is empty or corrupt. Try re-uploading or trimming the recording.")
+        # Atomic: readers never see a half-written MP4
+        entry = derived_cache.put(key, os.path.basename(webm_path), "mp4", tmp_path, ".mp4",
+                                  info={"target": target, "strategy": plan["strategy"]})
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    app.logger.info(f"✅ Converted {os.path.basename(webm_path)} to MP4 ({target}, {plan['strategy']}).")
+    return {"size": entry["size"]}
+
+def submit_mp4_job(filename, target=DEFAULT_PROFILE, key=None):
+    """Returns the state of the (possibly shared) conversion job for filename."""
+    key = key or mp4_cache_key(filename, target)
+    webm_path = os.path.join(RECDIR, filename)
+    work = lambda report: convert_to_mp4(webm_path, key, target, report)
+    return transcode_jobs.submit(mp4_job_id(key), work, {"kind": "mp4", "source": filename, "target": target})
+
+# --- Streaming MP4 (fragmented MP4 while converting) ---
+STREAM_READ_SIZE = 64 * 1024
+STREAM_START_WAIT = 10 # Seconds to wait for a fragmented conversion to start writing before answering 202
+# Fragmented MP4: the moov box goes out first and every ~1 s of media follows as
+# its own fragment, so bytes can be sent before the conversion is finished.
+FRAGMENTED_MP4_FLAGS = ["-movflags", "frag_keyframe+empty_moov+default_base_moof", "-frag_duration", "1000000"]
+
+def stream_convert_to_mp4(webm_path, key, target, report):
+    """Job body for streaming mode: ffmpeg writes fragmented MP4 to a pipe, every
+    chunk is appended to the .part file that streaming responses tail, and the
+    finished file becomes the cached MP4 (so a dropped client loses nothing)."""
+    meta = get_media_meta(os.path.basename(webm_path))
+    plan = plan_mp4(meta, MP4_PROFILES[target])
+    args = list(plan["args"])
+    if "-movflags" in args: # +faststart needs a second pass over the whole file
+        i = args.index("-movflags")
+        del args[i:i + 2]
+    tmp_path = derived_cache.staging_path(key, ".mp4")
+
+    ffmpeg_cmd = [
+        FFMPEG_PATH, "-hide_banner", "-loglevel", "error",
+        "-i", webm_path,
+        *args, *FRAGMENTED_MP4_FLAGS,
+        "-f", "mp4", "pipe:1",
+    ]
+    report(strategy=plan["strategy"])
+    try:
+        pipe_ffmpeg_to_file(ffmpeg_cmd, tmp_path, lambda total: report(bytes=total), timeout=MP4_CONVERT_TIMEOUT,
+                            op=f"mp4_stream_{plan['strategy']}")
+        if os.path.getsize(tmp_path) == 0:
+            raise RuntimeError("Converted video is empty or corrupt. Try re-uploading or trimming the recording.")
+        entry = derived_cache.put(key, os.path.basename(webm_path), "mp4", tmp_path, ".mp4",
+                                  info={"target": target, "strategy": plan["strategy"], "fragmented": True})
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    app.logger.info(f"✅ Streamed {os.path.basename(webm_path)} to MP4 ({target}, {plan['strategy']}).")
+    return {"size": entry["size"]}
+
+def tail_growing_file(f, job_id):
+    """Yields f's content as it grows, until the job writing it has finished."""
+    with f:
+        while True:
+            chunk = f.read(STREAM_READ_SIZE)
+            if chunk:
+                yield chunk
+                continue
+            job = transcode_jobs.get(job_id)
+            if not job or job["state"] in ("done", "failed"):
+                # The writer is finished; drain whatever landed after our last read.
+                while chunk := f.read(STREAM_READ_SIZE):
+                    yield chunk
+                return
+            time.sleep(0.1)
+
+def submit_stream_mp4_job(filename, target, key):
+    """Like submit_mp4_job, but the job writes fragmented MP4 that can be tailed."""
+    webm_path = os.path.join(RECDIR, filename)
+    work = lambda report: stream_convert_to_mp4(webm_path, key, target, report)
+    return transcode_jobs.submit(mp4_job_id(key), work,
+                                 {"kind": "mp4", "source": filename, "target": target, "fragmented": True})
+
+def stream_mp4(filename, target):
+    """Starts (or attaches to) a streaming conversion and sends fragments as they
+    are produced. Falls back to the cached file when it's already complete."""
+    key = mp4_cache_key(filename, target)
+    entry = derived_cache.get(key, source=filename)
+    if entry:
+        return send_cached_mp4(entry, filename)
+
+    job_id = mp4_job_id(key)
+    part_path = derived_cache.staging_path(key, ".mp4")
+    job = submit_stream_mp4_job(filename, target, key)
+
+    deadline = time.monotonic() + STREAM_START_WAIT
+    while True:
+        entry = derived_cache.get(key, count=False)
+        if entry:
+            return send_cached_mp4(entry, filename)
+        job = transcode_jobs.get(job_id) or job
+        if job["state"] == "failed":
+            return jsonify({"status": "fail", "error": f"Video conversion failed: {job.get('error')}"}), 500
+        # Only a fragmented writer can be tailed. A regular background job (or a
+        # fragmented one still queued for a slot) is handed to the client to poll
+        # rather than holding this worker and connection until it finishes.
+        if not job.get("fragmented") or time.monotonic() > deadline:
+            return mp4_job_response(filename, target, job)
+        if job["state"] == "running":
+            try:
+                f = open(part_path, "rb")
+                break
+            except FileNotFoundError:
+                pass
+        time.sleep(0.2)
+
+    return Response(tail_growing_file(f, job_id), mimetype="video/mp4", headers={
+        "Content-Disposition": f'attachment; filename="{filename.replace(".webm", ".mp4")}"',
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no", # Let nginx pass fragments through as they arrive
+    })
+
+def mp4_download_url(filename, target):
+    url = f"/download/mp4/{filename}"
+    return url if target == DEFAULT_PROFILE else f"{url}?target={target}"
+
+def mp4_job_response(filename, target, job):
+    return jsonify({
+        "status": "ok",
+        "job_id": job["job_id"],
+        "state": job["state"],
+        "progress": job.get("progress"),
+        "status_url": f"/jobs/{job['job_id']}",
+        "download_url": mp4_download_url(filename, target),
+    }), 202
+
+def job_failed_response(job, default_error):
+    """The error of a failed job. transcode_jobs keeps it failed until its
+    retry_at (None: no more retries), so clients can stop polling."""
+    response = jsonify({
+        "status": "fail",
+        "state": "failed",
+        "job_id": job["job_id"],
+        "error": job.get("error") or default_error,
+        "retry_at": job.get("retry_at"),
+    })
+    response.status_code = 500
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+def check_webm_source(filename):
+    """Returns an error response if filename is not a convertible recording, else None."""
+    if not filename.endswith(".webm"):
+        return jsonify({"status": "fail", "error": "Invalid file type. Only .webm allowed for conversion input."}), 400
+    if not os.path.exists(os.path.join(RECDIR, filename)):
+        app.logger.error(f"❌ Original WEBM file not found: {filename}")
+        return jsonify({"status": "fail", "error": "Original WEBM file not found"}), 404
+    if request.args.get("target", DEFAULT_PROFILE) not in MP4_PROFILES:
+        return jsonify({"status": "fail", "error": f"Unknown target. Use one of: {', '.join(MP4_PROFILES)}"}), 400
+    return None
+
+@app.route("/convert/mp4/<filename>", methods=["GET", "POST"], endpoint="convert_mp4")
+def convert_mp4(filename):
+    """POST starts (or joins) the conversion; with ?stream=1 it starts a
+    streaming one instead. GET only reports where things stand, so a client
+    can show a failed conversion instead of saving the error as the download.
+    "stream_url" is only set once a streaming conversion is running, i.e. when
+    ?stream=1 will send the MP4 rather than a 202 for a job still waiting for
+    a slot; until then clients poll this. A regular job answers 202 like POST."""
+    error = check_webm_source(filename)
+    if error:
+        return error
+    target = request.args.get("target", DEFAULT_PROFILE)
+    key = mp4_cache_key(filename, target)
+    download_url = mp4_download_url(filename, target)
+    if derived_cache.get(key, count=False, source=filename):
+        return jsonify({"status": "ok", "state": "done", "download_url": download_url})
+    if request.method == "POST" and request.args.get("stream") != "1":
+        return mp4_job_response(filename, target, submit_mp4_job(filename, target, key))
+
+    job = transcode_jobs.get(mp4_job_id(key))
+    if request.method == "POST" and not (job and job["state"] in ("queued", "running")):
+        job = submit_stream_mp4_job(filename, target, key)
+    if transcode_jobs.held_back(job):
+        return job_failed_response(job, "Video conversion failed")
+    if job and job["state"] in ("queued", "running") and not job.get("fragmented"):
+        return mp4_job_response(filename, target, job)
+    response = {
+        "status": "ok",
+        "state": job["state"] if job and job["state"] in ("queued", "running") else "none",
+        "download_url": download_url,
+    }
+    if response["state"] == "running":
+        response["stream_url"] = f"{download_url}{'&' if '?' in download_url else '?'}stream=1"
+    return jsonify(response)
+
+@app.route("/metrics", endpoint="prometheus_metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/cache/stats", endpoint="cache_stats")
+def cache_stats():
+    return jsonify({"status": "ok", "cache": derived_cache.stats()})
+
+@app.route("/jobs/<job_id>", endpoint="job_status")
+def job_status(job_id):
+    job = transcode_jobs.get(job_id)
+    if not job:
+        return jsonify({"status": "fail", "error": "Job not found"}), 404
+    return jsonify({"status": "ok", "job": job})
+
+@app.route("/download/mp4/<filename>", endpoint="download_mp4")
+def download_mp4(filename):
+    error = check_webm_source(filename)
+    if error:
+        return error
+    target = request.args.get("target", DEFAULT_PROFILE)
+
+    # ?stream=1: send fragmented MP4 while it's being produced (or the cached file).
+    if request.args.get("stream") == "1":
+        return stream_mp4(filename, target)
+
+    # Serve from the derived cache; otherwise start (or join) the background conversion.
+    key = mp4_cache_key(filename, target)
+    entry = derived_cache.get(key, source=filename)
+    if entry:
+        return send_cached_mp4(entry, filename)
+
+    return mp4_job_response(filename, target, submit_mp4_job(filename, target, key))
 
 @app.route("/link/secure/<fname>", endpoint="generate_secure_link")
 def generate_secure_link(fname):
@@ -310,73 +959,265 @@ def secure_download(token):
         return "⏳ Link expired.", 410
     except BadSignature:
         return "❌ Invalid link.", 400
-    return send_from_directory(RECDIR, fname)
+    return send_media(RECDIR, fname, cache="private", accel_root=RECDIR)
 
 @app.route("/link/public/<fname>", methods=["GET"], endpoint="get_or_create_public_link")
 def get_or_create_public_link(fname):
-    global public_links
-    public_links = load_json(LINKS_FILE)
     if not os.path.exists(os.path.join(RECDIR, fname)):
         return jsonify({"status": "fail", "error": "File not found"}), 404
 
-    for token, f in public_links.items():
-        if f == fname:
-            url = request.url_root.rstrip("/") + "/public/" + token
-            return jsonify({"status": "ok", "url": url, "isNew": False})
+    token = store.link_for_file(fname)
+    if token:
+        url = request.url_root.rstrip("/") + "/public/" + token
+        return jsonify({"status": "ok", "url": url, "hlsUrl": url + "/hls/master.m3u8", "isNew": False})
 
-    token = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
-    public_links[token] = fname
-    save_json(public_links, LINKS_FILE)
-    return jsonify({"status": "ok", "url": request.url_root.rstrip("/") + "/public/" + token, "isNew": True})
+    new_token = ''.join(random.choices(string.ascii_letters + string.digits, k=12))
+    token, created = store.get_or_create_link(fname, new_token)
+    if created and fname.endswith(".webm"):
+        submit_hls_job(fname) # Shared files get their HLS ladder ahead of the first view
+    url = request.url_root.rstrip("/") + "/public/" + token
+    return jsonify({"status": "ok", "url": url, "hlsUrl": url + "/hls/master.m3u8", "isNew": created})
 
 @app.route("/link/public/<fname>", methods=["DELETE"], endpoint="delete_public_link")
 def delete_public_link(fname):
-    global public_links
-    public_links = load_json(LINKS_FILE)
-    removed = False
-    for token, f in list(public_links.items()):
-        if f == fname:
-            del public_links[token]
-            removed = True
-    if removed:
-        save_json(public_links, LINKS_FILE)
+    if store.delete_links_for_file(fname):
         return jsonify({"status": "ok", "message": "Link removed"})
     return jsonify({"status": "fail", "error": "No public link found"}), 404
 
 @app.route("/public/<token>", endpoint="serve_public_file")
 def serve_public_file(token):
-    public_links = load_json(LINKS_FILE)
-    fname = public_links.get(token)
+    fname = store.file_for_link(token)
+    if not fname or not os.path.exists(os.path.join(RECDIR, fname)):
+        return "❌ Invalid or expired link.", 404
+    return send_media(RECDIR, fname, cache="public", accel_root=RECDIR)
+
+# --- HLS packaging (see hls.py) ---
+HLS_PACKAGE_TIMEOUT = 60 * 60 # Upper bound for packaging one recording
+HLS_RETRY_AFTER = 5 # Seconds a player should wait before asking for a playlist that is being packaged
+
+def hls_cache_key(filename):
+    return derived_cache.key(os.path.join(RECDIR, filename), "hls",
+                             {"ladder": HLS_LADDER, "segment": HLS_SEGMENT_SECONDS})
+
+def package_recording(webm_path, key, report):
+    """Job body: writes the HLS ladder into a staging directory, then moves the
+    whole directory into the derived cache as one entry."""
+    # The ladder depends on the streams; if the cached probe failed, probe again
+    # here and let an error fail the job rather than guess at an audio track.
+    meta = get_media_meta(os.path.basename(webm_path)) or probe_media(FFPROBE_PATH, webm_path)
+    duration = meta.get("duration")
+    staging_dir = derived_cache.staging_path(key)
+    shutil.rmtree(staging_dir, ignore_errors=True) # Leftovers of a crashed run
+    os.makedirs(staging_dir)
+
+    def on_progress(block):
+        seconds = progress_seconds(block)
+        progress = min(seconds / duration, 0.99) if (seconds is not None and duration) else None
+        report(progress=progress, out_time=seconds, speed=block.get("speed"))
+
+    report(duration=duration)
+    try:
+        renditions = package_hls(FFMPEG_PATH, webm_path, staging_dir, meta,
+                                 on_progress=on_progress, timeout=HLS_PACKAGE_TIMEOUT)
+        if not os.path.exists(os.path.join(staging_dir, "master.m3u8")):
+            raise RuntimeError("HLS packaging produced no master playlist.")
+        entry = derived_cache.put(key, os.path.basename(webm_path), "hls", staging_dir,
+                                  info={"renditions": len(renditions), "copy": renditions[0]["copy"]})
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    app.logger.info(f"✅ Packaged {os.path.basename(webm_path)} as HLS ({len(renditions)} renditions).")
+    return {"size": entry["size"]}
+
+def submit_hls_job(filename, key=None):
+    """Returns the state of the (possibly shared) HLS packaging job for filename."""
+    key = key or hls_cache_key(filename)
+    webm_path = os.path.join(RECDIR, filename)
+    work = lambda report: package_recording(webm_path, key, report)
+    return transcode_jobs.submit(TranscodeJobs.job_id("hls", key), work, {"kind": "hls", "source": filename})
+
+def public_hls_source(token):
+    """The recording behind a public link if it can be packaged, else an error response."""
+    fname = store.file_for_link(token)
     if not fname or not os.path.exists(os.path.join(RECDIR, fname)):
+        return None, ("❌ Invalid or expired link.", 404)
+    meta = get_media_meta(fname)
+    if not fname.endswith(".webm") or (meta and not meta.get("video")):
+        return None, (jsonify({"status": "fail", "error": "This recording has no video to stream."}), 404)
+    return fname, None
+
+@app.route("/public/<token>/hls/master.m3u8", endpoint="public_hls_master")
+def public_hls_master(token):
+    """Entry point for players. Packages on first view; once ready, redirects to
+    the package's own URL so every playlist and segment below it is immutable."""
+    fname, error = public_hls_source(token)
+    if error:
+        return error
+    key = hls_cache_key(fname)
+    entry = derived_cache.get(key, source=fname)
+    if entry:
+        response = redirect(f"/public/{token}/hls/{key}/master.m3u8")
+        response.headers["Cache-Control"] = CACHE_POLICIES["revalidate"]
+        return response
+
+    # A failed packaging stays failed until its backoff passes, so a broken
+    # recording gets an error instead of an endless Retry-After loop.
+    job = submit_hls_job(fname, key)
+    if job["state"] == "failed":
+        return job_failed_response(job, "HLS packaging failed")
+    response = jsonify({
+        "status": "ok",
+        "job_id": job["job_id"],
+        "state": job["state"],
+        "progress": job.get("progress"),
+        "status_url": f"/jobs/{job['job_id']}",
+    })
+    response.status_code = 503
+    response.headers["Retry-After"] = str(HLS_RETRY_AFTER)
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route("/public/<token>/hls/<key>/<path:asset>", endpoint="public_hls_asset")
+def public_hls_asset(token, key, asset):
+    fname, error = public_hls_source(token)
+    if error:
+        return error
+    entry = derived_cache.get(key, count=False) # One lookup per segment; the master counts the view
+    if not entry or entry["kind"] != "hls" or fname not in entry["sources"]:
         return "❌ Invalid or expired link.", 404
-    return send_from_directory(RECDIR, fname)
+    mimetype = HLS_MIMETYPES.get(os.path.splitext(asset)[1])
+    if not mimetype:
+        abort(404)
+    # The key names the exact package, so nothing below it ever changes.
+    return send_media(derived_cache.root, f"{entry['path']}/{asset}", mimetype=mimetype,
+                      cache="immutable", accel_root=RECDIR)
+
+# --- Thumbnails and scrub sprites (see thumbnails.py) ---
+THUMBNAIL_TIMEOUT = 15 * 60 # Upper bound for one extraction pass
+
+def thumbnail_cache_key(filename):
+    return derived_cache.key(os.path.join(RECDIR, filename), "thumbs", {
+        "tile": TILE_WIDTH, "columns": SPRITE_COLUMNS, "max_tiles": MAX_TILES, "min_interval": MIN_INTERVAL,
+        "poster": [POSTER_WIDTH, POSTER_POSITION],
+        "sampling": "max-keyframe-gap", # Sprites sampled under the old average-spacing rule may repeat frames
+    })
+
+def thumbnail_url(filename, key, asset):
+    return f"/thumbnails/{filename}/{key}/{asset}"
+
+def extract_thumbnails(fname, key, report):
+    """Job body: extracts the poster and sprite sheet into a staging directory,
+    moves it into the derived cache and points the file index at the poster."""
+    path = os.path.join(RECDIR, fname)
+    entry = derived_cache.get(key, count=False, source=fname)
+    if entry: # Made for a recording with the same content (e.g. the same clip cut twice)
+        store.set_file_thumbnail(fname, thumbnail_url(fname, key, "poster.jpg"))
+        return {"size": entry["size"], "tiles": entry["info"]["count"]}
+    meta = get_media_meta(fname)
+    index = store.get_media_index(fname, os.stat(path))
+    duration = (meta or {}).get("duration")
+    staging_dir = derived_cache.staging_path(key)
+    shutil.rmtree(staging_dir, ignore_errors=True) # Leftovers of a crashed run
+    os.makedirs(staging_dir)
+
+    def on_progress(block):
+        seconds = progress_seconds(block)
+        progress = min(seconds / duration, 0.99) if (seconds is not None and duration) else None
+        report(progress=progress, out_time=seconds)
+
+    try:
+        sprite = make_thumbnails(FFMPEG_PATH, path, staging_dir, meta,
+                                 keyframes=(index or {}).get("keyframes"),
+                                 on_progress=on_progress, timeout=THUMBNAIL_TIMEOUT)
+        entry = derived_cache.put(key, fname, "thumbs", staging_dir, info=sprite)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    store.set_file_thumbnail(fname, thumbnail_url(fname, key, "poster.jpg"))
+    app.logger.info(f"🖼️ Extracted thumbnails for {fname} ({sprite['count']} tiles every {sprite['interval']:g}s).")
+    return {"size": entry["size"], "tiles": sprite["count"]}
+
+def submit_thumbnail_job(filename, key=None):
+    key = key or thumbnail_cache_key(filename)
+    work = lambda report: extract_thumbnails(filename, key, report)
+    # Per recording, so each owner of shared content gets its own poster URL recorded.
+    job_id = TranscodeJobs.job_id("thumbs", key, {"source": filename})
+    return transcode_jobs.submit(job_id, work, {"kind": "thumbs", "source": filename})
+
+@app.route("/thumbnails/<fname>", endpoint="get_thumbnails")
+def get_thumbnails(fname):
+    """URLs of the poster, sprite sheet and its indexes, with the sprite grid
+    inline; 202 with the job while they are still being extracted."""
+    if not is_valid_name(fname) or not os.path.isfile(os.path.join(RECDIR, fname)):
+        return jsonify({"status": "fail", "error": "File not found"}), 404
+    meta = get_media_meta(fname)
+    if meta and not meta.get("video"):
+        return jsonify({"status": "fail", "error": "This recording has no video."}), 404
+    key = thumbnail_cache_key(fname)
+    entry = derived_cache.get(key, source=fname)
+    if entry:
+        return jsonify({
+            "status": "ok",
+            "state": "done",
+            "poster_url": thumbnail_url(fname, key, "poster.jpg"),
+            "sprite_url": thumbnail_url(fname, key, "sprite.jpg"),
+            "vtt_url": thumbnail_url(fname, key, "sprite.vtt"),
+            "index_url": thumbnail_url(fname, key, "sprite.json"),
+            "sprite": entry["info"],
+        })
+
+    job = submit_thumbnail_job(fname, key) # Held back while a failure's backoff runs
+    if job["state"] == "failed":
+        return job_failed_response(job, "Thumbnail extraction failed")
+    return jsonify({
+        "status": "ok",
+        "job_id": job["job_id"],
+        "state": job["state"],
+        "progress": job.get("progress"),
+        "status_url": f"/jobs/{job['job_id']}",
+    }), 202
+
+@app.route("/thumbnails/<fname>/<key>/<asset>", endpoint="get_thumbnail_asset")
+def get_thumbnail_asset(fname, key, asset):
+    entry = derived_cache.get(key, count=False) # The index request counts the view
+    if not entry or entry["kind"] != "thumbs" or fname not in entry["sources"]:
+        abort(404)
+    mimetype = THUMBNAIL_MIMETYPES.get(os.path.splitext(asset)[1])
+    if not mimetype:
+        abort(404)
+    # The key names the exact extraction, so these never change.
+    return send_media(derived_cache.root, f"{entry['path']}/{asset}", mimetype=mimetype,
+                      cache="immutable", accel_root=RECDIR)
 
 @app.route("/send_email", methods=["POST"], endpoint="send_email_route")
 def send_email():
     data = request.get_json()
-    if not app.config.get("MAIL_USERNAME") or not app.config.get("MAIL_PASSWORD"):
+    if not mail_configured():
         return jsonify({"status": "fail", "error": "Mail service is not configured on the server."}), 503
-
-    try:
-        msg = Message(
-            "GrabScreen recording",
-            recipients=[data["to"]],
-            body=f"Hi,\n\nHere is your recording:\n{data['url']}\n\nEnjoy!"
-        )
-        mail.send(msg)
-        return jsonify({"status": "ok"})
-    except Exception as e:
-        app.logger.error(f"Mail sending failed: {e}")
-        return jsonify({"status": "fail", "error": "Could not send the email."}), 500
+    if not data or not data.get("to") or not data.get("url"):
+        return jsonify({"status": "fail", "error": "Recipient and link are required."}), 400
+
+    mail_id = mailer.enqueue(
+        "GrabScreen recording",
+        recipients=[data["to"]],
+        body=f"Hi,\n\nHere is your recording:\n{data['url']}\n\nEnjoy!"
+    )
+    return mail_queued_response(mail_id, "Your email is on its way.")
+
+@app.route("/mail/<mail_id>", endpoint="mail_status")
+def mail_status(mail_id):
+    status = mailer.status(mail_id)
+    if not status:
+        return jsonify({"status": "fail", "error": "Message not found"}), 404
+    return jsonify({"status": "ok", "mail": status})
 
 @app.route("/debug/files", endpoint="list_debug_files")
 def list_files():
     # Allow debug on Render for convenience if RENDER_EXTERNAL_URL is set
     if os.getenv("FLASK_ENV") == "development" or os.getenv("RENDER_EXTERNAL_URL"): 
         webm_files = sorted(os.listdir(RECDIR))
-        mp4_files = sorted(os.listdir(MP4_DIR))
+        derived_files = sorted(os.path.join(d, f) for d in os.listdir(DERIVED_DIR)
+                               for f in os.listdir(os.path.join(DERIVED_DIR, d)))
         return f"<h2>WEBM Files ({RECDIR}):</h2><pre>{'<br>'.join(webm_files)}</pre>" \
-               f"<h2>MP4 Files ({MP4_DIR}):</h2><pre>{'<br>'.join(mp4_files)}</pre>"
+               f"<h2>Derived Files ({DERIVED_DIR}):</h2><pre>{'<br>'.join(derived_files)}</pre>"
     return "Not available in production", 404
 
 @app.route("/delete/<filename>", methods=["POST"], endpoint="delete_file_route")
@@ -385,8 +1226,7 @@ def delete_file(filename):
         return jsonify({"status": "fail", "error": "Invalid filename"}), 400
 
     file_path = os.path.join(RECDIR, filename)
-    mp4_file_path = os.path.join(MP4_DIR, filename.replace(".webm", ".mp4"))
-    
+
     if not os.path.abspath(file_path).startswith(os.path.abspath(RECDIR)):
         return jsonify({"status": "fail", "error": "Access denied"}), 403
 
@@ -394,21 +1234,10 @@ def delete_file(filename):
         return jsonify({"status": "fail", "error": "File not found"}), 404
     try:
         os.remove(file_path)
-        if os.path.exists(mp4_file_path):
-            os.remove(mp4_file_path)
-            app.logger.info(f"Deleted corresponding MP4 file: {mp4_file_path}")
+        derived_cache.forget_source(filename) # Its cached MP4s and clips
 
-        token = request.cookies.get("magic_token")
-        if token and token in user_sessions and filename in user_sessions[token]:
-            user_sessions[token].remove(filename)
-            save_json(user_sessions, SESSIONS_FILE)
-        
-        global public_links
-        public_links = load_json(LINKS_FILE)
-        for t, f in list(public_links.items()):
-            if f == filename:
-                del public_links[t]
-        save_json(public_links, LINKS_FILE)
+        # Drops the recording from its session and removes its public links in one transaction.
+        store.delete_recording(filename)
 
         return jsonify({"status": "ok", "message": f"{filename} deleted"})
     except Exception as e:
@@ -417,7 +1246,7 @@ def delete_file(filename):
 
 @app.route("/contact_us", methods=["POST"], endpoint="contact_us_route")
 def contact_us():
-    if not app.config.get("MAIL_USERNAME") or not app.config.get("MAIL_PASSWORD"):
+    if not mail_configured():
         return jsonify({"status": "fail", "error": "Mail service is not configured on the server."}), 503
 
     data = request.get_json()
@@ -428,18 +1257,13 @@ def contact_us():
     if not all([from_email, subject, message_body]):
         return jsonify({"status": "fail", "error": "Please fill out all fields."}), 400
 
-    try:
-        msg = Message(
-            subject=f"[GrabScreen Contact] {subject}",
-            recipients=[app.config["MAIL_USERNAME"]], 
-            body=f"You have a new message from: {from_email}\n\n---\n\n{message_body}",
-            reply_to=from_email
-        )
-        mail.send(msg)
-        return jsonify({"status": "ok", "message": "Your message has been sent!"})
-    except Exception as e:
-        app.logger.error(f"Contact form mail sending failed: {e}")
-        return jsonify({"status": "fail", "error": "Sorry, an error occurred and the message could not be sent."}), 500
+    mail_id = mailer.enqueue(
+        subject=f"[GrabScreen Contact] {subject}",
+        recipients=[app.config["MAIL_USERNAME"]],
+        body=f"You have a new message from: {from_email}\n\n---\n\n{message_body}",
+        reply_to=from_email
+    )
+    return mail_queued_response(mail_id, "Your message has been sent!")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,566 @@
+# bench.py
+# Offline benchmark / load test for the upload, clip, MP4 and public-link paths.
+#
+# Synthetic WebM inputs are generated with ffmpeg (lavfi testsrc + sine), then
+# the app is driven either in-process through Flask's test client ("client")
+# or over HTTP against a real local gunicorn ("gunicorn"). Everything runs in
+# a throwaway RECDIR/database, so it never touches real recordings.
+#
+# Usage (from the repository root):
+#   python benchmarks/bench.py                          # both drivers, default sizes
+#   python benchmarks/bench.py --quick --driver client  # a fast smoke run
+#   python benchmarks/bench.py --out new.json --baseline benchmarks/baseline.json
+#   python benchmarks/bench.py --scenarios concurrency  # sync vs gevent workers
+#
+# The concurrency scenario holds 1..256 slow uploads open against gunicorn
+# (started through gunicorn.conf.py) and measures a cheap request meanwhile:
+# with sync workers, probes time out once the slow clients outnumber the
+# workers; with gevent they stay fast up to GUNICORN_WORKER_CONNECTIONS.
+#
+# Results are written as JSON (latency p50/p95/p99/mean in milliseconds,
+# throughput in requests/s and MB/s). With --baseline, every metric also
+# present in the baseline is compared and regressions beyond --tolerance are
+# listed; --fail-on-regression turns them into a non-zero exit code.
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (width, height, seconds) of the generated inputs.
+INPUTS = [(640, 360, 5), (1280, 720, 30), (1920, 1080, 120)]
+QUICK_INPUTS = [(640, 360, 3), (1280, 720, 10)]
+LINK_COUNTS = [10, 1000, 10000, 100000]
+QUICK_LINK_COUNTS = [10, 1000]
+# Slow clients held open by the concurrency scenario.
+CONCURRENCY_LEVELS = [1, 4, 16, 64, 256]
+QUICK_CONCURRENCY_LEVELS = [1, 4, 16]
+
+
+# --- Statistics ---
+def percentile(sorted_values, p):
+    """Linear-interpolated percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def summarize(latencies, wall_time, nbytes=0):
+    """Latencies in seconds -> metrics dict (ms, req/s, MB/s)."""
+    values = sorted(latencies)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    result = {
+        "count": len(values),
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "throughput_rps": round(len(values) / wall_time, 3) if wall_time else None,
+    }
+    if nbytes:
+        result["throughput_mb_s"] = round(nbytes / wall_time / 1e6, 3) if wall_time else None
+    return result
+
+
+# --- Inputs ---
+def generate_inputs(ffmpeg, out_dir, specs):
+    """Renders one VP8/Opus WebM per (width, height, seconds) spec."""
+    paths = []
+    for width, height, seconds in specs:
+        path = os.path.join(out_dir, f"testsrc_{width}x{height}_{seconds}s.webm")
+        if not os.path.exists(path):
+            subprocess.run([
+                ffmpeg, "-hide_banner", "-loglevel", "error", "-y",
+                "-f", "lavfi", "-i", f"testsrc=size={width}x{height}:rate=30:duration={seconds}",
+                "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}",
+                "-c:v", "libvpx", "-deadline", "realtime", "-cpu-used", "8", "-b:v", "1M",
+                "-c:a", "libopus", "-shortest", path,
+            ], check=True)
+        paths.append(path)
+    return paths
+
+
+def input_label(path):
+    return os.path.basename(path)[len("testsrc_"):-len(".webm")]
+
+
+# --- Drivers ---
+class ClientDriver:
+    """In-process: Flask test client (sequential; measures the app itself)."""
+    name = "client"
+    concurrency = 1
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json_body=None):
+        r = self.client.open(path, method=method, json=json_body)
+        return r.status_code, r.get_data()
+
+    def upload(self, data, filename):
+        r = self.client.post("/upload", data={"video": (io.BytesIO(data), filename)},
+                             content_type="multipart/form-data")
+        return r.status_code, r.get_json()
+
+    def first_byte(self, path):
+        """Returns (status, seconds to first body chunk, total bytes)."""
+        start = time.perf_counter()
+        r = self.client.get(path, buffered=False)
+        chunks = iter(r.response)
+        first = next(chunks, b"")
+        ttfb = time.perf_counter() - start
+        total = len(first) + sum(len(c) for c in chunks)
+        r.close()
+        return r.status_code, ttfb, total
+
+    def close(self):
+        pass
+
+
+class GunicornDriver:
+    """Over HTTP against `gunicorn app:app` on a free local port. With a
+    worker_class, the app runs through gunicorn.conf.py (the production entry
+    point) with that worker class instead of threaded sync workers."""
+    name = "gunicorn"
+
+    def __init__(self, env, workers, concurrency, worker_class=None):
+        import requests
+        self.concurrency = concurrency
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = port = s.getsockname()[1]
+        self.base = f"http://127.0.0.1:{port}"
+        if worker_class:
+            env = dict(env, GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(workers))
+            args = ["-c", "gunicorn.conf.py"]
+        else:
+            args = ["-w", str(workers), "--threads", "4"]
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", *args,
+             "-b", f"127.0.0.1:{port}", "--timeout", "600", "app:app"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                self.session.get(self.base + "/", timeout=1)
+                return
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        self.close()
+        raise RuntimeError("gunicorn did not start")
+
+    def request(self, method, path, json_body=None):
+        r = self.session.request(method, self.base + path, json=json_body)
+        return r.status_code, r.content
+
+    def upload(self, data, filename):
+        r = self.session.post(self.base + "/upload", files={"video": (filename, data, "video/webm")})
+        return r.status_code, r.json()
+
+    def first_byte(self, path):
+        start = time.perf_counter()
+        with self.session.get(self.base + path, stream=True) as r:
+            chunks = r.iter_content(64 * 1024)
+            first = next(chunks, b"")
+            ttfb = time.perf_counter() - start
+            total = len(first) + sum(len(c) for c in chunks)
+        return r.status_code, ttfb, total
+
+    def close(self):
+        self.proc.terminate()
+        try:
+            self.proc.wait(10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+def run_timed(driver, calls):
+    """Runs the zero-argument callables with the driver's concurrency.
+    Each returns the bytes it moved; returns (latencies, wall_time, bytes)."""
+    def timed(call):
+        start = time.perf_counter()
+        nbytes = call()
+        return time.perf_counter() - start, nbytes or 0
+
+    start = time.perf_counter()
+    if driver.concurrency > 1:
+        with ThreadPoolExecutor(max_workers=driver.concurrency) as pool:
+            results = list(pool.map(timed, calls))
+    else:
+        results = [timed(call) for call in calls]
+    wall = time.perf_counter() - start
+    return [r[0] for r in results], wall, sum(r[1] for r in results)
+
+
+def wait_for_job(driver, job_id, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, body = driver.request("GET", f"/jobs/{job_id}")
+        job = json.loads(body).get("job") if status == 200 else None
+        if job and job["state"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(f"job {job_id} did not finish")
+
+
+# --- Scenarios ---
+def bench_uploads(driver, inputs, iterations):
+    """POST /upload of every input; returns ({label: metrics}, {label: uploaded filename})."""
+    results, uploaded = {}, {}
+    for path in inputs:
+        with open(path, "rb") as f:
+            data = f.read()
+        names = []
+
+        def call():
+            status, body = driver.upload(data, "recording.webm")
+            assert status == 200, body
+            names.append(body["filename"])
+            return len(data)
+
+        latencies, wall, nbytes = run_timed(driver, [call] * iterations)
+        results[f"upload/{input_label(path)}"] = summarize(latencies, wall, nbytes)
+        uploaded[input_label(path)] = names[0]
+    return results, uploaded
+
+
+def bench_clips(driver, uploaded, iterations, seconds_by_label):
+    """POST /clip/<orig> at random offsets (never repeating a range, so the
+    derived cache can't answer) in both modes."""
+    from transcode_jobs import TranscodeJobs
+    results = {}
+    for label, fname in uploaded.items():
+        wait_for_job(driver, TranscodeJobs.job_id("index", fname))  # clips use the keyframe index
+        length = seconds_by_label[label]
+        for mode in ("fast", "exact"):
+            def call():
+                start = round(random.uniform(0, length * 0.5), 3)
+                end = round(min(start + max(length * 0.3, 1), length), 3)
+                status, body = driver.request("POST", f"/clip/{fname}",
+                                              {"start": start, "end": end, "mode": mode})
+                assert status == 200, body
+                return 0
+
+            latencies, wall, _ = run_timed(driver, [call] * iterations)
+            results[f"clip/{mode}/{label}"] = summarize(latencies, wall)
+    return results
+
+
+def bench_mp4(driver, uploaded, iterations, forget):
+    """Cold conversion (POST /convert + polling, cache cleared first), warm
+    cached download, and time-to-first-byte of the streaming download."""
+    results = {}
+    for label, fname in uploaded.items():
+        cold, stream_ttfb = [], []
+        for _ in range(iterations):
+            forget(fname)
+            start = time.perf_counter()
+            status, body = driver.request("POST", f"/convert/mp4/{fname}")
+            reply = json.loads(body)
+            assert status in (200, 202), reply
+            if status == 202:
+                job = wait_for_job(driver, reply["job_id"])
+                assert job["state"] == "done", job
+            cold.append(time.perf_counter() - start)
+
+            forget(fname)
+            status, ttfb, _ = driver.first_byte(f"/download/mp4/{fname}?stream=1")
+            assert status == 200, status
+            stream_ttfb.append(ttfb)
+        results[f"mp4/convert/{label}"] = summarize(cold, sum(cold))
+        results[f"mp4/stream_ttfb/{label}"] = summarize(stream_ttfb, sum(stream_ttfb))
+
+        def call():
+            status, body = driver.request("GET", f"/download/mp4/{fname}")
+            assert status == 200, status
+            return len(body)
+
+        latencies, wall, nbytes = run_timed(driver, [call] * max(iterations * 5, 10))
+        results[f"mp4/cached/{label}"] = summarize(latencies, wall, nbytes)
+    return results
+
+
+def seed_links(store, fname, count):
+    """Adds public links (to copies of fname's recording row) until there are `count`."""
+    with store.transaction() as db:
+        have = db.execute("SELECT COUNT(*) FROM public_link").fetchone()[0]
+        for i in range(have, count):
+            cur = db.execute(
+                "INSERT INTO recording (filename, session_token, created_at) VALUES (?, '', datetime('now'))",
+                (f"bench_link_{i}.webm",),
+            )
+            token = "".join(random.choices(string.ascii_letters + string.digits, k=12))
+            db.execute("INSERT INTO public_link (token, recording_id) VALUES (?, ?)", (token, cur.lastrowid))
+
+
+def bench_links(driver, store, recdir, fname, counts, lookups):
+    """GET /public/<token> latency as the number of public links grows."""
+    results = {}
+    for count in counts:
+        seed_links(store, fname, count)
+        with store.transaction() as db:
+            tokens = [r[0] for r in db.execute("SELECT token FROM public_link ORDER BY RANDOM() LIMIT ?", (lookups,))]
+        # Point the sampled links at a real (small) file so the full serving path runs.
+        for token in tokens:
+            linked = store.file_for_link(token)
+            if not os.path.exists(os.path.join(recdir, linked)):
+                os.link(os.path.join(recdir, fname), os.path.join(recdir, linked))
+
+        def make_call(token):
+            def call():
+                status, body = driver.request("GET", f"/public/{token}")
+                assert status == 200, status
+                return len(body)
+            return call
+
+        latencies, wall, nbytes = run_timed(driver, [make_call(t) for t in tokens])
+        results[f"public_link/{count}"] = summarize(latencies, wall, nbytes)
+    return results
+
+
+class SlowUploaders:
+    """`count` connections that each POST /upload and trickle the body a few
+    bytes at a time, the way a client on a bad uplink does, until closed."""
+
+    BODY_SIZE = 10 * 1024 * 1024
+    TRICKLE_BYTES = 256
+    TRICKLE_INTERVAL = 0.2
+
+    def __init__(self, port, count):
+        self.sockets = []
+        boundary = "benchslowupload"
+        head = (f'--{boundary}\r\nContent-Disposition: form-data; name="video"; filename="slow.webm"\r\n'
+                f"Content-Type: video/webm\r\n\r\n").encode()
+        request = (f"POST /upload HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n"
+                   f"Content-Type: multipart/form-data; boundary={boundary}\r\n"
+                   f"Content-Length: {self.BODY_SIZE}\r\n\r\n").encode() + head
+        for _ in range(count):
+            s = socket.create_connection(("127.0.0.1", port))
+            s.sendall(request)
+            s.setblocking(False)
+            self.sockets.append(s)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._trickle, daemon=True)
+        self._thread.start()
+
+    def _trickle(self):
+        chunk = b"\0" * self.TRICKLE_BYTES
+        while not self._stop.wait(self.TRICKLE_INTERVAL):
+            for s in self.sockets:
+                try:
+                    s.send(chunk)
+                except OSError:  # buffer full (nobody reading yet) or closed
+                    pass
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        for s in self.sockets:
+            s.close()
+
+
+def bench_concurrency(env, workers, worker_classes, levels, probes, probe_timeout=3.0):
+    """Latency of a cheap request (GET /) while N slow uploads hold connections,
+    per gunicorn worker class. Probes that don't get an answer within
+    probe_timeout count as timeouts (their latency is recorded as the timeout)."""
+    import requests
+    results = {}
+    for worker_class in worker_classes:
+        driver = GunicornDriver(env, workers, 1, worker_class=worker_class)
+        try:
+            for level in levels:
+                slow = SlowUploaders(driver.port, level)
+                try:
+                    time.sleep(1)  # let the server accept them
+                    latencies, timeouts = [], 0
+                    start = time.perf_counter()
+                    for _ in range(probes):
+                        t = time.perf_counter()
+                        try:
+                            r = requests.get(driver.base + "/", timeout=probe_timeout)
+                            r.raise_for_status()
+                        except requests.RequestException:
+                            timeouts += 1
+                        latencies.append(time.perf_counter() - t)
+                    wall = time.perf_counter() - start
+                finally:
+                    slow.close()
+                results[f"concurrency/{worker_class}/{level}"] = {
+                    **summarize(latencies, wall), "slow_clients": level, "timeouts": timeouts}
+        finally:
+            driver.close()
+    return results
+
+
+# --- Baseline comparison ---
+def compare(results, baseline, tolerance):
+    """Returns [(metric, field, baseline, current, ratio)] that got worse by more than tolerance."""
+    regressions = []
+    for driver, metrics in results["results"].items():
+        for name, current in metrics.items():
+            previous = baseline.get("results", {}).get(driver, {}).get(name)
+            if not previous:
+                continue
+            for field in ("p50_ms", "p95_ms", "p99_ms"):
+                if previous.get(field) and current.get(field):
+                    ratio = current[field] / previous[field]
+                    if ratio > 1 + tolerance:
+                        regressions.append((f"{driver}:{name}", field, previous[field], current[field], ratio))
+            if previous.get("throughput_rps") and current.get("throughput_rps"):
+                ratio = previous["throughput_rps"] / current["throughput_rps"]
+                if ratio > 1 + tolerance:
+                    regressions.append((f"{driver}:{name}", "throughput_rps",
+                                        previous["throughput_rps"], current["throughput_rps"], ratio))
+    return regressions
+
+
+def environment_info(ffmpeg):
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = None
+    ffmpeg_version = subprocess.run([ffmpeg, "-version"], capture_output=True, text=True).stdout.split("\n")[0]
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_rev": rev,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark upload, clip, MP4 and public-link paths.")
+    parser.add_argument("--driver", choices=("client", "gunicorn", "both"), default="both")
+    parser.add_argument("--quick", action="store_true", help="small inputs and few iterations")
+    parser.add_argument("--iterations", type=int, help="requests per scenario (default 20, --quick 5)")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--concurrency", type=int, default=8, help="parallel HTTP clients (gunicorn driver)")
+    parser.add_argument("--scenarios", default="upload,clip,mp4,links",
+                        help="comma-separated; also: concurrency (slow clients vs. worker class)")
+    parser.add_argument("--worker-classes", default="sync,gevent",
+                        help="gunicorn worker classes compared by the concurrency scenario")
+    parser.add_argument("--out", default="benchmarks/results.json")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown vs baseline (0.10 = 10%%)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--ffmpeg", default=os.getenv("FFMPEG", "ffmpeg"))
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    iterations = args.iterations or (5 if args.quick else 20)
+    specs = QUICK_INPUTS if args.quick else INPUTS
+    link_counts = QUICK_LINK_COUNTS if args.quick else LINK_COUNTS
+    scenarios = set(args.scenarios.split(","))
+    drivers = ("client", "gunicorn") if args.driver == "both" else (args.driver,)
+    if not scenarios & {"upload", "clip", "mp4", "links"}:
+        drivers = ()  # only the concurrency scenario, which starts its own servers
+
+    scratch = tempfile.mkdtemp(prefix="grabscreen-bench-")
+    inputs_dir = os.path.join(scratch, "inputs")
+    os.makedirs(inputs_dir)
+    if drivers:
+        print(f"Generating {len(specs)} inputs in {inputs_dir} ...")
+    inputs = generate_inputs(args.ffmpeg, inputs_dir, specs) if drivers else []
+    seconds_by_label = {input_label(p): s for p, (_, _, s) in zip(inputs, specs)}
+
+    results = {"meta": {**environment_info(args.ffmpeg), "iterations": iterations, "quick": args.quick,
+                        "workers": args.workers, "concurrency": args.concurrency},
+               "results": {}}
+    try:
+        for name in drivers:
+            # Fresh recordings dir and database per driver; config.py reads them at import.
+            recdir = os.path.join(scratch, name, "recordings")
+            os.makedirs(recdir)
+            env = dict(os.environ, RECDIR=recdir, DATABASE_PATH=os.path.join(scratch, name, "bench.db"),
+                       RETENTION_INTERVAL="0")
+            os.environ.update(env)
+            sys.path.insert(0, ROOT)
+            for module in ("config", "app"):
+                sys.modules.pop(module, None)
+            import config
+            from derived_cache import DerivedCache
+            from store import Store
+
+            store = Store(config.DATABASE_PATH)
+            cache = DerivedCache(config.DERIVED_DIR, store, config.DERIVED_CACHE_BYTES)
+            if name == "client":
+                import app as app_module
+                driver = ClientDriver(app_module.app)
+            else:
+                driver = GunicornDriver(env, args.workers, args.concurrency)
+
+            print(f"[{name}] running {', '.join(sorted(scenarios))} ...")
+            metrics = {}
+            try:
+                upload_metrics, uploaded = bench_uploads(driver, inputs, iterations)
+                if "upload" in scenarios:
+                    metrics.update(upload_metrics)
+                if "clip" in scenarios:
+                    metrics.update(bench_clips(driver, uploaded, iterations, seconds_by_label))
+                if "mp4" in scenarios:
+                    metrics.update(bench_mp4(driver, uploaded, max(iterations // 4, 1), cache.forget_source))
+                if "links" in scenarios:
+                    smallest = uploaded[input_label(inputs[0])]
+                    metrics.update(bench_links(driver, store, recdir, smallest, link_counts, iterations * 5))
+            finally:
+                driver.close()
+            results["results"][name] = metrics
+
+        if "concurrency" in scenarios:
+            recdir = os.path.join(scratch, "concurrency", "recordings")
+            os.makedirs(recdir)
+            env = dict(os.environ, RECDIR=recdir, DATABASE_PATH=os.path.join(scratch, "concurrency", "bench.db"),
+                       RETENTION_INTERVAL="0")
+            levels = QUICK_CONCURRENCY_LEVELS if args.quick else CONCURRENCY_LEVELS
+            print(f"[concurrency] {args.worker_classes} with {', '.join(map(str, levels))} slow clients ...")
+            results["results"]["concurrency"] = bench_concurrency(
+                env, args.workers, args.worker_classes.split(","), levels, probes=min(iterations, 10))
+    finally:
+        if not args.keep:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+    for driver_name, metrics in results["results"].items():
+        for metric, m in metrics.items():
+            timeouts = f"  {m['timeouts']} timeouts" if "timeouts" in m else ""
+            print(f"  {driver_name:8} {metric:40} p50 {m['p50_ms']:>10} ms  p95 {m['p95_ms']:>10} ms  "
+                  f"p99 {m['p99_ms']:>10} ms  {m['throughput_rps']} req/s{timeouts}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for metric, field, before, after, ratio in regressions:
+            print(f"  REGRESSION {metric} {field}: {before} -> {after} ({ratio:.2f}x)")
+        if not regressions:
+            print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}.")
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+# chunked_upload.py
+# Resumable, chunked uploads for recordings.
+#
+# The browser creates an upload session, PUTs sequence-numbered chunks while
+# MediaRecorder is still running, and finalizes once recording stops. Every
+# chunk is written to its own part file and renamed into place only when it
+# is complete, so retrying a chunk is always safe and a dropped connection
+# never loses what was already received. Everything lives on disk, which means
+# any gunicorn worker can serve any step of the same upload.
+
+import errno
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+
+# Large buffer for copying request bodies to disk (instead of 4KB reads).
+COPY_BUFFER_SIZE = 1024 * 1024
+# Upload sessions that were never finalized are dropped after this long.
+UPLOAD_SESSION_MAX_AGE = 24 * 60 * 60
+# A finalize lock older than this is left over from a crashed finalize, even if its pid is alive again.
+FINALIZE_LOCK_MAX_AGE = 10 * 60
+
+_UPLOAD_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+_PART_SUFFIX = ".part"
+_MANIFEST = "manifest.json"
+_FINALIZE_LOCK = "finalize.lock"
+_ASSEMBLED = "assembled.tmp"
+# os.link errors that mean "no hard link possible here", not "the name is taken".
+_NO_LINK_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP}
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        return True  # os.kill() would terminate the process on Windows; rely on the age check.
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class UploadError(Exception):
+    """Raised for client-visible upload problems. Carries an HTTP status."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def copy_stream(src, dst_file, length=None):
+    """Copies a readable stream into an open file using a large buffer.
+    Returns the number of bytes written."""
+    written = 0
+    while True:
+        to_read = COPY_BUFFER_SIZE if length is None else min(COPY_BUFFER_SIZE, length - written)
+        if to_read <= 0:
+            break
+        buf = src.read(to_read)
+        if not buf:
+            break
+        dst_file.write(buf)
+        written += len(buf)
+    return written
+
+
+def _append_file(dst_fd, src_path):
+    """Appends src_path to dst_fd, using kernel-side copies where available."""
+    with open(src_path, "rb") as src:
+        src_fd = src.fileno()
+        remaining = os.fstat(src_fd).st_size
+        offset = 0
+        try:
+            while remaining > 0:
+                if hasattr(os, "copy_file_range"):
+                    n = os.copy_file_range(src_fd, dst_fd, remaining, offset)
+                else:
+                    n = os.sendfile(dst_fd, src_fd, offset, remaining)
+                if n == 0:
+                    break
+                offset += n
+                remaining -= n
+        except (AttributeError, OSError):
+            # Zero-copy not supported here (e.g. Windows or cross-filesystem): buffered copy.
+            src.seek(offset)
+            with os.fdopen(os.dup(dst_fd), "ab", closefd=True) as dst:
+                shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+            remaining = 0
+
+
+def link_new(src, dest_dir, names):
+    """Hard-links src into dest_dir under the first of `names` that is free and
+    returns that name. Neither the link nor the fallback copy (for filesystems
+    without hard links) replaces an existing file, so two writers racing for
+    the same name each end up with their own."""
+    for name in names:
+        dst = os.path.join(dest_dir, name)
+        try:
+            os.link(src, dst)
+            return name
+        except FileExistsError:
+            continue
+        except OSError as e:
+            if e.errno not in _NO_LINK_ERRNOS:
+                raise
+        try:
+            with open(src, "rb") as fsrc, open(dst, "xb") as fdst:
+                shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+            return name
+        except FileExistsError:
+            continue
+
+
+class ChunkedUploads:
+    """On-disk store of in-progress chunked uploads, one directory per upload."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    # --- Paths ---
+    def _dir(self, upload_id):
+        if not upload_id or not _UPLOAD_ID_RE.match(upload_id):
+            raise UploadError("Invalid upload id", 400)
+        return os.path.join(self.root, upload_id)
+
+    def _existing_dir(self, upload_id):
+        path = self._dir(upload_id)
+        if not os.path.isdir(path):
+            raise UploadError("Upload session not found", 404)
+        return path
+
+    def _read_manifest(self, path):
+        try:
+            with open(os.path.join(path, _MANIFEST), "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            raise UploadError("Upload session not found", 404)
+
+    def _write_manifest(self, path, manifest):
+        tmp = os.path.join(path, _MANIFEST + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(path, _MANIFEST))
+
+    def _parts(self, path):
+        seqs = []
+        for entry in os.scandir(path):
+            if entry.name.endswith(_PART_SUFFIX):
+                try:
+                    seqs.append(int(entry.name[:-len(_PART_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(seqs)
+
+    @staticmethod
+    def _part_name(seq):
+        return f"{seq:08d}{_PART_SUFFIX}"
+
+    # --- Operations ---
+    def create(self, owner_token):
+        upload_id = uuid.uuid4().hex
+        path = self._dir(upload_id)
+        os.makedirs(path)
+        self._write_manifest(path, {"token": owner_token, "created": time.time(), "filename": None})
+        return upload_id
+
+    def owner(self, upload_id):
+        return self._read_manifest(self._existing_dir(upload_id)).get("token")
+
+    def put_chunk(self, upload_id, seq, stream, content_length):
+        """Stores chunk `seq`. Returns False if the chunk was already stored
+        (a retry), True if it was written now.
+
+        content_length is required: without it a body cut short by a dropped
+        connection would be indistinguishable from a complete chunk."""
+        path = self._existing_dir(upload_id)
+        if seq < 0:
+            raise UploadError("Chunk sequence number must be >= 0", 400)
+        if content_length is None:
+            raise UploadError("Content-Length is required for chunks", 411)
+        manifest = self._read_manifest(path)
+        if manifest.get("filename"):
+            raise UploadError("Upload already finalized", 409)
+
+        part_path = os.path.join(path, self._part_name(seq))
+        if os.path.exists(part_path):
+            return False
+
+        tmp_path = f"{part_path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                written = copy_stream(stream, f, content_length)
+            if written != content_length:
+                raise UploadError(f"Incomplete chunk: got {written} of {content_length} bytes", 400)
+            os.replace(tmp_path, part_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return True
+
+    def status(self, upload_id):
+        path = self._existing_dir(upload_id)
+        manifest = self._read_manifest(path)
+        seqs = self._parts(path)
+        total = sum(os.path.getsize(os.path.join(path, self._part_name(s))) for s in seqs)
+        return {"received": seqs, "bytes": total, "filename": manifest.get("filename")}
+
+    @staticmethod
+    def _finalize_lock_is_stale(lock_path):
+        try:
+            locked_at = os.path.getmtime(lock_path)
+            with open(lock_path, "r") as f:
+                pid = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            locked_at, pid = 0, 0
+        if pid and not _pid_alive(pid):
+            return True
+        return time.time() - locked_at > FINALIZE_LOCK_MAX_AGE
+
+    def _lock_finalize(self, lock_path):
+        """Takes the upload's finalize lock (holding our pid) and returns its fd.
+        A lock left behind by a process that died mid-finalize is taken over."""
+        for _ in range(2):
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._finalize_lock_is_stale(lock_path):
+                    break
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+                continue
+            os.write(fd, str(os.getpid()).encode())
+            return fd
+        raise UploadError("Upload is already being finalized", 409)
+
+    def finalize(self, upload_id, dest_dir, names, expected_chunks=None):
+        """Concatenates all parts into a new file in dest_dir, named after the
+        first of `names` (an iterable of candidates) that is still free when
+        the file is linked into place. Returns
+        (filename, created); finalizing an already finalized upload returns its
+        existing filename."""
+        path = self._existing_dir(upload_id)
+        manifest = self._read_manifest(path)
+        if manifest.get("filename"):
+            return manifest["filename"], False
+
+        lock_path = os.path.join(path, _FINALIZE_LOCK)
+        lock_fd = self._lock_finalize(lock_path)
+        try:
+            seqs = self._parts(path)
+            if not seqs:
+                raise UploadError("No chunks received", 400)
+            if expected_chunks is not None and len(seqs) != expected_chunks:
+                missing = sorted(set(range(expected_chunks)) - set(seqs))
+                raise UploadError(f"Missing chunks: {missing[:50]}", 409)
+            if seqs != list(range(len(seqs))):
+                missing = sorted(set(range(seqs[-1] + 1)) - set(seqs))
+                raise UploadError(f"Missing chunks: {missing[:50]}", 409)
+
+            # Assemble inside the upload's directory, then link the result into
+            # place under a name nobody else has taken (see link_new).
+            tmp_dest = os.path.join(path, _ASSEMBLED)
+            out_fd = os.open(tmp_dest, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o644)
+            try:
+                try:
+                    for seq in seqs:
+                        _append_file(out_fd, os.path.join(path, self._part_name(seq)))
+                    os.fsync(out_fd)
+                finally:
+                    os.close(out_fd)
+                filename = link_new(tmp_dest, dest_dir, names)
+            finally:
+                # A half-assembled file would otherwise sit next to the parts until expiry.
+                try:
+                    os.remove(tmp_dest)
+                except FileNotFoundError:
+                    pass
+
+            manifest["filename"] = filename
+            self._write_manifest(path, manifest)
+            for seq in seqs:
+                os.remove(os.path.join(path, self._part_name(seq)))
+            return filename, True
+        finally:
+            os.close(lock_fd)
+            os.remove(lock_path)
+
+    def expire(self, max_age=UPLOAD_SESSION_MAX_AGE):
+        """Removes upload sessions older than max_age. Returns how many were removed."""
+        now = time.time()
+        removed = 0
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and _UPLOAD_ID_RE.match(entry.name):
+                try:
+                    if now - entry.stat().st_mtime > max_age:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                        removed += 1
+                except OSError:
+                    continue
+        return removed
@@ -0,0 +1,253 @@
+# clipper.py
+# Keyframe-aware clipping.
+#
+# Re-encoding a whole range with libvpx is many times slower than realtime,
+# but most of a clip can be stream-copied: only the frames before the first
+# keyframe inside the range depend on data outside it. Two modes:
+#
+#   fast  - snap the start back to the preceding keyframe and stream-copy
+#           everything (the clip may start up to one GOP early).
+#   exact - stream-copy when the start is on a keyframe; otherwise "smart cut":
+#           re-encode only [start, next keyframe) and concatenate it with the
+#           stream-copied remainder.
+#
+# The end edge is always stream-copied. WebM from MediaRecorder (VP8/VP9) has
+# no frame reordering, so cutting a copied stream at `end` is already
+# frame-accurate and needs no re-encode.
+#
+# batch_clip() cuts several segments in one ffmpeg process: the source is
+# decoded once, split into one trim chain per segment and every chain is
+# encoded into its own output (WebM or MP4).
+
+import json
+import os
+import shutil
+import tempfile
+from bisect import bisect_left, bisect_right
+
+from media import run_process
+
+CLIP_MODES = ("exact", "fast")
+# A start this close to a keyframe counts as "on" it.
+KEYFRAME_TOLERANCE = 0.05
+
+# Encoder matching each source codec, so re-encoded edges can be concatenated
+# with stream-copied packets. Only WebM video codecs can be copied into a .webm clip.
+EDGE_ENCODERS = {
+    "vp8": ["-c:v", "libvpx", "-b:v", "1M", "-deadline", "realtime", "-cpu-used", "8"],
+    "vp9": ["-c:v", "libvpx-vp9", "-b:v", "1M", "-deadline", "realtime", "-cpu-used", "8", "-row-mt", "1"],
+}
+# Used when the whole range has to be re-encoded and the codec can't be copied.
+FALLBACK_VIDEO = ["-c:v", "libvpx-vp9", "-b:v", "1M"]
+AUDIO_ENCODERS = {
+    "opus": ["-c:a", "libopus", "-b:a", "128k"],
+    "vorbis": ["-c:a", "libvorbis", "-q:a", "5"],
+}
+FALLBACK_AUDIO = AUDIO_ENCODERS["opus"]
+
+# Output formats of batch_clip().
+BATCH_FORMATS = {
+    "webm": {"ext": ".webm", "video": EDGE_ENCODERS["vp9"], "audio": AUDIO_ENCODERS["opus"], "extra": []},
+    "mp4": {
+        "ext": ".mp4",
+        "video": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p"],
+        "audio": ["-c:a", "aac", "-b:a", "128k"],
+        "extra": ["-movflags", "+faststart"],
+    },
+}
+
+
+def probe_streams(ffprobe_path, path):
+    """Returns (video_codec, audio_codec, pix_fmt); missing streams are None."""
+    cmd = [
+        ffprobe_path, "-v", "error",
+        "-show_entries", "stream=codec_type,codec_name,pix_fmt",
+        "-of", "json", path,
+    ]
+    result = run_process(cmd, timeout=30, op="probe")
+    video = audio = pix_fmt = None
+    for stream in json.loads(result.stdout).get("streams", []):
+        if stream.get("codec_type") == "video" and video is None:
+            video, pix_fmt = stream.get("codec_name"), stream.get("pix_fmt")
+        elif stream.get("codec_type") == "audio" and audio is None:
+            audio = stream.get("codec_name")
+    return video, audio, pix_fmt
+
+
+def probe_keyframes(ffprobe_path, path):
+    """Sorted keyframe timestamps (seconds) of the first video stream. Reads
+    packet headers only, so nothing is decoded."""
+    cmd = [
+        ffprobe_path, "-v", "error", "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=p=0", path,
+    ]
+    result = run_process(cmd, timeout=120, op="probe_keyframes")
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts, _, flags = line.partition(",")
+        if "K" in flags and pts not in ("", "N/A"):
+            keyframes.append(float(pts))
+    return sorted(keyframes)
+
+
+def _copy_cmd(ffmpeg_path, in_path, start, duration, out_path):
+    return [
+        ffmpeg_path, "-hide_banner", "-loglevel", "error",
+        "-ss", f"{start:.6f}", "-i", in_path, "-t", f"{duration:.6f}",
+        "-map", "0:v:0?", "-map", "0:a:0?",
+        "-c", "copy", "-avoid_negative_ts", "make_zero",
+        "-y", out_path,
+    ]
+
+
+def _encode_cmd(ffmpeg_path, in_path, start, duration, out_path, video_args, audio_codec, pix_fmt):
+    audio_args = AUDIO_ENCODERS.get(audio_codec, FALLBACK_AUDIO) if audio_codec else ["-an"]
+    pix_args = ["-pix_fmt", pix_fmt] if pix_fmt else []
+    return [
+        ffmpeg_path, "-hide_banner", "-loglevel", "error",
+        "-ss", f"{start:.6f}", "-i", in_path, "-t", f"{duration:.6f}",
+        "-map", "0:v:0?", "-map", "0:a:0?",
+        *video_args, *pix_args, *audio_args,
+        "-y", out_path,
+    ]
+
+
+def plan_clip(keyframes, start, end, mode):
+    """Decides how to cut [start, end). Returns a dict with the strategy
+    ("copy", "smart" or "reencode") and the keyframe it hinges on."""
+    if mode == "fast":
+        i = bisect_right(keyframes, start + KEYFRAME_TOLERANCE) - 1
+        snapped = keyframes[i] if i >= 0 else 0.0
+        return {"strategy": "copy", "start": snapped}
+
+    # Exact: is the start (almost) on a keyframe?
+    i = bisect_left(keyframes, start - KEYFRAME_TOLERANCE)
+    if i < len(keyframes) and abs(keyframes[i] - start) <= KEYFRAME_TOLERANCE:
+        return {"strategy": "copy", "start": keyframes[i]}
+    # First keyframe after the start, if it's inside the clip.
+    j = bisect_right(keyframes, start)
+    if j < len(keyframes) and keyframes[j] < end - KEYFRAME_TOLERANCE:
+        return {"strategy": "smart", "start": start, "keyframe": keyframes[j]}
+    return {"strategy": "reencode", "start": start}
+
+
+def clip_recording(ffmpeg_path, ffprobe_path, in_path, out_path, start, end, mode="exact",
+                   keyframes=None, streams=None):
+    """Cuts [start, end) of in_path into out_path (written atomically).
+
+    Returns {"strategy", "start", "end"}, where start is the actual start of
+    the clip (earlier than requested in fast mode). `keyframes` and `streams`
+    (as returned by probe_keyframes / probe_streams) skip the probes when the
+    caller already has them. Raises subprocess.CalledProcessError if ffmpeg fails."""
+    if mode not in CLIP_MODES:
+        raise ValueError(f"Unknown clip mode '{mode}'. Use one of: {', '.join(CLIP_MODES)}")
+
+    video_codec, audio_codec, pix_fmt = streams or probe_streams(ffprobe_path, in_path)
+    edge_encoder = EDGE_ENCODERS.get(video_codec)
+    if keyframes is None:
+        keyframes = probe_keyframes(ffprobe_path, in_path) if edge_encoder else []
+
+    if video_codec and edge_encoder is None:
+        # e.g. H.264 from some browsers' MediaRecorder: can't be stream-copied into a .webm clip.
+        plan = {"strategy": "reencode", "start": start}
+    elif video_codec:
+        plan = plan_clip(keyframes, start, end, mode)
+    else:
+        plan = {"strategy": "copy", "start": start}
+    if plan["strategy"] == "smart" and audio_codec and audio_codec not in AUDIO_ENCODERS:
+        plan = {"strategy": "reencode", "start": start}
+
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    work_dir = tempfile.mkdtemp(prefix=".clip-", dir=out_dir)
+    try:
+        ext = os.path.splitext(out_path)[1] or ".webm"
+        tmp_out = os.path.join(work_dir, "out" + ext)
+        strategy, clip_start = plan["strategy"], plan["start"]
+
+        if strategy == "copy":
+            run_process(_copy_cmd(ffmpeg_path, in_path, clip_start, end - clip_start, tmp_out), op="clip_copy")
+        elif strategy == "reencode":
+            run_process(_encode_cmd(ffmpeg_path, in_path, start, end - start, tmp_out,
+                                    edge_encoder or FALLBACK_VIDEO, audio_codec, pix_fmt), op="clip_encode")
+        else:
+            keyframe = plan["keyframe"]
+            head = os.path.join(work_dir, "head" + ext)
+            body = os.path.join(work_dir, "body" + ext)
+            # The short head is re-encoded with the source's own codecs so the
+            # concat demuxer can join it to the stream-copied body.
+            run_process(_encode_cmd(ffmpeg_path, in_path, start, keyframe - start, head,
+                                    edge_encoder, audio_codec, pix_fmt), op="clip_encode")
+            run_process(_copy_cmd(ffmpeg_path, in_path, keyframe, end - keyframe, body), op="clip_copy")
+            list_path = os.path.join(work_dir, "parts.txt")
+            with open(list_path, "w") as f:
+                f.write(f"file '{head}'\nfile '{body}'\n")
+            run_process([
+                ffmpeg_path, "-hide_banner", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", list_path,
+                "-c", "copy", "-y", tmp_out,
+            ], op="clip_concat")
+
+        os.replace(tmp_out, out_path)
+        return {"strategy": strategy, "start": clip_start, "end": end}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _batch_graph(segments, origin, has_video, has_audio):
+    """filter_complex that splits the decoded input once per segment and trims
+    each branch to its segment (times relative to the input seek `origin`)."""
+    n = len(segments)
+    graph = []
+    if has_video:
+        graph.append(f"[0:v]split={n}" + "".join(f"[v{i}]" for i in range(n)))
+    if has_audio:
+        graph.append(f"[0:a]asplit={n}" + "".join(f"[a{i}]" for i in range(n)))
+    for i, (start, end, fmt) in enumerate(segments):
+        trim = f"start={start - origin:.6f}:end={end - origin:.6f}"
+        if has_video:
+            # H.264 4:2:0 needs even dimensions.
+            scale = ",scale=trunc(iw/2)*2:trunc(ih/2)*2" if fmt == "mp4" else ""
+            graph.append(f"[v{i}]trim={trim},setpts=PTS-STARTPTS{scale}[vo{i}]")
+        if has_audio:
+            graph.append(f"[a{i}]atrim={trim},asetpts=PTS-STARTPTS[ao{i}]")
+    return ";".join(graph)
+
+
+def batch_clip(ffmpeg_path, in_path, segments, out_paths, has_video=True, has_audio=True):
+    """Cuts every (start, end, format) in `segments` into the matching entry of
+    out_paths (each written atomically) with a single ffmpeg process.
+
+    Decoding starts at the earliest segment and stops after the latest, so
+    nothing outside the segments' span is read. Every segment is re-encoded,
+    which makes all of them frame-accurate. Raises subprocess.CalledProcessError
+    if ffmpeg fails."""
+    for _, _, fmt in segments:
+        if fmt not in BATCH_FORMATS:
+            raise ValueError(f"Unknown format '{fmt}'. Use one of: {', '.join(BATCH_FORMATS)}")
+    origin = min(start for start, _, _ in segments)
+    span = max(end for _, end, _ in segments) - origin
+
+    cmd = [
+        ffmpeg_path, "-hide_banner", "-loglevel", "error",
+        "-ss", f"{origin:.6f}", "-t", f"{span:.6f}", "-i", in_path,
+        "-filter_complex", _batch_graph(segments, origin, has_video, has_audio),
+    ]
+    out_dir = os.path.dirname(os.path.abspath(out_paths[0]))
+    work_dir = tempfile.mkdtemp(prefix=".clip-", dir=out_dir)
+    try:
+        tmp_outs = []
+        for i, (_, _, fmt) in enumerate(segments):
+            spec = BATCH_FORMATS[fmt]
+            tmp_out = os.path.join(work_dir, f"out{i}{spec['ext']}")
+            tmp_outs.append(tmp_out)
+            if has_video:
+                cmd += ["-map", f"[vo{i}]", *spec["video"]]
+            if has_audio:
+                cmd += ["-map", f"[ao{i}]", *spec["audio"]]
+            cmd += [*spec["extra"], "-y", tmp_out]
+        run_process(cmd, op="clip_batch")
+        for tmp_out, out_path in zip(tmp_outs, out_paths):
+            os.replace(tmp_out, out_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,59 @@
+# config.py
+# Paths and settings shared by the web app (app.py) and the maintenance CLI
+# (cleanup.py), so both always operate on the same directories and database.
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- Dynamic Path Configuration based on OS ---
+IS_WINDOWS = os.name == 'nt' # 'nt' for Windows, 'posix' for Linux/macOS
+
+if IS_WINDOWS:
+    # --- Paths for Windows Local Development ---
+    # IMPORTANT: VERIFY THESE PATHS ON YOUR MACHINE!
+    # RECDIR should be where you want recordings to be saved locally
+    RECDIR = "E:\\GrabScreen_Recordings" # <--- Ensure this path exists and is accessible locally
+    # FFMPEG_DIR should be the path to the 'bin' folder containing ffmpeg.exe
+    FFMPEG_DIR = "C:\\ffmpeg-7.1.1-essentials_build\\bin" # <--- e.g., "C:\\ffmpeg-7.0.2-full_build\\bin" (VERIFY!)
+    FFMPEG_PATH = os.path.join(FFMPEG_DIR, "ffmpeg.exe") # Add .exe for Windows
+    FFPROBE_PATH = os.path.join(FFMPEG_DIR, "ffprobe.exe")
+else:
+    # --- Paths for Linux/Render Deployment ---
+    # RECDIR must point to your Render Persistent Disk mount path + a subdirectory for your files
+    RECDIR = "/var/data/recordings" # <--- CHANGED THIS TO USE RENDER'S PERSISTENT DISK
+    # On Render, FFmpeg is usually installed system-wide (e.g., via apt-get).
+    # If it's in the system's PATH, just "ffmpeg" is enough.
+    FFMPEG_PATH = "ffmpeg" # Assumes 'ffmpeg' is in the system's PATH on Render
+    FFPROBE_PATH = "ffprobe" # Installed alongside ffmpeg
+    # If you put a static ffmpeg build on the persistent disk, the path would be:
+    # FFMPEG_PATH = "/var/data/ffmpeg-7.0.2-amd64-static/ffmpeg"
+    # (assuming you extracted 'ffmpeg-7.0.2-amd64-static' into /var/data/)
+
+RECDIR = os.getenv("RECDIR", RECDIR) # Override for local runs and benchmarks
+
+MP4_DIR = os.path.join(RECDIR, "mp4_converted") # Legacy name-keyed MP4 cache; only swept by retention
+UPLOADS_DIR = os.path.join(RECDIR, ".uploads") # In-progress chunked uploads
+JOBS_DIR = os.path.join(RECDIR, ".jobs") # Background transcode job state
+DERIVED_DIR = os.path.join(RECDIR, "derived") # Content-addressed cache of MP4s, clips, ...
+METRICS_DIR = os.path.join(RECDIR, ".metrics") # Per-worker metric snapshots, merged by /metrics
+DERIVED_CACHE_BYTES = int(os.getenv("DERIVED_CACHE_BYTES", 2 * 1024 ** 3)) # Disk budget for DERIVED_DIR
+DERIVED_CACHE_POLICY = os.getenv("DERIVED_CACHE_POLICY", "lru")
+
+# Legacy JSON stores, imported once into the SQLite store.
+LINKS_FILE = "public_links.json"
+SESSIONS_FILE = "user_sessions.json"
+DATABASE_PATH = os.getenv("DATABASE_PATH", os.path.join(BASE_DIR, "instance", "database.db"))
+
+# --- Retention (see retention.py) ---
+# Recordings are deleted this long after they were created.
+# 24 hours = 24 * 60 * 60 = 86400 seconds
+RETENTION_MAX_AGE = int(os.getenv("RETENTION_MAX_AGE", 24 * 60 * 60))
+# Total size of the recordings kept; the oldest go first when it's exceeded. 0 = no quota.
+RECORDINGS_QUOTA_BYTES = int(os.getenv("RECORDINGS_QUOTA_BYTES", 0))
+# How often the in-process sweep runs (one worker at a time). 0 disables it, e.g. when cleanup.py runs from cron.
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", 10 * 60))
@@ -0,0 +1,88 @@
+# cooperative.py
+# Helpers that keep blocking calls from stalling the gevent worker (see gunicorn.conf.py).
+#
+# Under `-k gevent` every request, job and background thread is a greenlet in
+# one OS thread, so a call that blocks in C (waiting for a child process with
+# wait4(), hashing a large file) stops all of them. These helpers do the
+# cooperative thing when gevent has monkey-patched the process and the plain
+# thing otherwise, so the same code serves both worker classes.
+
+import os
+import subprocess
+import sys
+import threading
+from types import SimpleNamespace
+
+USAGE_SAMPLE_INTERVAL = 0.25 # Seconds between /proc samples of a child under gevent
+
+
+def gevent_active():
+    """True when running under gevent's monkey patches (gunicorn -k gevent)."""
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("socket")
+
+
+def thread_local():
+    """A threading.local that is per OS thread even under gevent. Greenlets of
+    one thread never interleave inside a call that doesn't yield, so they can
+    share e.g. a SQLite connection instead of opening one per request."""
+    if gevent_active():
+        from gevent.monkey import get_original
+        return get_original("threading", "local")()
+    return threading.local()
+
+
+def run_blocking(fn, *args):
+    """fn(*args), on gevent's native thread pool when gevent is active (for
+    CPU- or disk-bound work that would otherwise stall every greenlet)."""
+    if gevent_active():
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+
+def _proc_usage(pid):
+    """Resource usage of a live Linux process so far, read from /proc, in
+    wait4()'s shape (ru_maxrss in kilobytes), or None if unavailable."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()  # After "(comm)", which may contain spaces
+        with open(f"/proc/{pid}/status") as f:
+            hwm = next((int(line.split()[1]) for line in f if line.startswith("VmHWM:")), None)
+    except (OSError, IndexError, ValueError):
+        return None
+    if hwm is None:  # Already a zombie: its memory is gone
+        return None
+    tick = os.sysconf("SC_CLK_TCK")
+    # fields[0] is field 3 of proc(5) (state); utime and stime are fields 14 and 15.
+    return SimpleNamespace(ru_utime=int(fields[11]) / tick, ru_stime=int(fields[12]) / tick, ru_maxrss=hwm)
+
+
+def wait_child(proc):
+    """Waits for proc and returns its resource usage, or None where that isn't
+    available. Sets proc.returncode.
+
+    Under gevent, subprocess.Popen is gevent's: its pipes and wait() are
+    cooperative, but gevent's SIGCHLD handler reaps every child with
+    waitpid(), so wait4() never gets to see the child's rusage. There the
+    usage is sampled from /proc every USAGE_SAMPLE_INTERVAL while waiting;
+    the last sample misses at most that much CPU time at the end of the run
+    (peak RSS is a high-water mark, so it is only off if the peak came last)."""
+    if gevent_active():
+        usage = _proc_usage(proc.pid)
+        while True:
+            try:
+                proc.wait(timeout=USAGE_SAMPLE_INTERVAL)
+                return usage
+            except subprocess.TimeoutExpired:
+                usage = _proc_usage(proc.pid) or usage
+    if not hasattr(os, "wait4"):
+        proc.wait()
+        return None
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:  # already reaped elsewhere
+        proc.wait()
+        return None
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
@@ -0,0 +1,169 @@
+# derived_cache.py
+# Content-addressed, disk-budgeted cache for media derived from recordings
+# (MP4 conversions, clips, thumbnails, ...).
+#
+# Keys hash the source's bytes (sha256, remembered per size/mtime in the
+# store) together with the kind of transform and its parameters, so changing
+# encoder settings never serves a stale file, and a re-uploaded copy of the
+# same recording reuses its conversions. Entries are files or directories at
+# <root>/<key[:2]>/<key><ext>, tracked in the store with size, last access
+# and hit count.
+#
+# Since keys only depend on content, one entry can belong to several
+# recordings (a clip requested twice is two hard links of one cached cut).
+# The store keeps every owner: a recording becomes one when it produces the
+# entry (put) or finds it under its own key (get with source=), and an entry
+# is deleted with its recordings only once the last owner is gone.
+#
+# After every insert the cache is trimmed to its byte budget, least recently
+# used first ("lfu": least often used first). Entries made from a recording
+# that has a public link are pinned: shared links stay fast and are never
+# evicted.
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from cooperative import run_blocking
+
+HASH_BLOCK_SIZE = 1024 * 1024
+CACHE_POLICIES = ("lru", "lfu")
+
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _path_size(path):
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(dirpath, name))
+            for dirpath, _, names in os.walk(path) for name in names
+        )
+    return os.path.getsize(path)
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class DerivedCache:
+    """Derived media files keyed by source content + transform parameters."""
+
+    def __init__(self, root, store, max_bytes, policy="lru", logger=None):
+        if policy not in CACHE_POLICIES:
+            raise ValueError(f"Unknown cache policy '{policy}'. Use one of: {', '.join(CACHE_POLICIES)}")
+        self.root = root
+        self.store = store
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.logger = logger
+        os.makedirs(root, exist_ok=True)
+
+    # --- Keys & paths ---
+    def source_hash(self, source_path):
+        """sha256 of the file's bytes; only re-read when its size or mtime changed."""
+        fname = os.path.basename(source_path)
+        st = os.stat(source_path)
+        digest = self.store.get_source_hash(fname, st)
+        if digest is None:
+            digest = run_blocking(_hash_file, source_path)
+            self.store.save_source_hash(fname, st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def key(self, source_path, kind, params=None):
+        raw = json.dumps([self.source_hash(source_path), kind, params or {}], sort_keys=True)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _relpath(self, key, ext=""):
+        return os.path.join(key[:2], key + ext)
+
+    def path(self, key, ext=""):
+        return os.path.join(self.root, self._relpath(key, ext))
+
+    def staging_path(self, key, ext="", unique=False):
+        """Where to build an entry before put(). Deterministic by default, so
+        other workers can find (and tail) an entry being built; `unique` gives
+        each writer its own path when builds aren't de-duplicated."""
+        tag = f".{os.getpid()}.{threading.get_ident()}" if unique else ""
+        path = os.path.join(self.root, key[:2], f"{key}.part{tag}{ext}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    # --- Lookups & inserts ---
+    def get(self, key, count=True, source=None):
+        """Returns the entry (a dict; "abspath" is the file, "sources" its
+        owners) or None. Counts a hit or miss unless count is False (e.g.
+        while polling). `source` is the recording whose content `key` was
+        computed from; it becomes an owner of the entry it finds."""
+        entry = self.store.get_derived(key)
+        if entry is not None:
+            entry["abspath"] = os.path.join(self.root, entry["path"])
+            if not os.path.exists(entry["abspath"]):  # removed behind our back
+                self.store.delete_derived(key)
+                entry = None
+        if entry is not None and source is not None and source not in entry["sources"]:
+            self.store.add_derived_owner(key, source)
+            entry["sources"].append(source)
+        if count:
+            self.store.record_derived_lookup(key, entry is not None, time.time())
+        return entry
+
+    def put(self, key, source, kind, staged_path, ext="", info=None):
+        """Moves staged_path (a file or a directory) into the cache as `key`,
+        then trims the cache to its budget, never evicting the new entry itself
+        (the caller is about to use it, even when it alone exceeds the budget).
+        Returns the new entry."""
+        rel = self._relpath(key, ext)
+        dest = os.path.join(self.root, rel)
+        if os.path.isdir(staged_path) and os.path.isdir(dest):
+            _remove(dest)  # os.replace can't overwrite a non-empty directory
+        os.replace(staged_path, dest)
+        size = _path_size(dest)
+        self.store.save_derived(key, source, kind, rel, size, info, time.time())
+        self.evict(keep=key)
+        return {"key": key, "source": source, "sources": [source], "kind": kind, "path": rel, "size": size,
+                "info": info, "abspath": dest}
+
+    # --- Eviction ---
+    def evict(self, keep=None):
+        evicted = self.store.evict_derived(self.max_bytes, self.policy, keep)
+        for rel, _ in evicted:
+            _remove(os.path.join(self.root, rel))
+        if evicted and self.logger:
+            freed = sum(size for _, size in evicted)
+            self.logger.info(f"🧹 Evicted {len(evicted)} derived file(s) ({freed / 1e6:.1f} MB) from the media cache.")
+        return len(evicted)
+
+    def forget_source(self, source):
+        """Deletes everything derived from the recording `source` that no other
+        recording still owns."""
+        self.discard(self.store.forget_derived_source(source))
+
+    def discard(self, rel_paths):
+        """Removes entry files whose rows are already gone from the store."""
+        for rel in rel_paths:
+            _remove(os.path.join(self.root, rel))
+
+    def stats(self):
+        stats = self.store.derived_stats()
+        lookups = stats.get("hits", 0) + stats.get("misses", 0)
+        stats.update(
+            max_bytes=self.max_bytes,
+            policy=self.policy,
+            hit_rate=round(stats.get("hits", 0) / lookups, 4) if lookups else None,
+        )
+        return stats
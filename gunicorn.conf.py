@@ -0,0 +1,33 @@
+# gunicorn.conf.py
+# Production entry point:  gunicorn -c gunicorn.conf.py app:app
+#
+# The default worker class is gevent: each worker process serves many
+# connections at once as greenlets, so a slow uploader or a long download no
+# longer holds a whole worker. Uploads, file serving, streaming MP4 and the
+# waits on ffmpeg all yield to other requests (see cooperative.py).
+# GUNICORN_WORKER_CLASS=sync switches back to one request per worker (e.g.
+# for debugging, or where gevent isn't installed).
+#
+# Settings (environment):
+#   WEB_CONCURRENCY              worker processes (gunicorn's own variable; default 2)
+#   GUNICORN_WORKER_CLASS        gevent (default) or sync
+#   GUNICORN_WORKER_CONNECTIONS  concurrent connections per gevent worker (default 1000)
+#   GUNICORN_TIMEOUT             seconds before a silent worker is restarted (default 120)
+#   PORT                         listen port (gunicorn binds 0.0.0.0:$PORT by default)
+
+import os
+
+try:
+    import gevent  # noqa: F401
+    _default_worker_class = "gevent"
+except ImportError:
+    _default_worker_class = "sync"
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", _default_worker_class)
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+# The app starts background threads at import (retention, mailer, metrics), so
+# it has to be loaded in each worker, after gevent has patched the process.
+preload_app = False
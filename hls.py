@@ -0,0 +1,117 @@
+# hls.py
+# Packages a recording as HLS (fMP4 segments) for adaptive playback of shared links.
+#
+# One ffmpeg process writes the whole ladder:
+#   v0  the source video, stream-copied when its codec can go into fMP4
+#       (H.264, HEVC, VP9, AV1); VP8 has to be encoded (H.264, same size).
+#   v1+ up to two lower H.264 renditions from HLS_LADDER that are smaller
+#       than the source.
+# Audio is AAC in every rendition (copied when the source already is AAC).
+# Segments are ~HLS_SEGMENT_SECONDS long; encoded renditions get keyframes
+# on segment boundaries, the copy rendition cuts at the source's keyframes.
+#
+# Output layout (relative paths, as referenced by the playlists):
+#   master.m3u8, v<N>/index.m3u8, v<N>/init.mp4, v<N>/seg_<n>.m4s
+
+import os
+
+from media import run_ffmpeg_progress
+
+HLS_SEGMENT_SECONDS = 4
+# (height, video bitrate, audio bitrate), best first. Only rungs below the source are used.
+HLS_LADDER = [(720, "2500k", "128k"), (480, "1000k", "96k"), (360, "600k", "64k")]
+MAX_LOWER_RENDITIONS = 2
+# Source bitrate used when v0 has to be encoded.
+SOURCE_ENCODE_BITRATE = "4000k"
+COPY_VIDEO_CODECS = ("h264", "hevc", "vp9", "av1")
+
+HLS_MIMETYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+}
+
+
+def _kbits(rate):
+    return int(rate.rstrip("k"))
+
+
+def plan_renditions(meta):
+    """Returns the renditions for a file described by `meta` (media.probe_media):
+    [{"copy": bool, "height": int or None, "video_bitrate", "audio_bitrate"}]."""
+    video = (meta or {}).get("video") or {}
+    height = video.get("height")
+    renditions = [{
+        "copy": video.get("codec") in COPY_VIDEO_CODECS,
+        "height": height,
+        "video_bitrate": SOURCE_ENCODE_BITRATE,
+        "audio_bitrate": "128k",
+    }]
+    lower = [rung for rung in HLS_LADDER if height and rung[0] < height][:MAX_LOWER_RENDITIONS]
+    for rung_height, video_bitrate, audio_bitrate in lower:
+        renditions.append({"copy": False, "height": rung_height,
+                           "video_bitrate": video_bitrate, "audio_bitrate": audio_bitrate})
+    return renditions
+
+
+def hls_command(ffmpeg_path, in_path, out_dir, renditions, has_audio=True, audio_codec=None):
+    encoded = [i for i, r in enumerate(renditions) if not r["copy"]]
+    cmd = [ffmpeg_path, "-hide_banner", "-loglevel", "error", "-y", "-i", in_path]
+    if encoded:
+        # Decode once, scale once per encoded rendition.
+        chains = [f"[0:v]split={len(encoded)}" + "".join(f"[s{i}]" for i in encoded)]
+        for i in encoded:
+            height = renditions[i]["height"]
+            scale = f"scale=-2:{height}" if height else "scale=trunc(iw/2)*2:trunc(ih/2)*2"
+            chains.append(f"[s{i}]{scale}[r{i}]")
+        cmd += ["-filter_complex", ";".join(chains)]
+
+    stream_map = []
+    for i, r in enumerate(renditions):
+        cmd += ["-map", "0:v:0" if r["copy"] else f"[r{i}]"]
+        if r["copy"]:
+            cmd += [f"-c:v:{i}", "copy"]
+        else:
+            rate = _kbits(r["video_bitrate"])
+            cmd += [
+                f"-c:v:{i}", "libx264", f"-preset:v:{i}", "veryfast", f"-pix_fmt:v:{i}", "yuv420p",
+                f"-b:v:{i}", r["video_bitrate"], f"-maxrate:v:{i}", f"{int(rate * 1.1)}k",
+                f"-bufsize:v:{i}", f"{rate * 2}k",
+                f"-force_key_frames:v:{i}", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+            ]
+        if has_audio:
+            cmd += ["-map", "0:a:0"]
+            if r["copy"] and audio_codec == "aac":
+                cmd += [f"-c:a:{i}", "copy"]
+            else:
+                cmd += [f"-c:a:{i}", "aac", f"-b:a:{i}", r["audio_bitrate"]]
+            stream_map.append(f"v:{i},a:{i}")
+        else:
+            stream_map.append(f"v:{i}")
+
+    cmd += [
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_type", "fmp4",
+        "-hls_flags", "independent_segments",
+        "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_segment_filename", os.path.join(out_dir, "v%v", "seg_%05d.m4s"),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", " ".join(stream_map),
+        os.path.join(out_dir, "v%v", "index.m3u8"),
+    ]
+    return cmd
+
+
+def package_hls(ffmpeg_path, in_path, out_dir, meta, on_progress=None, timeout=None):
+    """Writes the HLS ladder for in_path into out_dir (which must be empty).
+    Returns the renditions that were packaged."""
+    renditions = plan_renditions(meta)
+    audio = (meta or {}).get("audio")
+    has_audio = audio is not None
+    for i in range(len(renditions)):
+        os.makedirs(os.path.join(out_dir, f"v{i}"), exist_ok=True)
+    cmd = hls_command(ffmpeg_path, in_path, out_dir, renditions, has_audio, (audio or {}).get("codec"))
+    run_ffmpeg_progress(cmd, on_progress, timeout=timeout, op="hls")
+    return renditions
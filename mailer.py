@@ -0,0 +1,204 @@
+# mailer.py
+# Outgoing mail through a persistent outbox instead of sending inside the request.
+#
+# enqueue() writes the message to the mail_outbox table and returns its id
+# right away. A background sender delivers due messages in batches over one
+# SMTP connection (TLS handshake and login happen once, not per message) and
+# keeps that connection open while there is work, closing it after IDLE_CLOSE
+# seconds without any. Only one worker process sends at a time (flock on
+# lock_path), so the app holds a single SMTP session however many gunicorn
+# workers it runs; the others take over if that worker exits.
+#
+# Failed attempts are retried with exponential backoff; permanent SMTP errors
+# (5xx replies, refused recipients) and the last attempt mark the message
+# failed. Claims are leased, so a message whose sender died mid-send goes out
+# again after LEASE_SECONDS.
+#
+# For local testing, point MAIL_SERVER/MAIL_PORT at an SMTP stand-in, e.g.
+#   python -m aiosmtpd -n -l localhost:8025
+# with MAIL_USE_TLS=0 and MAIL_SENDER=you@example.com.
+
+import random
+import smtplib
+import threading
+import time
+import uuid
+
+from flask_mail import BadHeaderError, Message
+
+try:
+    import fcntl
+except ImportError:  # Windows local development: single process anyway.
+    fcntl = None
+
+BATCH_SIZE = 20
+POLL_INTERVAL = 2.0 # Other workers' enqueues are picked up this quickly
+LEASE_SECONDS = 5 * 60
+IDLE_CLOSE = 60 # Close the SMTP connection after this long without mail
+KEEPALIVE_CHECK = 10 # NOOP a connection idle for this long before reusing it
+MAX_ATTEMPTS = 6
+RETRY_BASE = 30 # Seconds before the first retry; doubles per attempt
+RETRY_MAX = 30 * 60
+KEEP_SECONDS = 7 * 24 * 60 * 60 # Sent/failed messages stay queryable this long
+PRUNE_INTERVAL = 60 * 60
+
+
+def retry_delay(attempts):
+    """Backoff after `attempts` failed attempts, with some jitter."""
+    delay = min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX)
+    return delay * random.uniform(0.9, 1.1)
+
+
+def is_permanent(error):
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, BadHeaderError, AssertionError)):
+        return True
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False  # Configuration problem; may be fixed before the retries run out
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+class Mailer:
+    """Queues messages in the store and delivers them from a background thread."""
+
+    def __init__(self, app, mail, store, lock_path, logger=None, observe=None):
+        self.app = app
+        self.mail = mail
+        self.store = store
+        self.lock_path = lock_path
+        self.logger = logger
+        # observe(result) is called per attempt: "sent", "retry" or "failed".
+        self.observe = observe
+        self._conn = None
+        self._last_used = 0.0
+        self._last_prune = 0.0
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = None
+
+    # --- Queue ---
+    def enqueue(self, subject, recipients, body, html=None, sender=None, reply_to=None):
+        """Stores the message for delivery and returns its id."""
+        mail_id = uuid.uuid4().hex
+        message = {"subject": subject, "recipients": list(recipients), "body": body,
+                   "html": html, "sender": sender, "reply_to": reply_to}
+        self.store.enqueue_mail(mail_id, message, time.time())
+        self._wake.set()
+        return mail_id
+
+    def status(self, mail_id):
+        return self.store.get_mail(mail_id)
+
+    # --- SMTP connection ---
+    def _connection(self):
+        if self._conn is not None and time.monotonic() - self._last_used > KEEPALIVE_CHECK:
+            try:
+                if self._conn.host is not None:
+                    self._conn.host.noop()
+            except (smtplib.SMTPException, OSError):
+                self._close()
+        if self._conn is None:
+            conn = self.mail.connect()
+            conn.__enter__()  # TLS handshake + login
+            self._conn = conn
+        return self._conn
+
+    def _close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None and conn.host is not None:
+            try:
+                conn.host.quit()
+            except (smtplib.SMTPException, OSError):
+                conn.host.close()
+
+    def _send(self, message):
+        msg = Message(
+            subject=message["subject"],
+            recipients=message["recipients"],
+            body=message["body"],
+            html=message.get("html"),
+            sender=tuple(message["sender"]) if isinstance(message.get("sender"), list) else message.get("sender"),
+            reply_to=message.get("reply_to"),
+        )
+        reused = self._conn is not None
+        try:
+            self._connection().send(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self._close()
+            if not reused:
+                raise
+            self._connection().send(msg)  # The server dropped an idle connection; retry once on a new one
+        self._last_used = time.monotonic()
+
+    # --- Delivery ---
+    def _record(self, result):
+        if self.observe:
+            self.observe(result)
+
+    def deliver_due(self, now=None):
+        """Sends one batch of due messages. Returns how many were attempted.
+        Must run inside an app context."""
+        batch = self.store.claim_mail(now or time.time(), BATCH_SIZE, LEASE_SECONDS)
+        for mail_id, message, attempts in batch:
+            try:
+                self._send(message)
+            except Exception as e:
+                if isinstance(e, (smtplib.SMTPException, OSError)) and not isinstance(
+                        e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+                    self._close()  # Connection state unknown
+                attempts += 1
+                error = f"{type(e).__name__}: {e}"
+                if is_permanent(e) or attempts >= MAX_ATTEMPTS:
+                    self.store.mail_attempt_failed(mail_id, error)
+                    self._record("failed")
+                    if self.logger:
+                        self.logger.error(f"❌ Giving up on mail {mail_id} after {attempts} attempt(s): {error}")
+                else:
+                    self.store.mail_attempt_failed(mail_id, error, time.time() + retry_delay(attempts))
+                    self._record("retry")
+                    if self.logger:
+                        self.logger.warning(f"Mail {mail_id} attempt {attempts} failed, will retry: {error}")
+                continue
+            self.store.mail_sent(mail_id, time.time())
+            self._record("sent")
+        return len(batch)
+
+    # --- Background sender ---
+    def _lead(self):
+        """Blocks until this process is the one that sends (holds the flock)."""
+        if fcntl is None:
+            return
+        lock = open(self.lock_path, "a")
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._lock = lock  # Held for the life of the process
+                return
+            except OSError:
+                time.sleep(POLL_INTERVAL)
+
+    def _loop(self):
+        self._lead()
+        with self.app.app_context():
+            while True:
+                try:
+                    if self.deliver_due():
+                        continue  # More may be due right away
+                    now = time.time()
+                    if now - self._last_prune > PRUNE_INTERVAL:
+                        self._last_prune = now
+                        self.store.prune_mail(now - KEEP_SECONDS)
+                    due = self.store.next_mail_due()
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"Mail sender error: {e}")
+                    due = None
+                if self._conn is not None and time.monotonic() - self._last_used > IDLE_CLOSE:
+                    self._close()
+                timeout = POLL_INTERVAL if due is None else min(max(due - time.time(), 0), POLL_INTERVAL)
+                self._wake.wait(timeout)
+                self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="mailer", daemon=True)
+            self._thread.start()
@@ -0,0 +1,247 @@
+# media.py
+# Small helpers around the ffmpeg / ffprobe command line tools.
+#
+# Every ffmpeg/ffprobe process is started through this module, which reaps it
+# with wait4() so its CPU time and peak RSS are known, and reports them to the
+# observer installed with set_process_observer() (see metrics.py). Under the
+# gevent worker the wait is cooperative instead and the usage is sampled from
+# /proc while the process runs (gevent reaps children itself); see cooperative.py.
+
+import json
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from cooperative import wait_child
+
+_observer = None
+
+
+def set_process_observer(observer):
+    """observer(op, wall_seconds, cpu_user, cpu_system, max_rss_bytes, returncode)
+    is called after every process run through this module."""
+    global _observer
+    _observer = observer
+
+
+def _wait(proc, op, started):
+    """proc.wait(), but also collects the child's resource usage (see wait_child)."""
+    rusage = wait_child(proc)
+    if _observer:
+        wall = time.monotonic() - started
+        if rusage is not None:
+            # ru_maxrss is in kilobytes on Linux, bytes on macOS.
+            rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+            _observer(op, wall, rusage.ru_utime, rusage.ru_stime, rss, proc.returncode)
+        else:
+            _observer(op, wall, None, None, None, proc.returncode)
+
+
+def _start_timeout(proc, timeout):
+    """Kills proc after `timeout` seconds. Returns (timer, timed_out event)."""
+    timed_out = threading.Event()
+
+    def _kill_on_timeout():
+        timed_out.set()
+        proc.kill()
+
+    timer = threading.Timer(timeout, _kill_on_timeout) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    return timer, timed_out
+
+
+def run_process(cmd, timeout=None, op="ffmpeg"):
+    """Like subprocess.run(cmd, check=True, capture_output=True, text=True,
+    timeout=timeout), with the process accounted under `op`. Output goes
+    through temp files, so a chatty process can never fill a pipe and stall."""
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        started = time.monotonic()
+        proc = subprocess.Popen(cmd, stdout=out, stderr=err)
+        timer, timed_out = _start_timeout(proc, timeout)
+        try:
+            _wait(proc, op, started)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+        out.seek(0)
+        err.seek(0)
+        stdout = out.read().decode(errors="replace")
+        stderr = err.read().decode(errors="replace")
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout, output=stdout, stderr=stderr)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=stdout, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+class FFmpegError(Exception):
+    """ffmpeg exited with a non-zero status. `stderr` holds its error output."""
+
+    def __init__(self, returncode, stderr):
+        super().__init__(f"ffmpeg exited with code {returncode}: {stderr}")
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+def _fraction(value):
+    """'30000/1001' -> 29.97; None for missing or 0/0 rates."""
+    try:
+        num, _, den = str(value).partition("/")
+        num, den = float(num), float(den or 1)
+        return round(num / den, 3) if num and den else None
+    except ValueError:
+        return None
+
+
+def _number(value, cast=float):
+    try:
+        return cast(value) if value not in (None, "N/A") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def probe_media(ffprobe_path, path):
+    """Runs ffprobe once and returns a compact description of the file:
+    duration, container, bit rate and the first video/audio stream."""
+    cmd = [
+        ffprobe_path, "-v", "error",
+        "-show_format", "-show_streams",
+        "-of", "json", path,
+    ]
+    result = run_process(cmd, timeout=60, op="probe")
+    info = json.loads(result.stdout)
+    fmt = info.get("format", {})
+    meta = {
+        "duration": _number(fmt.get("duration")),
+        "format": fmt.get("format_name"),
+        "bit_rate": _number(fmt.get("bit_rate"), int),
+        "video": None,
+        "audio": None,
+    }
+    for stream in info.get("streams", []):
+        kind = stream.get("codec_type")
+        if kind == "video" and meta["video"] is None:
+            meta["video"] = {
+                "codec": stream.get("codec_name"),
+                "width": stream.get("width"),
+                "height": stream.get("height"),
+                "fps": _fraction(stream.get("avg_frame_rate")) or _fraction(stream.get("r_frame_rate")),
+                "pix_fmt": stream.get("pix_fmt"),
+            }
+        elif kind == "audio" and meta["audio"] is None:
+            meta["audio"] = {
+                "codec": stream.get("codec_name"),
+                "sample_rate": _number(stream.get("sample_rate"), int),
+                "channels": stream.get("channels"),
+            }
+    if meta["duration"] is None:
+        # Some containers only carry per-stream durations.
+        durations = [_number(s.get("duration")) for s in info.get("streams", [])]
+        durations = [d for d in durations if d]
+        meta["duration"] = max(durations) if durations else None
+    return meta
+
+
+def remux_with_cues(ffmpeg_path, in_path, out_path):
+    """Stream-copies in_path into a new WebM at out_path. The muxer writes the
+    Duration and a Cues (seek index) element, which MediaRecorder output lacks;
+    -cues_to_front puts the Cues before the clusters so players can seek
+    without reading to the end of the file. No re-encoding happens."""
+    cmd = [
+        ffmpeg_path, "-hide_banner", "-loglevel", "error",
+        "-i", in_path, "-map", "0", "-c", "copy",
+        "-cues_to_front", "1", "-f", "webm", "-y", out_path,
+    ]
+    run_process(cmd, timeout=30 * 60, op="remux")
+
+
+def run_ffmpeg_progress(cmd, on_progress=None, timeout=None, op="ffmpeg"):
+    """Runs an ffmpeg command with `-progress pipe:1` added to its global
+    options and calls on_progress(dict) for every progress block ffmpeg
+    reports. Raises FFmpegError on failure and subprocess.TimeoutExpired if
+    the process runs longer than `timeout` seconds."""
+    cmd = [cmd[0], "-nostats", "-progress", "pipe:1"] + list(cmd[1:])
+    # stderr goes to a temp file so a chatty ffmpeg can never fill a pipe and stall.
+    with tempfile.TemporaryFile(mode="w+") as err:
+        started = time.monotonic()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err, text=True)
+        timer, timed_out = _start_timeout(proc, timeout)
+        block = {}
+        try:
+            for line in proc.stdout:
+                key, sep, value = line.strip().partition("=")
+                if not sep:
+                    continue
+                block[key] = value
+                if key == "progress":
+                    if on_progress:
+                        on_progress(block)
+                    block = {}
+            _wait(proc, op, started)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+        err.seek(0)
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout, stderr=err.read()[-4000:])
+        if proc.returncode != 0:
+            raise FFmpegError(proc.returncode, err.read()[-4000:])
+
+
+def pipe_ffmpeg_to_file(cmd, path, on_chunk=None, timeout=None, chunk_size=64 * 1024, op="ffmpeg"):
+    """Runs an ffmpeg command that writes to pipe:1 and appends everything it
+    produces to `path`, flushing each chunk so readers tailing the file see it
+    immediately. on_chunk(total_bytes) is called after every write. Raises
+    FFmpegError on failure and subprocess.TimeoutExpired after `timeout` seconds."""
+    with tempfile.TemporaryFile(mode="w+") as err, open(path, "wb", buffering=0) as out:
+        started = time.monotonic()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err)
+        timer, timed_out = _start_timeout(proc, timeout)
+        total = 0
+        try:
+            while True:
+                chunk = proc.stdout.read1(chunk_size)
+                if not chunk:
+                    break
+                out.write(chunk)
+                total += len(chunk)
+                if on_chunk:
+                    on_chunk(total)
+            _wait(proc, op, started)
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+        err.seek(0)
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout, stderr=err.read()[-4000:])
+        if proc.returncode != 0:
+            raise FFmpegError(proc.returncode, err.read()[-4000:])
+        return total
+
+
+def progress_seconds(block):
+    """Output position in seconds from an ffmpeg -progress block, or None."""
+    for key in ("out_time_us", "out_time_ms"):  # both are microseconds in ffmpeg
+        value = block.get(key)
+        if value and value != "N/A":
+            try:
+                return max(0.0, int(value) / 1_000_000)
+            except ValueError:
+                pass
+    return None
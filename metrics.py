@@ -0,0 +1,256 @@
+# metrics.py
+# Minimal Prometheus instrumentation that aggregates across gunicorn workers.
+#
+# Each process keeps its counters, histograms and gauges in memory and a
+# background thread writes them to <state_dir>/<pid>.json about once a second.
+# A scrape of /metrics (answered by any worker) merges the snapshots of all
+# live workers. Counters and histograms of workers that have exited are folded
+# into an archive file, so totals never go backwards when a worker restarts.
+#
+# Values that are cheap to compute on demand (disk usage, cache counters kept
+# in the database) come from collectors that run at scrape time.
+
+import json
+import math
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows local development: single process anyway.
+    fcntl = None
+
+FLUSH_INTERVAL = 1.0
+# A snapshot not rewritten for this long belongs to a dead worker.
+STALE_SNAPSHOT_SECONDS = 5 * 60
+ARCHIVE_FILE = "archive.json"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROCESS_SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+RSS_BUCKETS = tuple(2 ** n for n in range(24, 32))  # 16 MiB .. 2 GiB
+THROUGHPUT_BUCKETS = (1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8, 5e8)
+DB_SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _key(name, labels):
+    return json.dumps([name, sorted(labels.items())])
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metrics:
+    """Counters, histograms and gauges shared by all worker processes."""
+
+    def __init__(self, state_dir):
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self._defs = {}  # name -> {"type", "help", "buckets"}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._values = {"counter": {}, "histogram": {}, "gauge": {}}
+        self._flusher = None
+
+    # --- Definitions ---
+    def counter(self, name, help):
+        self._defs[name] = {"type": "counter", "help": help}
+
+    def gauge(self, name, help):
+        self._defs[name] = {"type": "gauge", "help": help}
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self._defs[name] = {"type": "histogram", "help": help, "buckets": list(buckets)}
+
+    def collector(self, fn):
+        """fn() returns [(name, type, help, [(labels dict, value), ...])], computed at scrape time."""
+        self._collectors.append(fn)
+        return fn
+
+    # --- Recording ---
+    def _series(self, kind):
+        if os.getpid() != self._pid:  # forked: don't report the parent's numbers as ours
+            self._reset()
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics", daemon=True)
+            self._flusher.start()
+        return self._values[kind]
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            series = self._series("counter")
+            key = _key(name, labels)
+            series[key] = series.get(key, 0) + value
+
+    def add(self, name, delta, **labels):
+        """Moves a gauge (e.g. requests in flight) by delta."""
+        with self._lock:
+            series = self._series("gauge")
+            key = _key(name, labels)
+            series[key] = series.get(key, 0) + delta
+
+    def observe(self, name, value, **labels):
+        buckets = self._defs[name]["buckets"]
+        with self._lock:
+            series = self._series("histogram")
+            key = _key(name, labels)
+            h = series.get(key)
+            if h is None:
+                # One count per bucket (non-cumulative) plus +Inf, then sum.
+                h = series[key] = [0] * (len(buckets) + 1) + [0.0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[i] += 1
+                    break
+            else:
+                h[len(buckets)] += 1
+            h[-1] += value
+
+    # --- Snapshots ---
+    def _snapshot_path(self, pid):
+        return os.path.join(self.state_dir, f"{pid}.json")
+
+    def flush(self):
+        with self._lock:
+            if os.getpid() != self._pid:
+                return
+            data = json.dumps({"updated": time.time(), **self._values})
+        path = self._snapshot_path(self._pid)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _merge(into, snapshot, kinds):
+        for kind in kinds:
+            target = into.setdefault(kind, {})
+            for key, value in snapshot.get(kind, {}).items():
+                if kind == "histogram":
+                    current = target.get(key)
+                    target[key] = value[:] if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    target[key] = target.get(key, 0) + value
+
+    def _read(self, path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def collect(self):
+        """Merged values of all workers, past and present."""
+        self.flush()
+        merged = {}
+        lock = open(os.path.join(self.state_dir, "archive.lock"), "a")
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = os.path.join(self.state_dir, ARCHIVE_FILE)
+            archive = self._read(archive_path) or {}
+            archived = False
+            for entry in os.scandir(self.state_dir):
+                stem, ext = os.path.splitext(entry.name)
+                if ext != ".json" or not stem.isdigit():
+                    continue
+                snapshot = self._read(entry.path)
+                if snapshot is None:
+                    continue
+                pid = int(stem)
+                dead = pid != os.getpid() and (
+                    not _pid_alive(pid) or time.time() - snapshot.get("updated", 0) > STALE_SNAPSHOT_SECONDS
+                )
+                if dead:
+                    # Keep its totals; gauges (e.g. in-flight) died with it.
+                    self._merge(archive, snapshot, ("counter", "histogram"))
+                    os.remove(entry.path)
+                    archived = True
+                else:
+                    self._merge(merged, snapshot, ("counter", "histogram", "gauge"))
+            if archived:
+                tmp = archive_path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(archive, f)
+                os.replace(tmp, archive_path)
+            self._merge(merged, archive, ("counter", "histogram"))
+        finally:
+            lock.close()
+        return merged
+
+    # --- Exposition ---
+    def render(self):
+        """All metrics in the Prometheus text format (version 0.0.4)."""
+        merged = self.collect()
+        by_name = {}
+        for kind in ("counter", "gauge", "histogram"):
+            for key, value in merged.get(kind, {}).items():
+                name, labels = json.loads(key)
+                by_name.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, definition in self._defs.items():
+            lines.append(f"# HELP {name} {definition['help']}")
+            lines.append(f"# TYPE {name} {definition['type']}")
+            for labels, value in sorted(by_name.get(name, []), key=lambda s: s[0]):
+                if definition["type"] != "histogram":
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                bounds = definition["buckets"] + [math.inf]
+                for bound, count in zip(bounds, value[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value[-1])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+        for fn in self._collectors:
+            try:
+                families = fn()
+            except Exception:
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,82 @@
+# planner.py
+# Picks the cheapest correct way to turn a recording into an MP4.
+#
+# A full libx264 encode is only needed when the source video codec can't go
+# into an MP4 for the requested target. In order of cost:
+#
+#   remux      - both streams are copied; pure I/O.
+#   audio      - video is copied, only the audio is transcoded.
+#   transcode  - video (and audio) are re-encoded.
+#
+# Targets ("profiles") say which codecs may be copied as-is. "compatibility"
+# is for files that must open everywhere (QuickTime, iOS, older Android/
+# Windows players); "fast" accepts what current browsers play from MP4.
+# The table can be extended or overridden with a JSON file (MP4_PROFILES_FILE).
+
+import copy
+import json
+import os
+
+DEFAULT_PROFILE = "compatibility"
+
+MP4_PROFILES = {
+    "compatibility": {
+        "video_copy": ["h264"],
+        "audio_copy": ["aac", "mp3"],
+        "video_encode": ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "28", "-pix_fmt", "yuv420p"],
+        "audio_encode": ["-c:a", "aac", "-b:a", "64k"],
+        "max_fps": 30,
+    },
+    "fast": {
+        "video_copy": ["h264", "hevc", "vp9", "av1"],
+        "audio_copy": ["aac", "mp3", "opus", "flac"],
+        "video_encode": ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "28", "-pix_fmt", "yuv420p"],
+        "audio_encode": ["-c:a", "aac", "-b:a", "64k"],
+        "max_fps": 30,
+    },
+}
+
+
+def load_profiles(path=None):
+    """Returns the profile table, with entries from the JSON file at `path`
+    (if any) merged over the built-in ones."""
+    profiles = copy.deepcopy(MP4_PROFILES)
+    if path and os.path.exists(path):
+        with open(path, "r") as f:
+            for name, overrides in json.load(f).items():
+                profiles.setdefault(name, copy.deepcopy(MP4_PROFILES[DEFAULT_PROFILE])).update(overrides)
+    return profiles
+
+
+def plan_mp4(meta, profile):
+    """Returns {"strategy", "args"} for converting a file described by `meta`
+    (see media.probe_media) under `profile`. `args` are the ffmpeg output
+    options between the input and the output file."""
+    meta = meta or {}
+    video = meta.get("video")
+    audio = meta.get("audio")
+    maps = ["-map", "0:v:0?", "-map", "0:a:0?"]
+
+    video_ok = video is None or video.get("codec") in profile["video_copy"]
+    audio_ok = audio is None or audio.get("codec") in profile["audio_copy"]
+    audio_args = ["-c:a", "copy"] if audio_ok else list(profile["audio_encode"])
+    if audio is None and meta:
+        audio_args = ["-an"]
+
+    if meta and video_ok:
+        strategy = "remux" if audio_ok else "audio"
+        # +faststart moves the index to the front so the file starts playing before it's fully downloaded.
+        return {"strategy": strategy, "args": maps + ["-c:v", "copy"] + audio_args + ["-movflags", "+faststart"]}
+
+    # Full transcode. Without metadata we can't know the streams: encode both.
+    video_args = []
+    fps = (video or {}).get("fps")
+    max_fps = profile.get("max_fps")
+    if max_fps and (not fps or fps > max_fps):
+        video_args += ["-r", str(max_fps)]  # MediaRecorder often reports 1000 fps (its timebase)
+    if ((video or {}).get("width") or 0) % 2 or ((video or {}).get("height") or 0) % 2:
+        video_args += ["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"]  # 4:2:0 needs even dimensions
+    video_args += list(profile["video_encode"])
+    if not meta:
+        audio_args = list(profile["audio_encode"])
+    return {"strategy": "transcode", "args": maps + video_args + audio_args + ["-movflags", "+faststart"]}
@@ -0,0 +1,165 @@
+# retention.py
+# Deletes recordings once they expire or when they no longer fit the disk quota.
+#
+# Instead of scanning RECDIR and comparing mtimes, every recording is entered
+# in an expiry index in the store when it's created (expires_at is indexed),
+# so a sweep only reads the rows that are due. Deleting a recording drops its
+# session entry, public links, cached media info and derived-cache entries in
+# the same transaction, so nothing dangling is left behind.
+#
+# A sweep also expires abandoned chunked uploads, old job state files and the
+# legacy mp4_converted directory. It runs either in-process (one worker at a
+# time, see start()) or from cron through cleanup.py.
+
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows local development: no cross-process lock.
+    fcntl = None
+
+# Recordings deleted per transaction; a backlog is worked off in several batches.
+SWEEP_BATCH = 200
+BACKFILL_FLAG = "retention_backfill"
+
+
+class Retention:
+    """Expiry-indexed retention for the recordings in RECDIR."""
+
+    def __init__(self, recdir, store, max_age, quota_bytes=0, derived_cache=None,
+                 uploads=None, jobs=None, legacy_dirs=(), logger=None):
+        self.recdir = recdir
+        self.store = store
+        self.max_age = max_age
+        self.quota_bytes = quota_bytes
+        self.derived_cache = derived_cache
+        self.uploads = uploads
+        self.jobs = jobs
+        self.legacy_dirs = legacy_dirs
+        self.logger = logger
+        self.lock_path = os.path.join(recdir, ".retention.lock")
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.info(message)
+
+    # --- Index ---
+    def track(self, fname, created=None):
+        """Enters (or refreshes the size of) a recording in the expiry index."""
+        try:
+            st = os.stat(os.path.join(self.recdir, fname))
+        except OSError:
+            return
+        created = created if created is not None else st.st_mtime
+        self.store.track_expiry(fname, st.st_size, created + self.max_age)
+
+    def track_many(self, fnames, created):
+        """track() for several new recordings, in one write."""
+        rows = []
+        for fname in fnames:
+            try:
+                rows.append((fname, os.path.getsize(os.path.join(self.recdir, fname)), created + self.max_age))
+            except OSError:
+                continue
+        if rows:
+            self.store.track_expiries(rows)
+
+    def backfill(self):
+        """One-time import of recordings that predate the index (expiry = mtime + max_age)."""
+        if self.store.has_flag(BACKFILL_FLAG):
+            return 0
+        tracked = self.store.tracked_recordings()
+        added = 0
+        for entry in os.scandir(self.recdir):
+            if entry.is_file() and entry.name.endswith(".webm") and entry.name not in tracked:
+                self.track(entry.name)
+                added += 1
+        self.store.set_flag(BACKFILL_FLAG)
+        self._log(f"Retention index backfilled with {added} existing recording(s).")
+        return added
+
+    # --- Sweeping ---
+    def _delete(self, fnames):
+        for fname in fnames:
+            try:
+                os.remove(os.path.join(self.recdir, fname))
+            except FileNotFoundError:
+                pass  # already gone; still drop its references
+        derived_paths = self.store.expire_recordings(fnames)
+        if self.derived_cache:
+            self.derived_cache.discard(derived_paths)
+
+    def sweep(self, now=None):
+        """Deletes due and over-quota recordings and prunes leftovers.
+        Returns counts of what was removed."""
+        now = now if now is not None else time.time()
+        counts = {"expired": 0, "over_quota": 0, "uploads": 0, "jobs": 0, "legacy": 0}
+        while batch := self.store.due_recordings(now, SWEEP_BATCH):
+            self._delete(batch)
+            counts["expired"] += len(batch)
+        if self.quota_bytes:
+            while batch := self.store.over_quota_recordings(self.quota_bytes, SWEEP_BATCH):
+                self._delete(batch)
+                counts["over_quota"] += len(batch)
+        if self.uploads:
+            counts["uploads"] = self.uploads.expire()
+        if self.jobs:
+            counts["jobs"] = self.jobs.prune(self.max_age)
+        for directory in self.legacy_dirs:
+            counts["legacy"] += _remove_older_than(directory, now - self.max_age)
+        if any(counts.values()):
+            self._log(f"🧹 Retention sweep: {counts}")
+        return counts
+
+    # --- In-process scheduling ---
+    def run_if_due(self, interval):
+        """Sweeps unless another worker holds the lock or swept less than
+        `interval` seconds ago. Returns the counts, or None if skipped."""
+        with open(self.lock_path, "a") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None
+            # The lock file's mtime records the last sweep across all workers.
+            if time.time() - os.path.getmtime(self.lock_path) < interval and os.path.getsize(self.lock_path):
+                return None
+            self.backfill()
+            counts = self.sweep()
+            lock.seek(0)
+            lock.truncate()
+            lock.write(str(time.time()))
+            lock.flush()
+            return counts
+
+    def start(self, interval):
+        """Runs run_if_due every `interval` seconds on a daemon thread."""
+        def loop():
+            while True:
+                try:
+                    self.run_if_due(interval)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"Retention sweep failed: {e}")
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name="retention", daemon=True)
+        thread.start()
+        return thread
+
+
+def _remove_older_than(directory, cutoff):
+    """Deletes the files in directory last modified before cutoff."""
+    removed = 0
+    if not os.path.isdir(directory):
+        return removed
+    for entry in os.scandir(directory):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,185 @@
+# serving.py
+# Media-serving layer for recordings and derived files.
+#
+# - Strong ETags built from the file's identity (inode, size, mtime), plus
+#   Last-Modified; If-None-Match / If-Modified-Since answer 304 and If-Range
+#   is honoured.
+# - Single and multiple byte ranges (multipart/byteranges), so scrubbing in
+#   the player only pulls the bytes it needs.
+# - Cache-Control per kind of URL. Recordings are never rewritten in place
+#   (timestamp names; remuxes replace the file and so change the ETag), so
+#   they can be cached for a long time.
+# - Optional offload: with MEDIA_OFFLOAD=nginx the response only carries an
+#   X-Accel-Redirect header and nginx sends the bytes; MEDIA_OFFLOAD=sendfile
+#   does the same with X-Sendfile (Apache / lighttpd). Flask still does all
+#   authorization and conditional checks.
+
+import mimetypes
+import os
+import uuid
+
+from flask import Response, abort, request
+from werkzeug.http import http_date, parse_date, quote_etag
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+MEDIA_OFFLOAD = os.getenv("MEDIA_OFFLOAD", "").lower()  # "", "nginx" or "sendfile"
+# nginx `internal` location aliased to the media root (RECDIR), e.g.
+#   location /_media/ { internal; alias /var/data/recordings/; }
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/_media/")
+
+CACHE_POLICIES = {
+    # Timestamp-named recordings: content at a URL never changes.
+    "immutable": "public, max-age=31536000, immutable",
+    # Public links can be revoked, so shared caches must revalidate now and then.
+    "public": "public, max-age=3600, must-revalidate",
+    # Short-lived signed links.
+    "private": "private, max-age=900",
+    # Derived files that may be regenerated: always revalidate (cheap with ETags).
+    "revalidate": "private, no-cache",
+}
+
+READ_BLOCK_SIZE = 256 * 1024
+# More ranges than this in one request are answered with the whole file.
+MAX_RANGES = 16
+
+
+def file_etag(st):
+    return f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"
+
+
+def _not_modified(etag, mtime):
+    """True if the request's validators show the client already has this version."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since:
+        return int(mtime) <= request.if_modified_since.timestamp()
+    return False
+
+
+def _if_range_ok(etag, mtime):
+    """False if an If-Range precondition fails, i.e. the whole file must be sent."""
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == quote_etag(etag)
+    date = parse_date(if_range)
+    return date is not None and int(mtime) <= date.timestamp()
+
+
+def _byte_ranges(size):
+    """Parses the Range header into sorted, merged (start, end_exclusive) pairs.
+    Returns None to send the full file, [] if nothing is satisfiable."""
+    rng = request.range
+    if rng is None or rng.units != "bytes" or len(rng.ranges) > MAX_RANGES:
+        return None
+    spans = []
+    for start, stop in rng.ranges:
+        if start < 0:  # suffix range: last -start bytes
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            spans.append((start, stop))
+    spans.sort()
+    merged = []
+    for start, stop in spans:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _read_span(path, start, stop):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            block = f.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def _offload_headers(path, root):
+    if MEDIA_OFFLOAD == "nginx":
+        rel = os.path.relpath(path, root).replace(os.sep, "/")
+        return {"X-Accel-Redirect": MEDIA_ACCEL_PREFIX.rstrip("/") + "/" + rel}
+    if MEDIA_OFFLOAD == "sendfile":
+        return {"X-Sendfile": path}
+    return None
+
+
+def send_media(directory, fname, mimetype=None, as_attachment=False, cache="immutable",
+               download_name=None, accel_root=None):
+    """Serves directory/fname with ranges, validators and cache headers.
+    accel_root is the directory MEDIA_ACCEL_PREFIX maps to (defaults to directory)."""
+    path = safe_join(directory, fname)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    st = os.stat(path)
+    size, mtime = st.st_size, st.st_mtime
+    etag = file_etag(st)
+    mimetype = mimetype or mimetypes.guess_type(fname)[0] or "application/octet-stream"
+
+    headers = {
+        "ETag": quote_etag(etag),
+        "Last-Modified": http_date(mtime),
+        "Cache-Control": CACHE_POLICIES[cache],
+        "Accept-Ranges": "bytes",
+    }
+    if as_attachment:
+        headers["Content-Disposition"] = f'attachment; filename="{download_name or os.path.basename(fname)}"'
+
+    if _not_modified(etag, mtime):
+        return Response(status=304, headers=headers)
+
+    offload = _offload_headers(path, accel_root or directory)
+    if offload:
+        # The front proxy handles Range itself and streams from disk.
+        headers.update(offload)
+        return Response(status=200, headers=headers, mimetype=mimetype)
+
+    ranges = _byte_ranges(size) if _if_range_ok(etag, mtime) else None
+    if ranges == []:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status=416, headers=headers)
+
+    if not ranges:
+        # Whole file: wrap_file lets the WSGI server use sendfile().
+        rv = Response(wrap_file(request.environ, open(path, "rb")), status=200,
+                      headers=headers, mimetype=mimetype, direct_passthrough=True)
+        rv.content_length = size
+        return rv
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        rv = Response(_read_span(path, start, stop), status=206, headers=headers,
+                      mimetype=mimetype, direct_passthrough=True)
+        rv.content_length = stop - start
+        return rv
+
+    # Several ranges: multipart/byteranges body.
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+         f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode()
+        for start, stop in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode()
+    length = sum(len(h) for h in part_headers) + sum(stop - start for start, stop in ranges) + len(closing)
+
+    def body():
+        for head, (start, stop) in zip(part_headers, ranges):
+            yield head
+            yield from _read_span(path, start, stop)
+        yield closing
+
+    rv = Response(body(), status=206, headers=headers,
+                  content_type=f"multipart/byteranges; boundary={boundary}", direct_passthrough=True)
+    rv.content_length = length
+    return rv
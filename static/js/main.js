@@ -25,6 +25,7 @@ document.addEventListener("DOMContentLoaded", () => {
   const actionsPanel = $("#actionsPanel"), clipPanel = $("#clipPanel"), filesPanel = $("#filesPanel");
   const mediaGrid = $("#mediaGrid"), sessionBtn = $("#sessionBtn"), forgetBtn = $("#forgetBtn");
   const trimSliderEl = $("#trim-slider"), trimStartTime = $("#trim-start-time"), trimEndTime = $("#trim-end-time");
+  const trimPreview = $("#trimPreview");
   const deleteModal = $("#deleteModal"), fileToDeleteEl = $("#fileToDelete"), deleteConfirmBtn = $("#deleteConfirm"), deleteCancelBtn = $("#deleteCancel");
   const emailModal = $("#emailModal"), forgetSessionModal = $("#forgetSessionModal");
 
@@ -85,24 +86,52 @@ document.addEventListener("DOMContentLoaded", () => {
     return `${String(min).padStart(2, '0')}:${String(sec).padStart(2, '0')}`;
   };
 
-  const addFileToGrid = (filename) => {
+  const formatSize = (bytes) => {
+    if (bytes == null) return "";
+    return bytes >= 1e9 ? `${(bytes / 1e9).toFixed(1)} GB` : `${(bytes / 1e6).toFixed(1)} MB`;
+  };
+
+  // info: an entry from /session/list (thumbnail, duration, size); absent for fresh recordings.
+  const addFileToGrid = (filename, info = {}, append = false) => {
     if ($(`.media-card[data-filename="${filename}"]`)) return;
     const card = document.createElement("div");
     card.className = "media-card";
     card.dataset.filename = filename;
-    card.innerHTML = `<video src="${fullUrl(filename)}#t=0.1" preload="metadata"></video><p>${filename.substring(10)}</p>`;
-    mediaGrid.prepend(card);
+    const media = info.thumbnail_url
+      ? `<img src="${info.thumbnail_url}" alt="" loading="lazy">`
+      : `<video src="${fullUrl(filename)}#t=0.1" preload="metadata"></video>`;
+    const details = [info.duration != null ? formatTime(info.duration) : "", formatSize(info.size)].filter(Boolean).join(" · ");
+    card.innerHTML = `${media}<p>${filename.substring(10)}</p>${details ? `<small>${details}</small>` : ""}`;
+    append ? mediaGrid.append(card) : mediaGrid.prepend(card);
     card.addEventListener("click", () => activateFile(filename));
   };
   
-  const renderFiles = (files = []) => {
-    mediaGrid.innerHTML = "";
-    const hasFiles = files.length > 0;
-    if (hasFiles) files.forEach(addFileToGrid);
+  const renderFiles = (files = [], append = false) => {
+    if (!append) mediaGrid.innerHTML = "";
+    files.forEach(f => addFileToGrid(f.filename, f, true));
+    const hasFiles = mediaGrid.children.length > 0;
     sessionBtn.classList.toggle("hidden", !hasFiles);
     forgetBtn.classList.toggle("hidden", !hasFiles);
     filesPanel.classList.toggle("hidden", !hasFiles);
   };
+
+  // Gallery: newest first, a page at a time (the server answers 304 when nothing changed).
+  let galleryCursor = null;
+  const loadMoreBtn = document.createElement("button");
+  loadMoreBtn.className = "btn hidden";
+  loadMoreBtn.id = "loadMoreBtn";
+  loadMoreBtn.innerHTML = `<i class="fa-solid fa-angles-down"></i> Load more`;
+  mediaGrid.after(loadMoreBtn);
+
+  const loadGallery = async (cursor = null) => {
+    const params = new URLSearchParams({ limit: 50 });
+    if (cursor) params.set("cursor", cursor);
+    const { files = [], next_cursor = null } = await apiFetch(`/session/list?${params}`).then(r => r.json());
+    renderFiles(files, Boolean(cursor));
+    galleryCursor = next_cursor;
+    loadMoreBtn.classList.toggle("hidden", !galleryCursor);
+  };
+  loadMoreBtn.addEventListener("click", () => loadGallery(galleryCursor).catch(() => {}));
   
   const activateFile = (filename) => {
     if (!filename) {
@@ -118,6 +147,7 @@ document.addEventListener("DOMContentLoaded", () => {
     actionsPanel.innerHTML = `
       <a href="/download/${filename}" class="btn" data-action="download-webm" download><i class="fa-solid fa-download"></i> Download WEBM</a>
       <button class="btn" data-action="download-mp4"><i class="fa-solid fa-file-video"></i> Download MP4</button>
+      <label class="clip-mode" title="Keep the recording's VP9/Opus streams instead of converting to H.264/AAC. Much faster, plays in current browsers but not in some players (e.g. QuickTime)."><input type="checkbox" id="mp4Fast"> Fast MP4</label>
       <button class="btn" data-action="secure-link"><i class="fa-solid fa-lock"></i> Secure Link</button>
       <button class="btn" data-action="public-link"><i class="fa-solid fa-globe"></i> Public Link</button>
       <button class="btn" data-action="email"><i class="fa-solid fa-envelope"></i> Email</button>
@@ -129,6 +159,43 @@ document.addEventListener("DOMContentLoaded", () => {
     previewArea.scrollIntoView({ behavior: 'smooth', block: 'center' });
   };
   
+  // Scrub previews are tiles of the server's sprite sheet (GET /thumbnails/<file>):
+  // one image fetch up front instead of a video seek per slider step.
+  let scrubSprite = null;
+  const loadScrubSprite = async (filename) => {
+    scrubSprite = null;
+    let res = await apiFetch(`/thumbnails/${filename}`).catch(() => null);
+    if (res?.status === 202) {
+      // Still being extracted: poll the job itself (which doesn't resubmit it) until it settles.
+      const { status_url } = await res.json();
+      for (let attempt = 0; attempt < 30 && filename === currentFile; attempt++) {
+        await sleep(2000);
+        const { job } = await apiFetch(status_url).then(r => r.json()).catch(() => ({}));
+        if (!job || job.state === "failed") return; // Keep seeking the video
+        if (job.state === "done") {
+          res = await apiFetch(`/thumbnails/${filename}`).catch(() => null);
+          break;
+        }
+      }
+    }
+    if (res?.status !== 200 || filename !== currentFile) return;
+    const data = await res.json();
+    new Image().src = data.sprite_url; // Warm the cache before the first drag
+    scrubSprite = { ...data.sprite, url: data.sprite_url };
+  };
+
+  const showScrubTile = (seconds, videoDuration) => {
+    const s = scrubSprite;
+    const i = Math.max(0, Math.min(Math.floor(seconds / s.interval), s.count - 1));
+    const left = trimSliderEl.offsetLeft + trimSliderEl.offsetWidth * (seconds / videoDuration);
+    Object.assign(trimPreview.style, {
+      width: `${s.width}px`, height: `${s.height}px`, left: `${left}px`,
+      backgroundImage: `url(${s.url})`,
+      backgroundPosition: `-${(i % s.columns) * s.width}px -${Math.floor(i / s.columns) * s.height}px`,
+    });
+    trimPreview.classList.remove("hidden");
+  };
+
   const createSlider = (videoDuration) => {
     if (trimSlider) { trimSlider.destroy(); }
     const startValues = [0, Math.min(10, videoDuration)];
@@ -140,7 +207,16 @@ document.addEventListener("DOMContentLoaded", () => {
       trimStartTime.textContent = formatTime(start);
       trimEndTime.textContent = formatTime(end);
     });
-    trimSlider.on('slide', (values, handle) => { preview.currentTime = parseFloat(values[handle]); });
+    trimSlider.on('slide', (values, handle) => {
+      const seconds = parseFloat(values[handle]);
+      if (scrubSprite) showScrubTile(seconds, videoDuration);
+      else preview.currentTime = seconds;
+    });
+    trimSlider.on('end', (values, handle) => {
+      trimPreview.classList.add("hidden");
+      preview.currentTime = parseFloat(values[handle]); // One seek, where the handle came to rest
+    });
+    loadScrubSprite(currentFile);
     clipPanel.classList.remove("hidden");
     clipPanel.scrollIntoView({ behavior: 'smooth', block: 'center' });
   };
@@ -159,7 +235,11 @@ document.addEventListener("DOMContentLoaded", () => {
       if (isFinite(preview.duration) && preview.duration > 0) {
         createSlider(preview.duration);
       } else {
-        statusMsg.textContent = "❌ Metadata loaded, but the video duration is invalid.";
+        // Raw MediaRecorder files report no duration; ask the server's probe cache instead.
+        apiFetch(`/meta/${currentFile}`).then(r => r.json()).then(({ meta }) => {
+          if (meta?.duration > 0) createSlider(meta.duration);
+          else statusMsg.textContent = "❌ Metadata loaded, but the video duration is invalid.";
+        });
       }
     };
     preview.addEventListener('loadedmetadata', onMetadataLoaded);
@@ -169,6 +249,86 @@ document.addEventListener("DOMContentLoaded", () => {
     }, 5000);
   };
 
+  // --- Recording upload: chunks stream to the server while recording ---
+  const UPLOAD_TIMESLICE_MS = 5000;
+  const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+  const createChunkedUpload = async () => {
+    const init = await apiFetch("/upload/chunked", { method: "POST" }).then(r => r.json());
+    if (init.status !== "ok") throw new Error(init.error || "Could not start upload");
+    const base = `/upload/chunked/${init.upload_id}`;
+    const pending = new Map(); // seq -> Blob, dropped as soon as the server has it
+    let nextSeq = 0, queue = Promise.resolve();
+
+    const sendChunk = async (seq, blob, attempts = 5) => {
+      for (let i = 0; i < attempts; i++) {
+        try {
+          const r = await apiFetch(`${base}/${seq}`, { method: "PUT", body: blob });
+          if (r.ok) { pending.delete(seq); return; }
+        } catch (err) { console.warn(`Chunk ${seq} upload failed, retrying:`, err); }
+        await sleep(500 * 2 ** i);
+      }
+      throw new Error(`Chunk ${seq} could not be uploaded`);
+    };
+
+    return {
+      push(blob) {
+        const seq = nextSeq++;
+        pending.set(seq, blob);
+        // Sequential so a slow link never has many chunks in flight; failures are retried in finish().
+        queue = queue.then(() => sendChunk(seq, blob)).catch(err => console.warn(err));
+      },
+      async finish() {
+        await queue;
+        // Resume: ask the server what it has and resend only what is missing.
+        const { received = [] } = await apiFetch(base).then(r => r.json());
+        const have = new Set(received);
+        for (const [seq, blob] of [...pending]) {
+          if (have.has(seq)) pending.delete(seq); else await sendChunk(seq, blob);
+        }
+        return apiFetch(`${base}/finalize`, {
+          method: "POST", headers: { "Content-Type": "application/json" }, body: JSON.stringify({ chunks: nextSeq })
+        }).then(r => r.json());
+      },
+    };
+  };
+
+  const recordWithUpload = async (recorder) => {
+    let upload = null;
+    try { upload = await createChunkedUpload(); } catch (err) { console.warn("Chunked upload unavailable, using single upload:", err); }
+    chunks = [];
+    recorder.ondataavailable = e => {
+      if (!e.data.size) return;
+      if (upload) upload.push(e.data); else chunks.push(e.data);
+    };
+    recorder.onstop = async () => {
+      statusMsg.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> Uploading & processing...`;
+      stopAllStreams(); 
+      let res;
+      try {
+        if (upload) {
+          res = await upload.finish();
+        } else {
+          const fd = new FormData();
+          fd.append("video", new Blob(chunks, { type: "video/webm" }), "recording.webm");
+          chunks = [];
+          res = await apiFetch("/upload", { method: "POST", body: fd }).then(r => r.json());
+        }
+      } catch (err) {
+        res = { status: "fail", error: err.message };
+      }
+      if (res.status === "ok") {
+        statusMsg.textContent = `✅ Recording saved!`;
+        addFileToGrid(res.filename);
+        activateFile(res.filename);
+      } else {
+        statusMsg.textContent = "❌ Upload failed: " + res.error;
+      }
+      resetRecordingButtons(); 
+    };
+    recorder.start(UPLOAD_TIMESLICE_MS);
+  };
+
   function updateWebcamOverlayStyle() {
       const container = webcamPreview.parentElement;
       if (!container) return; 
@@ -406,31 +566,20 @@ document.addEventListener("DOMContentLoaded", () => {
     window.addEventListener('resize', updateWebcamOverlayStyle);
   }
 
+  // VP9 goes into an MP4 as-is with the "fast" target (a remux, no re-encode); VP8 always
+  // has to be transcoded, so it's only the fallback for browsers that can't record VP9.
+  const recorderOptions = () => {
+    const mimeType = ["video/webm; codecs=vp9", "video/webm; codecs=vp8"].find(t => MediaRecorder.isTypeSupported(t));
+    return mimeType ? { mimeType } : {};
+  };
+
   const startScreenOnlyRecording = async () => {
     stopAllStreams(); 
     webcamCaptureArea.classList.add("hidden"); 
     try {
       screenStream = await navigator.mediaDevices.getDisplayMedia({ video: { mediaSource: "screen" }, audio: true });
-      mediaRecorder = new MediaRecorder(screenStream, { mimeType: "video/webm; codecs=vp8" });
-      chunks = [];
-      mediaRecorder.ondataavailable = e => chunks.push(e.data);
-      mediaRecorder.onstop = async () => {
-        const blob = new Blob(chunks, { type: "video/webm" });
-        const fd = new FormData();
-        fd.append("video", blob, "recording.webm");
-        statusMsg.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> Uploading & processing...`;
-        stopAllStreams(); 
-        const res = await apiFetch("/upload", { method: "POST", body: fd }).then(r => r.json());
-        if (res.status === "ok") {
-          statusMsg.textContent = `✅ Recording saved!`;
-          addFileToGrid(res.filename);
-          activateFile(res.filename);
-        } else {
-          statusMsg.textContent = "❌ Upload failed: " + res.error;
-        }
-        resetRecordingButtons(); 
-      };
-      mediaRecorder.start();
+      mediaRecorder = new MediaRecorder(screenStream, recorderOptions());
+      await recordWithUpload(mediaRecorder);
       screenStream.getVideoTracks()[0].onended = () => stopBtn.click(); 
       statusMsg.textContent = "🎬 Recording screen only…";
       startBtn.classList.add("hidden");
@@ -459,26 +608,8 @@ document.addEventListener("DOMContentLoaded", () => {
           webcamPreview.srcObject = combinedStream;
           webcamPreview.classList.add('webcam-overlay'); 
           updateWebcamOverlayStyle();
-          mediaRecorder = new MediaRecorder(combinedStream, { mimeType: "video/webm; codecs=vp8" });
-          chunks = [];
-          mediaRecorder.ondataavailable = e => chunks.push(e.data);
-          mediaRecorder.onstop = async () => {
-              const blob = new Blob(chunks, { type: "video/webm" });
-              const fd = new FormData();
-              fd.append("video", blob, "recording.webm");
-              statusMsg.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> Uploading & processing...`;
-              stopAllStreams(); 
-              const res = await apiFetch("/upload", { method: "POST", body: fd }).then(r => r.json());
-              if (res.status === "ok") {
-                  statusMsg.textContent = `✅ Recording saved!`;
-                  addFileToGrid(res.filename);
-                  activateFile(res.filename);
-              } else {
-                  statusMsg.textContent = "❌ Upload failed: " + res.error;
-              }
-              resetRecordingButtons(); 
-          };
-          mediaRecorder.start();
+          mediaRecorder = new MediaRecorder(combinedStream, recorderOptions());
+          await recordWithUpload(mediaRecorder);
           statusMsg.textContent = "🎬 Recording screen + webcam…";
           screenStream.getVideoTracks()[0].onended = () => stopBtn.click();
           if (webcamStream?.getVideoTracks()[0]) { webcamStream.getVideoTracks()[0].onended = () => stopBtn.click(); }
@@ -508,26 +639,8 @@ document.addEventListener("DOMContentLoaded", () => {
       if (!webcamStream || webcamStream.getTracks().length === 0) {
         throw new Error("No active webcam or microphone stream found.");
       }
-      mediaRecorder = new MediaRecorder(webcamStream, { mimeType: "video/webm; codecs=vp8" });
-      chunks = [];
-      mediaRecorder.ondataavailable = e => chunks.push(e.data);
-      mediaRecorder.onstop = async () => {
-        const blob = new Blob(chunks, { type: "video/webm" });
-        const fd = new FormData();
-        fd.append("video", blob, "recording.webm");
-        statusMsg.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> Uploading & processing...`;
-        stopAllStreams(); 
-        const res = await apiFetch("/upload", { method: "POST", body: fd }).then(r => r.json());
-        if (res.status === "ok") {
-          statusMsg.textContent = `✅ Recording saved!`;
-          addFileToGrid(res.filename);
-          activateFile(res.filename);
-        } else {
-          statusMsg.textContent = "❌ Upload failed: " + res.error;
-        }
-        resetRecordingButtons(); 
-      };
-      mediaRecorder.start();
+      mediaRecorder = new MediaRecorder(webcamStream, recorderOptions());
+      await recordWithUpload(mediaRecorder);
       statusMsg.textContent = "🎬 Recording webcam…";
       webcamStream.getTracks().forEach(track => { track.onended = () => stopBtn.click(); });
       startBtn.classList.add("hidden");
@@ -667,33 +780,49 @@ document.addEventListener("DOMContentLoaded", () => {
           const mp4Button = button;
           const originalMp4ButtonContent = mp4Button.innerHTML; 
           mp4Button.disabled = true;
-          mp4Button.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> Converting...`;
-          statusMsg.textContent = "⏳ Converting to MP4. This might take a moment...";
+          mp4Button.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> Preparing...`;
           try {
-              const downloadUrl = `/download/mp4/${currentFile}`;
-              const response = await fetch(downloadUrl);
-              if (response.ok) {
-                  const blob = await response.blob();
-                  const url = window.URL.createObjectURL(blob);
-                  const a = document.createElement('a');
-                  a.style.display = 'none';
-                  a.href = url;
-                  a.download = currentFile.replace('.webm', '.mp4');
-                  document.body.appendChild(a);
-                  a.click();
-                  window.URL.revokeObjectURL(url);
-                  a.remove();
-                  statusMsg.textContent = `✅ MP4 conversion complete! Check your downloads.`;
-              } else {
-                  const errorData = await response.json();
-                  statusMsg.textContent = `❌ MP4 conversion failed: ${errorData.error || 'Unknown error'}`;
-                  console.error("MP4 conversion server error:", errorData.error);
+              // Start (or join) a streaming conversion, then poll its status until the MP4 can
+              // be sent, so a failed or still-queued conversion is shown here instead of being
+              // saved as the MP4.
+              let response, conversion, method = "POST";
+              while (true) {
+                  const target = $("#mp4Fast")?.checked ? "&target=fast" : "";
+                  response = await apiFetch(`/convert/mp4/${currentFile}?stream=1${target}`, { method });
+                  conversion = await response.json();
+                  if (!response.ok) throw new Error(conversion.error || 'Unknown error');
+                  if (response.status === 202 || conversion.state === "done" || conversion.stream_url) break;
+                  method = conversion.state === "none" ? "POST" : "GET"; // "none": not started yet, e.g. due for a retry
+                  mp4Button.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> Waiting to convert...`;
+                  await sleep(1000);
+              }
+              // 202 = a regular conversion is already running; poll the job until it finishes.
+              if (response.status === 202) {
+                  statusMsg.textContent = "⏳ Converting to MP4. This might take a moment...";
+                  let job;
+                  do {
+                      await sleep(1000);
+                      ({ job } = await apiFetch(conversion.status_url).then(r => r.json()));
+                      if (job?.progress != null) mp4Button.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> Converting ${Math.round(job.progress * 100)}%`;
+                  } while (job && (job.state === "queued" || job.state === "running"));
+                  if (!job || job.state === "failed") throw new Error(job?.error || "Conversion failed");
               }
+              // stream_url sends the MP4 while it's still being converted; otherwise it's cached.
+              const a = document.createElement('a');
+              a.style.display = 'none';
+              a.href = conversion.stream_url || conversion.download_url;
+              a.download = currentFile.replace('.webm', '.mp4');
+              document.body.appendChild(a);
+              a.click();
+              a.remove();
+              statusMsg.textContent = conversion.stream_url
+                  ? "⏳ MP4 download started. It is converted as it downloads."
+                  : "✅ MP4 conversion complete! Check your downloads.";
           } catch (error) {
-              console.error("MP4 conversion request failed:", error);
-              statusMsg.textContent = `❌ MP4 conversion request failed. Check network or console.`;
+              console.error("MP4 conversion failed:", error);
+              statusMsg.textContent = `❌ MP4 conversion failed: ${error.message || 'Check network or console.'}`;
           } finally {
-              resetButton(mp4Button, originalMp4ButtonContent); 
+              resetButton(mp4Button, originalMp4ButtonContent);
               setTimeout(() => { if (statusMsg.textContent.includes('MP4')) statusMsg.textContent = ''; }, 6000);
           }
           break;
@@ -715,7 +844,7 @@ document.addEventListener("DOMContentLoaded", () => {
       if (start >= end) return alert("⚠ Invalid range.");
       const btn = e.target.closest("button");
       btn.disabled = true; btn.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> Cutting...`;
-      const r = await apiFetch(`/clip/${currentFile}`, { method: "POST", headers: {"Content-Type": "application/json"}, body: JSON.stringify({ start, end }) }).then(x => x.json());
+      const r = await apiFetch(`/clip/${currentFile}`, { method: "POST", headers: {"Content-Type": "application/json"}, body: JSON.stringify({ start, end, mode: $("#clipFast")?.checked ? "fast" : "exact" }) }).then(x => x.json());
       if (r.status === "ok") { addFileToGrid(r.clip); activateFile(r.clip); $("#clipCancel").click(); } else { alert("❌ " + r.error); }
       btn.disabled = false; btn.innerHTML = `<i class="fa-solid fa-share-nodes"></i> Create & Share Clip`;
   });
@@ -732,7 +861,7 @@ document.addEventListener("DOMContentLoaded", () => {
           btn.disabled = false; btn.innerHTML = `<i class="fa-solid fa-paper-plane"></i> Send`; return;
       }
       const r = await apiFetch("/send_email", { method: "POST", headers: {"Content-Type": "application/json"}, body: JSON.stringify({ to, url: linkRes.url }) }).then(x => x.json());
-      $("#emailStatus").textContent = r.status === "ok" ? "✅ Sent!" : "❌ " + (r.error || "Failed");
+      $("#emailStatus").textContent = r.status === "ok" ? "✅ On its way!" : "❌ " + (r.error || "Failed");
       btn.disabled = false; btn.innerHTML = `<i class="fa-solid fa-paper-plane"></i> Send`;
       if (r.status === "ok") setTimeout(() => { emailModal.close(); $("#emailStatus").textContent = ""; $("#emailTo").value = ""; }, 1500);
   });
@@ -761,6 +890,8 @@ document.addEventListener("DOMContentLoaded", () => {
       btn.disabled = true; btn.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> Forgetting...`;
       await apiFetch("/session/forget", { method: "POST" });
       renderFiles([]);
+      galleryCursor = null;
+      loadMoreBtn.classList.add("hidden");
       activateFile(null);
       statusMsg.textContent = "✅ Session has been successfully forgotten.";
       setTimeout(() => { statusMsg.textContent = ""; }, 4000);
@@ -842,8 +973,7 @@ document.addEventListener("DOMContentLoaded", () => {
       }
     }
     try {
-      const { files = [] } = await apiFetch("/session/files").then(r => r.json());
-      renderFiles(files.reverse());
+      await loadGallery();
     } catch {}
   })();
 });
\ No newline at end of file
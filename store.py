@@ -0,0 +1,791 @@
+# store.py
+# SQLite-backed store for user sessions, public links and media bookkeeping
+# (probe/keyframe caches, derived-media cache entries).
+#
+# Replaces rewriting user_sessions.json / public_links.json on every change.
+# Lookups go through indexes (link token, filename, session token) instead of
+# scanning a dict, and every write is a short IMMEDIATE transaction in WAL
+# mode, so several gunicorn worker processes can share the database safely.
+#
+# Schema: the `recording` and `public_link` tables keep the layout of the
+# existing instance/database.db; `session` is added so sessions without any
+# recordings still exist (the JSON store allowed that too).
+
+import datetime
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from cooperative import thread_local
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recording (
+    id INTEGER NOT NULL,
+    filename VARCHAR(255) NOT NULL,
+    session_token VARCHAR(32) NOT NULL,
+    created_at DATETIME,
+    PRIMARY KEY (id),
+    UNIQUE (filename)
+);
+CREATE INDEX IF NOT EXISTS ix_recording_session_token ON recording (session_token);
+
+CREATE TABLE IF NOT EXISTS public_link (
+    id INTEGER NOT NULL,
+    token VARCHAR(12) NOT NULL,
+    recording_id INTEGER NOT NULL,
+    PRIMARY KEY (id),
+    UNIQUE (token),
+    FOREIGN KEY(recording_id) REFERENCES recording (id)
+);
+CREATE INDEX IF NOT EXISTS ix_public_link_recording_id ON public_link (recording_id);
+
+CREATE TABLE IF NOT EXISTS session (
+    token VARCHAR(32) NOT NULL,
+    created_at DATETIME,
+    PRIMARY KEY (token)
+);
+
+-- Keyframe index written after the post-upload remux. Valid only while the
+-- file's size and mtime still match.
+CREATE TABLE IF NOT EXISTS media_index (
+    filename VARCHAR(255) NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    duration FLOAT,
+    keyframes TEXT NOT NULL,
+    indexed_at DATETIME,
+    PRIMARY KEY (filename)
+);
+
+-- ffprobe results, one row per file; stale once size/mtime change.
+CREATE TABLE IF NOT EXISTS media_meta (
+    filename VARCHAR(255) NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    meta TEXT NOT NULL,
+    probed_at DATETIME,
+    PRIMARY KEY (filename)
+);
+
+-- sha256 of each recording's bytes (the source part of derived-cache keys);
+-- stale once size/mtime change.
+CREATE TABLE IF NOT EXISTS source_hash (
+    filename VARCHAR(255) NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 VARCHAR(64) NOT NULL,
+    hashed_at DATETIME,
+    PRIMARY KEY (filename)
+);
+
+-- Derived media cache entries (see derived_cache.py). `path` is relative to
+-- the cache root; `source` is the recording the entry was first made from.
+-- Keys hash content, so recordings with identical bytes share entries: the
+-- recordings an entry belongs to are its rows in derived_owner.
+CREATE TABLE IF NOT EXISTS derived (
+    key VARCHAR(40) NOT NULL,
+    source VARCHAR(255) NOT NULL,
+    kind VARCHAR(16) NOT NULL,
+    path VARCHAR(255) NOT NULL,
+    size INTEGER NOT NULL,
+    info TEXT,
+    created_at DATETIME,
+    last_access FLOAT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (key)
+);
+CREATE INDEX IF NOT EXISTS ix_derived_last_access ON derived (last_access);
+CREATE INDEX IF NOT EXISTS ix_derived_source ON derived (source);
+
+CREATE TABLE IF NOT EXISTS derived_owner (
+    key VARCHAR(40) NOT NULL,
+    source VARCHAR(255) NOT NULL,
+    PRIMARY KEY (key, source)
+);
+CREATE INDEX IF NOT EXISTS ix_derived_owner_source ON derived_owner (source);
+
+-- Retention index: when each recording is due for deletion, and its size
+-- (for the disk quota). See retention.py.
+CREATE TABLE IF NOT EXISTS expiry (
+    filename VARCHAR(255) NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at FLOAT NOT NULL,
+    PRIMARY KEY (filename)
+);
+CREATE INDEX IF NOT EXISTS ix_expiry_expires_at ON expiry (expires_at);
+
+-- One-time maintenance steps that have already run (e.g. backfills).
+CREATE TABLE IF NOT EXISTS store_flag (
+    name VARCHAR(64) NOT NULL,
+    set_at DATETIME,
+    PRIMARY KEY (name)
+);
+
+-- Hit/miss/eviction counters of the derived cache, shared by all workers.
+CREATE TABLE IF NOT EXISTS derived_stat (
+    name VARCHAR(32) NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (name)
+);
+
+-- Outgoing mail, delivered by the background sender in mailer.py.
+-- state: queued -> sending -> sent | failed (queued again while retries are left).
+CREATE TABLE IF NOT EXISTS mail_outbox (
+    id VARCHAR(32) NOT NULL,
+    message TEXT NOT NULL,
+    state VARCHAR(16) NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt FLOAT NOT NULL,
+    lease_until FLOAT,
+    last_error TEXT,
+    created_at FLOAT NOT NULL,
+    sent_at FLOAT,
+    PRIMARY KEY (id)
+);
+CREATE INDEX IF NOT EXISTS ix_mail_outbox_due ON mail_outbox (state, next_attempt);
+
+-- Gallery listing: one row per recording in a session with everything the
+-- gallery shows, kept up to date by the writes that change it (sessions,
+-- retention sizes, media index, public links, derived MP4s). updated_at moves
+-- on every change and feeds the listing's ETag. Indexed per sort order for
+-- keyset pagination.
+CREATE TABLE IF NOT EXISTS file_index (
+    filename VARCHAR(255) NOT NULL,
+    session_token VARCHAR(32) NOT NULL,
+    created_at FLOAT NOT NULL,
+    size INTEGER,
+    duration FLOAT,
+    mp4 INTEGER NOT NULL DEFAULT 0,
+    public_link VARCHAR(12),
+    thumbnail TEXT,
+    updated_at FLOAT NOT NULL,
+    PRIMARY KEY (filename)
+);
+CREATE INDEX IF NOT EXISTS ix_file_index_created ON file_index (session_token, created_at, filename);
+CREATE INDEX IF NOT EXISTS ix_file_index_size ON file_index (session_token, COALESCE(size, 0), filename);
+CREATE INDEX IF NOT EXISTS ix_file_index_duration ON file_index (session_token, COALESCE(duration, 0), filename);
+CREATE INDEX IF NOT EXISTS ix_file_index_name ON file_index (session_token, filename);
+"""
+
+# Sort orders of Store.list_session_files: name -> SQL expression (matching an index).
+FILE_SORTS = {
+    "created": "created_at",
+    "size": "COALESCE(size, 0)",
+    "duration": "COALESCE(duration, 0)",
+    "name": "filename",
+}
+FILE_INDEX_BACKFILL_FLAG = "file_index_backfill"
+DERIVED_OWNER_BACKFILL_FLAG = "derived_owner_backfill"
+# Derived-cache kinds that file_index columns reflect (mp4, thumbnail).
+FILE_INDEX_KINDS = ("mp4", "thumbs")
+
+# Derived entries owned by a recording that has a public link; never evicted.
+PINNED_SOURCES = (
+    "SELECT r.filename FROM recording r JOIN public_link l ON l.recording_id = r.id"
+)
+PINNED_ENTRY = (
+    "EXISTS (SELECT 1 FROM derived_owner o WHERE o.key = derived.key "
+    f"AND o.source IN ({PINNED_SOURCES}))"
+)
+
+
+
+def _now():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+class Store:
+    """Sessions (magic_token -> recordings) and public links (token -> recording)."""
+
+    def __init__(self, db_path, observe=None):
+        self.db_path = db_path
+        # observe(kind, seconds) is called after every read query / write transaction.
+        self.observe = observe
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._local = thread_local()
+        self._conn().executescript(SCHEMA)
+        self._backfill_derived_owners()
+
+    # --- Connections & transactions ---
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # One connection per (OS) thread; autocommit mode so transactions are explicit.
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction. IMMEDIATE takes the write lock up front, so two
+        workers can't both read-then-write the same rows."""
+        conn = self._conn()
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            if self.observe:
+                self.observe("write", time.perf_counter() - started)
+
+    def _query(self, sql, params=()):
+        started = time.perf_counter()
+        rows = self._conn().execute(sql, params).fetchall()
+        if self.observe:
+            self.observe("read", time.perf_counter() - started)
+        return rows
+
+    # --- Migration ---
+    def migrate_from_json(self, sessions_file, links_file):
+        """One-time import of user_sessions.json and public_links.json.
+        Runs once per database (tracked with PRAGMA user_version)."""
+        with self.transaction() as db:
+            if db.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+                return False
+            sessions = _load_json(sessions_file)
+            links = _load_json(links_file)
+            for token, files in sessions.items():
+                db.execute("INSERT OR IGNORE INTO session (token, created_at) VALUES (?, ?)", (token, _now()))
+                for fname in files:
+                    db.execute(
+                        "INSERT OR IGNORE INTO recording (filename, session_token, created_at) VALUES (?, ?, ?)",
+                        (fname, token, _now()),
+                    )
+            for link_token, fname in links.items():
+                recording_id = self._recording_id(db, fname, create=True)
+                db.execute(
+                    "INSERT OR IGNORE INTO public_link (token, recording_id) VALUES (?, ?)",
+                    (link_token, recording_id),
+                )
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            return True
+
+    # --- Recordings ---
+    @staticmethod
+    def _recording_id(db, fname, create=False):
+        row = db.execute("SELECT id FROM recording WHERE filename = ?", (fname,)).fetchone()
+        if row:
+            return row[0]
+        if not create:
+            return None
+        # Not in any session (e.g. the session was forgotten): keep it ownerless.
+        cur = db.execute(
+            "INSERT INTO recording (filename, session_token, created_at) VALUES (?, '', ?)",
+            (fname, _now()),
+        )
+        return cur.lastrowid
+
+    def delete_recording(self, fname):
+        """Removes a recording with its session entry, public links and cached media info."""
+        with self.transaction() as db:
+            return self._delete_recording(db, fname)
+
+    def _delete_recording(self, db, fname):
+        db.execute("DELETE FROM media_index WHERE filename = ?", (fname,))
+        db.execute("DELETE FROM media_meta WHERE filename = ?", (fname,))
+        db.execute("DELETE FROM expiry WHERE filename = ?", (fname,))
+        db.execute("DELETE FROM file_index WHERE filename = ?", (fname,))
+        recording_id = self._recording_id(db, fname)
+        if recording_id is None:
+            return False
+        db.execute("DELETE FROM public_link WHERE recording_id = ?", (recording_id,))
+        db.execute("DELETE FROM recording WHERE id = ?", (recording_id,))
+        return True
+
+    def expire_recordings(self, fnames):
+        """Deletes every reference to fnames (sessions, links, media info, the
+        retention index and derived-cache entries) in one transaction.
+        Returns the derived-cache paths to remove from disk."""
+        with self.transaction() as db:
+            derived_paths = []
+            for fname in fnames:
+                self._delete_recording(db, fname)
+                derived_paths += self._disown_derived(db, fname)
+                db.execute("DELETE FROM source_hash WHERE filename = ?", (fname,))
+            return derived_paths
+
+    # --- Sessions ---
+    def session_exists(self, token):
+        if not token:
+            return False
+        return bool(self._query("SELECT 1 FROM session WHERE token = ?", (token,)))
+
+    def create_session(self, token):
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO session (token, created_at) VALUES (?, ?)", (token, _now()))
+
+    def add_session_files(self, token, fnames):
+        """Adds recordings to a session (creating the session if needed) in one transaction."""
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO session (token, created_at) VALUES (?, ?)", (token, _now()))
+            now = time.time()
+            for fname in fnames:
+                db.execute(
+                    "INSERT INTO recording (filename, session_token, created_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(filename) DO UPDATE SET session_token = excluded.session_token",
+                    (fname, token, _now()),
+                )
+                db.execute(
+                    "INSERT INTO file_index (filename, session_token, created_at, size, updated_at) "
+                    "VALUES (?, ?, ?, (SELECT size FROM expiry WHERE filename = ?), ?) "
+                    "ON CONFLICT(filename) DO UPDATE SET session_token = excluded.session_token, "
+                    "updated_at = excluded.updated_at",
+                    (fname, token, now, fname, now),
+                )
+
+    def session_files(self, token):
+        rows = self._query("SELECT filename FROM recording WHERE session_token = ? ORDER BY id", (token,))
+        return [r[0] for r in rows]
+
+    def forget_session(self, token):
+        """Deletes the session. Its recordings stay (public links keep working) but become ownerless."""
+        with self.transaction() as db:
+            cur = db.execute("DELETE FROM session WHERE token = ?", (token,))
+            db.execute("UPDATE recording SET session_token = '' WHERE session_token = ?", (token,))
+            db.execute("DELETE FROM file_index WHERE session_token = ?", (token,))
+            return cur.rowcount > 0
+
+    # --- Gallery listing (file_index) ---
+    def list_session_files(self, token, sort="created", descending=True, after=None, limit=50):
+        """One page of the session's recordings from the file index, ordered by
+        FILE_SORTS[sort] then filename. `after` is the (sort value, filename) of
+        the last row of the previous page (keyset pagination). Returns a list
+        of dicts; each has "sort_value" for building the next cursor."""
+        expr = FILE_SORTS[sort]
+        op, direction = ("<", "DESC") if descending else (">", "ASC")
+        sql = (f"SELECT filename, created_at, size, duration, mp4, public_link, thumbnail, {expr} "
+               f"FROM file_index WHERE session_token = ?")
+        params = [token]
+        if after is not None:
+            sql += f" AND ({expr}, filename) {op} (?, ?)"
+            params += list(after)
+        sql += f" ORDER BY {expr} {direction}, filename {direction} LIMIT ?"
+        params.append(limit)
+        return [
+            {"filename": f, "created": created, "size": size, "duration": duration, "mp4": bool(mp4),
+             "public_link": link, "thumbnail": thumbnail, "sort_value": value}
+            for f, created, size, duration, mp4, link, thumbnail, value in self._query(sql, params)
+        ]
+
+    def session_files_version(self, token):
+        """(count, last change) of the session's file index rows; changes whenever the listing would."""
+        return tuple(self._query(
+            "SELECT COUNT(*), COALESCE(MAX(updated_at), 0) FROM file_index WHERE session_token = ?", (token,)
+        )[0])
+
+    def set_file_thumbnail(self, fname, url):
+        with self.transaction() as db:
+            db.execute("UPDATE file_index SET thumbnail = ?, updated_at = ? WHERE filename = ?",
+                       (url, time.time(), fname))
+
+    def backfill_file_index(self):
+        """One-time import of recordings that predate the file index. Returns the rows added."""
+        with self.transaction() as db:
+            if db.execute("SELECT 1 FROM store_flag WHERE name = ?", (FILE_INDEX_BACKFILL_FLAG,)).fetchone():
+                return 0
+            cur = db.execute(
+                "INSERT OR IGNORE INTO file_index "
+                "(filename, session_token, created_at, size, duration, mp4, public_link, updated_at) "
+                "SELECT r.filename, r.session_token, "
+                "COALESCE((julianday(r.created_at) - 2440587.5) * 86400.0, 0), e.size, m.duration, "
+                "EXISTS(SELECT 1 FROM derived_owner o JOIN derived d ON d.key = o.key "
+                "WHERE o.source = r.filename AND d.kind = 'mp4'), "
+                "(SELECT l.token FROM public_link l WHERE l.recording_id = r.id ORDER BY l.id LIMIT 1), ? "
+                "FROM recording r LEFT JOIN expiry e ON e.filename = r.filename "
+                "LEFT JOIN media_index m ON m.filename = r.filename WHERE r.session_token != ''",
+                (time.time(),),
+            )
+            db.execute("INSERT INTO store_flag (name, set_at) VALUES (?, ?)", (FILE_INDEX_BACKFILL_FLAG, _now()))
+            return cur.rowcount
+
+    # --- Public links ---
+    def link_for_file(self, fname):
+        row = self._query(
+            "SELECT l.token FROM public_link l JOIN recording r ON r.id = l.recording_id "
+            "WHERE r.filename = ? ORDER BY l.id LIMIT 1", (fname,)
+        )
+        return row[0][0] if row else None
+
+    def get_or_create_link(self, fname, new_token):
+        """Returns (token, created). new_token is used only if fname has no link yet."""
+        with self.transaction() as db:
+            recording_id = self._recording_id(db, fname, create=True)
+            row = db.execute(
+                "SELECT token FROM public_link WHERE recording_id = ? ORDER BY id LIMIT 1", (recording_id,)
+            ).fetchone()
+            if row:
+                return row[0], False
+            db.execute("INSERT INTO public_link (token, recording_id) VALUES (?, ?)", (new_token, recording_id))
+            db.execute("UPDATE file_index SET public_link = ?, updated_at = ? WHERE filename = ?",
+                       (new_token, time.time(), fname))
+            return new_token, True
+
+    def file_for_link(self, token):
+        row = self._query(
+            "SELECT r.filename FROM public_link l JOIN recording r ON r.id = l.recording_id "
+            "WHERE l.token = ?", (token,)
+        )
+        return row[0][0] if row else None
+
+    def delete_links_for_file(self, fname):
+        with self.transaction() as db:
+            recording_id = self._recording_id(db, fname)
+            if recording_id is None:
+                return 0
+            db.execute("UPDATE file_index SET public_link = NULL, updated_at = ? WHERE filename = ?",
+                       (time.time(), fname))
+            return db.execute("DELETE FROM public_link WHERE recording_id = ?", (recording_id,)).rowcount
+
+    # --- Media index ---
+    def save_media_index(self, fname, size, mtime_ns, duration, keyframes):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO media_index (filename, size, mtime_ns, duration, keyframes, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (fname, size, mtime_ns, duration, json.dumps(keyframes), _now()),
+            )
+            db.execute("UPDATE file_index SET size = ?, duration = ?, updated_at = ? WHERE filename = ?",
+                       (size, duration, time.time(), fname))
+
+    def get_media_index(self, fname, st=None):
+        """Returns {"duration", "keyframes"} for fname, or None if it isn't indexed
+        or the file changed since (st is an os.stat result to validate against)."""
+        rows = self._query(
+            "SELECT size, mtime_ns, duration, keyframes FROM media_index WHERE filename = ?", (fname,)
+        )
+        if not rows:
+            return None
+        size, mtime_ns, duration, keyframes = rows[0]
+        if st is not None and (st.st_size != size or st.st_mtime_ns != mtime_ns):
+            return None
+        return {"duration": duration, "keyframes": json.loads(keyframes)}
+
+    # --- Media metadata (probe cache) ---
+    def save_media_meta(self, fname, size, mtime_ns, meta):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO media_meta (filename, size, mtime_ns, meta, probed_at) VALUES (?, ?, ?, ?, ?)",
+                (fname, size, mtime_ns, json.dumps(meta), _now()),
+            )
+
+    def get_media_meta(self, fnames):
+        """Returns {filename: (size, mtime_ns, meta)} for the cached entries among fnames."""
+        fnames = list(fnames)
+        found = {}
+        for i in range(0, len(fnames), 500):  # stay under SQLite's bound-parameter limit
+            batch = fnames[i:i + 500]
+            rows = self._query(
+                f"SELECT filename, size, mtime_ns, meta FROM media_meta "
+                f"WHERE filename IN ({','.join('?' * len(batch))})", batch
+            )
+            for fname, size, mtime_ns, meta in rows:
+                found[fname] = (size, mtime_ns, json.loads(meta))
+        return found
+
+    # --- Source hashes ---
+    def get_source_hash(self, fname, st):
+        rows = self._query("SELECT size, mtime_ns, sha256 FROM source_hash WHERE filename = ?", (fname,))
+        if not rows or rows[0][0] != st.st_size or rows[0][1] != st.st_mtime_ns:
+            return None
+        return rows[0][2]
+
+    def save_source_hash(self, fname, size, mtime_ns, sha256):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO source_hash (filename, size, mtime_ns, sha256, hashed_at) VALUES (?, ?, ?, ?, ?)",
+                (fname, size, mtime_ns, sha256, _now()),
+            )
+
+    # --- Derived media cache ---
+    @staticmethod
+    def _bump(db, name, n=1):
+        db.execute(
+            "INSERT INTO derived_stat (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n)
+        )
+
+    @staticmethod
+    def _refresh_derived(db, sources):
+        """Recomputes file_index.mp4 (has any cached MP4) for the given sources
+        and drops thumbnail URLs whose thumbnails left the cache."""
+        owned = ("SELECT 1 FROM derived_owner o JOIN derived d ON d.key = o.key "
+                 "WHERE o.source = file_index.filename AND d.kind = ")
+        db.executemany(
+            f"UPDATE file_index SET updated_at = ?, mp4 = EXISTS({owned}'mp4'), "
+            f"thumbnail = CASE WHEN EXISTS({owned}'thumbs') THEN thumbnail END "
+            "WHERE filename = ?",
+            [(time.time(), source) for source in set(sources)],
+        )
+
+    @staticmethod
+    def _owners(db, keys):
+        """The recordings that own any of keys."""
+        owners = set()
+        for key in keys:
+            owners.update(r[0] for r in db.execute("SELECT source FROM derived_owner WHERE key = ?", (key,)))
+        return owners
+
+    def _disown_derived(self, db, fname):
+        """Removes fname as an owner of its entries and deletes the entries
+        nobody else owns. Returns their paths; the caller deletes the files."""
+        keys = [r[0] for r in db.execute("SELECT key FROM derived_owner WHERE source = ?", (fname,))]
+        db.execute("DELETE FROM derived_owner WHERE source = ?", (fname,))
+        paths = []
+        for key in keys:
+            if db.execute("SELECT 1 FROM derived_owner WHERE key = ?", (key,)).fetchone():
+                continue
+            row = db.execute("SELECT path FROM derived WHERE key = ?", (key,)).fetchone()
+            if row:
+                paths.append(row[0])
+                db.execute("DELETE FROM derived WHERE key = ?", (key,))
+        return paths
+
+    def _backfill_derived_owners(self):
+        """One-time: entries that predate derived_owner are owned by their source."""
+        if self.has_flag(DERIVED_OWNER_BACKFILL_FLAG):
+            return
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO derived_owner (key, source) SELECT key, source FROM derived")
+            db.execute("INSERT OR IGNORE INTO store_flag (name, set_at) VALUES (?, ?)",
+                       (DERIVED_OWNER_BACKFILL_FLAG, _now()))
+
+    def get_derived(self, key):
+        rows = self._query("SELECT source, kind, path, size, info, hits FROM derived WHERE key = ?", (key,))
+        if not rows:
+            return None
+        source, kind, path, size, info, hits = rows[0]
+        sources = [r[0] for r in self._query("SELECT source FROM derived_owner WHERE key = ?", (key,))]
+        return {"key": key, "source": source, "sources": sources, "kind": kind, "path": path, "size": size,
+                "info": json.loads(info) if info else None, "hits": hits}
+
+    def add_derived_owner(self, key, source):
+        """Records that `source` (same content as the entry's other owners) uses key."""
+        with self.transaction() as db:
+            row = db.execute("SELECT kind FROM derived WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return
+            db.execute("INSERT OR IGNORE INTO derived_owner (key, source) VALUES (?, ?)", (key, source))
+            if row[0] in FILE_INDEX_KINDS:
+                self._refresh_derived(db, [source])
+
+    def record_derived_lookup(self, key, hit, now):
+        """Counts a cache lookup; a hit also refreshes the entry's recency."""
+        with self.transaction() as db:
+            if hit:
+                db.execute("UPDATE derived SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._bump(db, "hits" if hit else "misses")
+
+    def save_derived(self, key, source, kind, path, size, info, now):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO derived (key, source, kind, path, size, info, created_at, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE((SELECT hits FROM derived WHERE key = ?), 0))",
+                (key, source, kind, path, size, json.dumps(info) if info is not None else None, _now(), now, key),
+            )
+            db.execute("INSERT OR IGNORE INTO derived_owner (key, source) VALUES (?, ?)", (key, source))
+            if kind in FILE_INDEX_KINDS:
+                self._refresh_derived(db, self._owners(db, [key]))
+
+    def delete_derived(self, key):
+        with self.transaction() as db:
+            sources = self._owners(db, [key])
+            db.execute("DELETE FROM derived WHERE key = ?", (key,))
+            db.execute("DELETE FROM derived_owner WHERE key = ?", (key,))
+            self._refresh_derived(db, sources)
+
+    def evict_derived(self, max_bytes, policy="lru", keep=None):
+        """Drops unpinned entries other than `keep`, least recently (or, for
+        "lfu", least often) used first, until the cache fits in max_bytes.
+        Returns the removed [(path, size)]; the caller deletes the files."""
+        order = "hits, last_access" if policy == "lfu" else "last_access"
+        with self.transaction() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM derived").fetchone()[0]
+            if total <= max_bytes:
+                return []
+            evicted = []
+            evicted_keys = []
+            indexed_keys = []
+            rows = db.execute(f"SELECT key, kind, path, size FROM derived WHERE NOT {PINNED_ENTRY} AND key IS NOT ? "
+                              f"ORDER BY {order}", (keep,))
+            for key, kind, path, size in rows.fetchall():
+                if total <= max_bytes:
+                    break
+                db.execute("DELETE FROM derived WHERE key = ?", (key,))
+                evicted.append((path, size))
+                evicted_keys.append((key,))
+                total -= size
+                if kind in FILE_INDEX_KINDS:
+                    indexed_keys.append(key)
+            sources = self._owners(db, indexed_keys)
+            db.executemany("DELETE FROM derived_owner WHERE key = ?", evicted_keys)
+            self._refresh_derived(db, sources)
+            if evicted:
+                self._bump(db, "evictions", len(evicted))
+                self._bump(db, "evicted_bytes", sum(size for _, size in evicted))
+            return evicted
+
+    def forget_derived_source(self, fname):
+        """Drops fname's claim on its entries and removes the ones no other
+        recording owns. Returns their [path]."""
+        with self.transaction() as db:
+            paths = self._disown_derived(db, fname)
+            db.execute("DELETE FROM source_hash WHERE filename = ?", (fname,))
+            self._refresh_derived(db, [fname])
+            return paths
+
+    def derived_stats(self):
+        stats = dict(self._query("SELECT name, value FROM derived_stat"))
+        entries, size = self._query("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM derived")[0]
+        pinned = self._query(
+            f"SELECT COALESCE(SUM(size), 0) FROM derived WHERE {PINNED_ENTRY}"
+        )[0][0]
+        stats.update(entries=entries, bytes=size, pinned_bytes=pinned)
+        return stats
+
+    # --- Retention index ---
+    def track_expiry(self, fname, size, expires_at):
+        """Adds fname to the retention index. An already tracked file only gets
+        its size updated (e.g. after the remux), keeping its original expiry."""
+        self.track_expiries([(fname, size, expires_at)])
+
+    def track_expiries(self, rows):
+        """track_expiry for several (filename, size, expires_at) in one transaction."""
+        with self.transaction() as db:
+            db.executemany(
+                "INSERT INTO expiry (filename, size, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(filename) DO UPDATE SET size = excluded.size",
+                rows,
+            )
+            now = time.time()
+            db.executemany(
+                "UPDATE file_index SET size = ?, updated_at = ? WHERE filename = ? AND size IS NOT ?",
+                [(size, now, fname, size) for fname, size, _ in rows],
+            )
+
+    def due_recordings(self, now, limit):
+        """Filenames whose expiry has passed, oldest first."""
+        rows = self._query(
+            "SELECT filename FROM expiry WHERE expires_at <= ? ORDER BY expires_at LIMIT ?", (now, limit)
+        )
+        return [r[0] for r in rows]
+
+    def over_quota_recordings(self, quota_bytes, limit):
+        """The oldest recordings that have to go for the rest to fit in quota_bytes."""
+        total = self._query("SELECT COALESCE(SUM(size), 0) FROM expiry")[0][0]
+        victims = []
+        if total <= quota_bytes:
+            return victims
+        for fname, size in self._query(
+            "SELECT filename, size FROM expiry ORDER BY expires_at LIMIT ?", (limit,)
+        ):
+            if total <= quota_bytes:
+                break
+            victims.append(fname)
+            total -= size
+        return victims
+
+    def recordings_usage(self):
+        """(total bytes, count) of the recordings in the retention index."""
+        return self._query("SELECT COALESCE(SUM(size), 0), COUNT(*) FROM expiry")[0]
+
+    def tracked_recordings(self):
+        return {r[0] for r in self._query("SELECT filename FROM expiry")}
+
+    def has_flag(self, name):
+        return bool(self._query("SELECT 1 FROM store_flag WHERE name = ?", (name,)))
+
+    def set_flag(self, name):
+        """Sets a one-time flag. Returns True only for the caller that set it."""
+        with self.transaction() as db:
+            cur = db.execute("INSERT OR IGNORE INTO store_flag (name, set_at) VALUES (?, ?)", (name, _now()))
+            return cur.rowcount > 0
+
+    # --- Mail outbox ---
+    def enqueue_mail(self, mail_id, message, now):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO mail_outbox (id, message, state, next_attempt, created_at) "
+                "VALUES (?, ?, 'queued', ?, ?)",
+                (mail_id, json.dumps(message), now, now),
+            )
+
+    def claim_mail(self, now, limit, lease):
+        """Marks up to `limit` due messages as being sent until now + lease and
+        returns them as [(id, message dict, attempts)]. Messages whose sender
+        died mid-send (lease expired) are due again."""
+        with self.transaction() as db:
+            rows = db.execute(
+                "SELECT id, message, attempts FROM mail_outbox "
+                "WHERE (state = 'queued' AND next_attempt <= ?) OR (state = 'sending' AND lease_until <= ?) "
+                "ORDER BY next_attempt LIMIT ?",
+                (now, now, limit),
+            ).fetchall()
+            db.executemany(
+                "UPDATE mail_outbox SET state = 'sending', lease_until = ? WHERE id = ?",
+                [(now + lease, r[0]) for r in rows],
+            )
+        return [(mail_id, json.loads(message), attempts) for mail_id, message, attempts in rows]
+
+    def mail_sent(self, mail_id, now):
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE mail_outbox SET state = 'sent', attempts = attempts + 1, sent_at = ?, "
+                "lease_until = NULL, last_error = NULL WHERE id = ?",
+                (now, mail_id),
+            )
+
+    def mail_attempt_failed(self, mail_id, error, next_attempt=None):
+        """Records a failed attempt; the message is retried at next_attempt, or
+        given up on when next_attempt is None."""
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE mail_outbox SET state = ?, attempts = attempts + 1, next_attempt = COALESCE(?, next_attempt), "
+                "lease_until = NULL, last_error = ? WHERE id = ?",
+                ("failed" if next_attempt is None else "queued", next_attempt, error, mail_id),
+            )
+
+    def get_mail(self, mail_id):
+        rows = self._query(
+            "SELECT state, attempts, next_attempt, last_error, created_at, sent_at FROM mail_outbox WHERE id = ?",
+            (mail_id,),
+        )
+        if not rows:
+            return None
+        state, attempts, next_attempt, last_error, created_at, sent_at = rows[0]
+        return {"id": mail_id, "state": state, "attempts": attempts, "last_error": last_error,
+                "created": created_at, "sent": sent_at,
+                "next_attempt": next_attempt if state == "queued" else None}
+
+    def next_mail_due(self):
+        """Earliest next_attempt of the queued messages, or None."""
+        return self._query("SELECT MIN(next_attempt) FROM mail_outbox WHERE state = 'queued'")[0][0]
+
+    def prune_mail(self, before):
+        """Deletes delivered and failed messages created before `before`."""
+        with self.transaction() as db:
+            return db.execute(
+                "DELETE FROM mail_outbox WHERE state IN ('sent', 'failed') AND created_at < ?", (before,)
+            ).rowcount
+
+
+def _load_json(file_path):
+    if not file_path or not os.path.exists(file_path):
+        return {}
+    try:
+        with open(file_path, "r") as f:
+            return json.load(f) or {}
+    except (OSError, json.JSONDecodeError):
+        return {}
@@ -0,0 +1,152 @@
+import io
+import os
+
+import pytest
+
+import chunked_upload
+from chunked_upload import ChunkedUploads, UploadError, link_new
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return ChunkedUploads(str(tmp_path / "uploads"))
+
+
+@pytest.fixture
+def recdir(tmp_path):
+    path = tmp_path / "recordings"
+    path.mkdir()
+    return str(path)
+
+
+def put(uploads, upload_id, seq, data):
+    return uploads.put_chunk(upload_id, seq, io.BytesIO(data), len(data))
+
+
+def names(base="recording_20260101_120000"):
+    yield f"{base}.webm"
+    n = 1
+    while True:
+        yield f"{base}_{n}.webm"
+        n += 1
+
+
+def test_chunks_are_assembled_in_sequence_order(uploads, recdir):
+    upload_id = uploads.create("token")
+    put(uploads, upload_id, 1, b"world")
+    put(uploads, upload_id, 0, b"hello ")
+    assert uploads.status(upload_id)["received"] == [0, 1]
+
+    fname, created = uploads.finalize(upload_id, recdir, names(), expected_chunks=2)
+    assert created
+    with open(os.path.join(recdir, fname), "rb") as f:
+        assert f.read() == b"hello world"
+    assert uploads.status(upload_id) == {"received": [], "bytes": 0, "filename": fname}
+
+
+def test_retried_chunk_is_not_rewritten(uploads):
+    upload_id = uploads.create("token")
+    assert put(uploads, upload_id, 0, b"abc")
+    assert not put(uploads, upload_id, 0, b"xyz")
+    assert uploads.status(upload_id)["bytes"] == 3
+
+
+def test_chunk_needs_content_length(uploads):
+    upload_id = uploads.create("token")
+    with pytest.raises(UploadError) as e:
+        uploads.put_chunk(upload_id, 0, io.BytesIO(b"abc"), None)
+    assert e.value.status == 411
+
+
+def test_short_chunk_is_rejected(uploads):
+    upload_id = uploads.create("token")
+    with pytest.raises(UploadError):
+        uploads.put_chunk(upload_id, 0, io.BytesIO(b"ab"), 3)
+    assert uploads.status(upload_id)["received"] == []
+
+
+@pytest.mark.parametrize("received, expected, missing", [
+    ([0, 2], None, [1]),       # gap in the middle
+    ([0, 1], 4, [2, 3]),       # tail not uploaded yet
+    ([1, 2], None, [0]),       # first chunk missing
+])
+def test_finalize_reports_missing_chunks(uploads, recdir, received, expected, missing):
+    upload_id = uploads.create("token")
+    for seq in received:
+        put(uploads, upload_id, seq, b"x")
+    with pytest.raises(UploadError) as e:
+        uploads.finalize(upload_id, recdir, names(), expected_chunks=expected)
+    assert e.value.status == 409
+    assert str(missing) in str(e.value)
+    assert os.listdir(recdir) == []
+
+
+def test_finalize_twice_returns_the_same_file(uploads, recdir):
+    upload_id = uploads.create("token")
+    put(uploads, upload_id, 0, b"abc")
+    first = uploads.finalize(upload_id, recdir, names())
+    assert uploads.finalize(upload_id, recdir, names()) == (first[0], False)
+    assert os.listdir(recdir) == [first[0]]
+
+
+def test_same_second_uploads_get_separate_files(uploads, recdir):
+    # Regression: both uploads were named after the same second and the second
+    # one replaced the first one's file.
+    a, b = uploads.create("a"), uploads.create("b")
+    put(uploads, a, 0, b"first")
+    put(uploads, b, 0, b"second")
+    fname_a, _ = uploads.finalize(a, recdir, names())
+    fname_b, _ = uploads.finalize(b, recdir, names())
+    assert fname_a != fname_b
+    with open(os.path.join(recdir, fname_a), "rb") as f:
+        assert f.read() == b"first"
+    with open(os.path.join(recdir, fname_b), "rb") as f:
+        assert f.read() == b"second"
+
+
+def test_link_new_skips_a_name_taken_after_it_was_chosen(tmp_path, recdir):
+    src = tmp_path / "src"
+    src.write_bytes(b"new")
+
+    def racing_names():
+        # Another writer creates the first candidate right before it is used.
+        with open(os.path.join(recdir, "clip.webm"), "wb") as f:
+            f.write(b"existing")
+        yield "clip.webm"
+        yield "clip_1.webm"
+
+    assert link_new(str(src), recdir, racing_names()) == "clip_1.webm"
+    with open(os.path.join(recdir, "clip.webm"), "rb") as f:
+        assert f.read() == b"existing"
+
+
+def test_link_new_copies_without_hard_links(tmp_path, recdir, monkeypatch):
+    src = tmp_path / "src"
+    src.write_bytes(b"data")
+    (tmp_path / "recordings" / "a.webm").write_bytes(b"existing")
+
+    def no_link(src, dst):
+        raise OSError(chunked_upload.errno.EXDEV, "cross-device link")
+
+    monkeypatch.setattr(os, "link", no_link)
+    assert link_new(str(src), recdir, iter(["a.webm", "b.webm"])) == "b.webm"
+    assert (tmp_path / "recordings" / "a.webm").read_bytes() == b"existing"
+    assert (tmp_path / "recordings" / "b.webm").read_bytes() == b"data"
+
+
+def test_failed_assembly_leaves_no_partial_file(uploads, recdir, monkeypatch):
+    upload_id = uploads.create("token")
+    put(uploads, upload_id, 0, b"abc")
+
+    def disk_full(dst_fd, src_path):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(chunked_upload, "_append_file", disk_full)
+    with pytest.raises(OSError):
+        uploads.finalize(upload_id, recdir, names())
+    assert os.listdir(recdir) == []
+    assert uploads.status(upload_id)["received"] == [0]  # Parts kept for a retry
+
+    monkeypatch.undo()
+    fname, created = uploads.finalize(upload_id, recdir, names())
+    assert created and os.listdir(recdir) == [fname]
@@ -0,0 +1,38 @@
+import pytest
+
+from clipper import KEYFRAME_TOLERANCE, plan_clip
+
+KEYFRAMES = [0.0, 2.0, 4.0, 6.0]
+
+
+@pytest.mark.parametrize("start, snapped", [
+    (0.0, 0.0),
+    (3.5, 2.0),    # back to the previous keyframe
+    (4.0, 4.0),
+    (4.0 - KEYFRAME_TOLERANCE / 2, 4.0),  # within tolerance counts as on the keyframe
+    (9.0, 6.0),
+])
+def test_fast_snaps_to_the_preceding_keyframe(start, snapped):
+    assert plan_clip(KEYFRAMES, start, start + 1, "fast") == {"strategy": "copy", "start": snapped}
+
+
+def test_fast_without_keyframes_starts_at_zero():
+    assert plan_clip([], 3.0, 5.0, "fast") == {"strategy": "copy", "start": 0.0}
+
+
+def test_exact_on_a_keyframe_is_copied():
+    assert plan_clip(KEYFRAMES, 2.0 + KEYFRAME_TOLERANCE / 2, 5.0, "exact") == {"strategy": "copy", "start": 2.0}
+
+
+def test_exact_between_keyframes_is_a_smart_cut():
+    assert plan_clip(KEYFRAMES, 2.5, 5.0, "exact") == {"strategy": "smart", "start": 2.5, "keyframe": 4.0}
+
+
+@pytest.mark.parametrize("end", [3.5, 4.0])
+def test_exact_without_a_keyframe_inside_is_reencoded(end):
+    # No keyframe in (start, end - tolerance): there is nothing to stream-copy.
+    assert plan_clip(KEYFRAMES, 2.5, end, "exact") == {"strategy": "reencode", "start": 2.5}
+
+
+def test_exact_after_the_last_keyframe_is_reencoded():
+    assert plan_clip(KEYFRAMES, 6.5, 8.0, "exact") == {"strategy": "reencode", "start": 6.5}
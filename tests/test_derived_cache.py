@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+import derived_cache as derived_cache_module
+from derived_cache import DerivedCache
+from store import Store
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A time.time() that moves forward one second per call, so access order is unambiguous."""
+    now = [1_000_000.0]
+
+    def tick():
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr(derived_cache_module.time, "time", tick)
+    return now
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Store(str(tmp_path / "store.db"))
+
+
+def make_cache(tmp_path, store, max_bytes=10, policy="lru"):
+    return DerivedCache(str(tmp_path / "derived"), store, max_bytes, policy)
+
+
+def put(cache, name, size, source="rec.webm"):
+    key = name * 8
+    staged = cache.staging_path(key, ".bin")
+    with open(staged, "wb") as f:
+        f.write(b"x" * size)
+    return cache.put(key, source, "clip", staged, ".bin")
+
+
+def cached(cache, *names):
+    return {name for name in names if cache.get(name * 8, count=False) is not None}
+
+
+def test_lru_evicts_the_least_recently_used(tmp_path, store, clock):
+    cache = make_cache(tmp_path, store)
+    a = put(cache, "a", 4)
+    put(cache, "b", 4)
+    cache.get(a["key"])  # a is now more recent than b
+    put(cache, "c", 4)
+    assert cached(cache, "a", "b", "c") == {"a", "c"}
+
+
+def test_lfu_evicts_the_least_often_used(tmp_path, store, clock):
+    cache = make_cache(tmp_path, store, policy="lfu")
+    a, b = put(cache, "a", 4), put(cache, "b", 4)
+    cache.get(a["key"])
+    cache.get(a["key"])
+    cache.get(b["key"])  # b is more recent, but a has more hits
+    put(cache, "c", 4)
+    assert cached(cache, "a", "b", "c") == {"a", "c"}
+
+
+def test_eviction_removes_the_files(tmp_path, store, clock):
+    cache = make_cache(tmp_path, store)
+    a = put(cache, "a", 6)
+    put(cache, "b", 6)
+    assert not os.path.exists(a["abspath"])
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_of_publicly_linked_recordings_are_pinned(tmp_path, store, clock):
+    cache = make_cache(tmp_path, store)
+    store.add_session_files("tok", ["shared.webm", "rec.webm"])
+    store.get_or_create_link("shared.webm", "link1")
+    put(cache, "a", 4, source="shared.webm")
+    put(cache, "b", 4)
+    put(cache, "c", 4)
+    assert cached(cache, "a", "b", "c") == {"a", "c"}
+
+
+def test_an_entry_pinned_by_any_owner_stays(tmp_path, store, clock):
+    cache = make_cache(tmp_path, store)
+    store.add_session_files("tok", ["copy.webm"])
+    store.get_or_create_link("copy.webm", "link1")
+    a = put(cache, "a", 4)
+    cache.get(a["key"], source="copy.webm")  # Same content under another name
+    put(cache, "b", 4)
+    put(cache, "c", 4)
+    assert cached(cache, "a", "b", "c") == {"a", "c"}
+
+
+def test_put_never_evicts_the_new_entry(tmp_path, store, clock):
+    cache = make_cache(tmp_path, store)
+    put(cache, "a", 4)
+    big = put(cache, "b", 50)
+    assert os.path.exists(big["abspath"])
+    assert cached(cache, "a", "b") == {"b"}
+    put(cache, "c", 4)  # The next put trims the oversized entry
+    assert cached(cache, "b", "c") == {"c"}
+
+
+def test_forget_source_keeps_entries_other_recordings_own(tmp_path, store, clock):
+    cache = make_cache(tmp_path, store, max_bytes=100)
+    a = put(cache, "a", 4)
+    b = put(cache, "b", 4)
+    cache.get(b["key"], source="copy.webm")
+    cache.forget_source("rec.webm")
+    assert cached(cache, "a", "b") == {"b"}
+    assert not os.path.exists(a["abspath"])
+    assert cache.get(b["key"], count=False)["sources"] == ["copy.webm"]
+
+
+def test_entry_missing_on_disk_is_a_miss(tmp_path, store, clock):
+    cache = make_cache(tmp_path, store, max_bytes=100)
+    a = put(cache, "a", 4)
+    os.remove(a["abspath"])
+    assert cache.get(a["key"]) is None
+    assert store.get_derived(a["key"]) is None
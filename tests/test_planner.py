@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from planner import DEFAULT_PROFILE, MP4_PROFILES, load_profiles, plan_mp4
+
+
+def meta(video="vp8", audio="opus", **video_fields):
+    return {
+        "duration": 10.0,
+        "video": {"codec": video, "width": 1280, "height": 720, **video_fields} if video else None,
+        "audio": {"codec": audio} if audio else None,
+    }
+
+
+@pytest.mark.parametrize("profile, source, strategy", [
+    ("compatibility", meta("h264", "aac"), "remux"),
+    ("compatibility", meta("h264", "opus"), "audio"),
+    ("compatibility", meta("vp9", "opus"), "transcode"),
+    ("compatibility", meta("vp8", "opus"), "transcode"),
+    ("fast", meta("vp9", "opus"), "remux"),
+    ("fast", meta("vp8", "opus"), "transcode"),
+    ("fast", meta("vp9", "vorbis"), "audio"),
+    ("fast", meta("vp9", None), "remux"),
+])
+def test_cheapest_strategy(profile, source, strategy):
+    assert plan_mp4(source, MP4_PROFILES[profile])["strategy"] == strategy
+
+
+def test_copy_keeps_the_video_and_drops_missing_audio():
+    args = plan_mp4(meta("h264", None), MP4_PROFILES["compatibility"])["args"]
+    assert args[args.index("-c:v") + 1] == "copy"
+    assert "-an" in args
+
+
+def test_transcode_caps_the_frame_rate_and_evens_the_size():
+    args = plan_mp4(meta("vp8", "opus", fps=1000, width=1281), MP4_PROFILES[DEFAULT_PROFILE])["args"]
+    assert args[args.index("-r") + 1] == "30"
+    assert args[args.index("-vf") + 1] == "scale=trunc(iw/2)*2:trunc(ih/2)*2"
+    assert "libx264" in args
+
+
+def test_unknown_streams_are_transcoded_with_audio():
+    plan = plan_mp4(None, MP4_PROFILES[DEFAULT_PROFILE])
+    assert plan["strategy"] == "transcode"
+    assert "aac" in plan["args"]
+
+
+def test_load_profiles_merges_overrides(tmp_path):
+    path = tmp_path / "profiles.json"
+    path.write_text(json.dumps({
+        "fast": {"max_fps": 60},
+        "archive": {"video_copy": ["h264", "vp9"]},
+    }))
+    profiles = load_profiles(str(path))
+    assert profiles["fast"]["max_fps"] == 60
+    assert profiles["fast"]["video_copy"] == MP4_PROFILES["fast"]["video_copy"]
+    # New profiles start from the default one.
+    assert profiles["archive"]["audio_copy"] == MP4_PROFILES[DEFAULT_PROFILE]["audio_copy"]
+    assert MP4_PROFILES["fast"]["max_fps"] == 30  # The built-in table is untouched
+
+
+def test_load_profiles_without_a_file(tmp_path):
+    assert load_profiles(str(tmp_path / "missing.json")) == MP4_PROFILES
@@ -0,0 +1,126 @@
+import os
+
+import pytest
+from flask import Flask
+
+import serving
+from serving import MAX_RANGES, send_media
+
+DATA = bytes(range(256)) * 4  # 1024 bytes
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(serving, "MEDIA_OFFLOAD", "")
+    (tmp_path / "a.webm").write_bytes(DATA)
+    app = Flask(__name__)
+
+    @app.route("/media/<fname>")
+    def media(fname):
+        return send_media(str(tmp_path), fname)
+
+    return app.test_client()
+
+
+def test_whole_file_with_validators(client):
+    r = client.get("/media/a.webm")
+    assert r.status_code == 200
+    assert r.data == DATA
+    assert r.headers["Accept-Ranges"] == "bytes"
+    assert r.headers["ETag"].startswith('"')
+    assert "immutable" in r.headers["Cache-Control"]
+
+
+@pytest.mark.parametrize("header, start, stop", [
+    ("bytes=0-99", 0, 100),
+    ("bytes=1000-", 1000, 1024),
+    ("bytes=-24", 1000, 1024),        # suffix range
+    ("bytes=1000-5000", 1000, 1024),  # clamped to the size
+])
+def test_single_range(client, header, start, stop):
+    r = client.get("/media/a.webm", headers={"Range": header})
+    assert r.status_code == 206
+    assert r.data == DATA[start:stop]
+    assert r.headers["Content-Range"] == f"bytes {start}-{stop - 1}/{len(DATA)}"
+
+
+def test_adjacent_ranges_are_merged(client):
+    r = client.get("/media/a.webm", headers={"Range": "bytes=10-19,20-29"})
+    assert r.status_code == 206
+    assert r.data == DATA[10:30]
+    assert r.headers["Content-Range"] == "bytes 10-29/1024"
+
+
+def test_overlapping_ranges_send_the_whole_file(client):
+    # Werkzeug rejects overlapping or unordered range sets as malformed.
+    r = client.get("/media/a.webm", headers={"Range": "bytes=10-19,15-29"})
+    assert r.status_code == 200
+    assert r.data == DATA
+
+
+def test_multiple_ranges_are_multipart(client):
+    r = client.get("/media/a.webm", headers={"Range": "bytes=0-9,100-109"})
+    assert r.status_code == 206
+    assert r.mimetype == "multipart/byteranges"
+    assert int(r.headers["Content-Length"]) == len(r.data)
+    assert b"Content-Range: bytes 0-9/1024" in r.data
+    assert b"Content-Range: bytes 100-109/1024" in r.data
+    assert DATA[100:110] in r.data
+
+
+def test_unsatisfiable_range(client):
+    r = client.get("/media/a.webm", headers={"Range": "bytes=2000-3000"})
+    assert r.status_code == 416
+    assert r.headers["Content-Range"] == "bytes */1024"
+
+
+def test_too_many_ranges_send_the_whole_file(client):
+    ranges = ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(MAX_RANGES + 1))
+    r = client.get("/media/a.webm", headers={"Range": f"bytes={ranges}"})
+    assert r.status_code == 200
+    assert r.data == DATA
+
+
+def test_if_none_match(client):
+    etag = client.get("/media/a.webm").headers["ETag"]
+    assert client.get("/media/a.webm", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get("/media/a.webm", headers={"If-None-Match": f'"other", {etag}'}).status_code == 304
+    assert client.get("/media/a.webm", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_if_none_match_wins_over_if_modified_since(client):
+    r = client.get("/media/a.webm", headers={
+        "If-None-Match": '"other"',
+        "If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT",
+    })
+    assert r.status_code == 200
+
+
+def test_if_range_with_a_stale_etag_sends_the_whole_file(client):
+    etag = client.get("/media/a.webm").headers["ETag"]
+    r = client.get("/media/a.webm", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert r.status_code == 206
+    r = client.get("/media/a.webm", headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert r.status_code == 200
+    assert r.data == DATA
+
+
+def test_etag_changes_when_the_file_is_replaced(client, tmp_path):
+    etag = client.get("/media/a.webm").headers["ETag"]
+    replacement = tmp_path / "b.tmp"
+    replacement.write_bytes(DATA[:10])
+    os.replace(replacement, tmp_path / "a.webm")
+    assert client.get("/media/a.webm", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_offload_leaves_the_body_to_the_proxy(client, monkeypatch):
+    monkeypatch.setattr(serving, "MEDIA_OFFLOAD", "nginx")
+    r = client.get("/media/a.webm", headers={"Range": "bytes=0-9"})
+    assert r.status_code == 200
+    assert r.headers["X-Accel-Redirect"] == "/_media/a.webm"
+    assert r.data == b""
+
+
+def test_missing_or_escaping_names_are_404(client):
+    assert client.get("/media/missing.webm").status_code == 404
+    assert client.get("/media/..%2Fa.webm").status_code == 404
@@ -0,0 +1,137 @@
+import json
+
+import pytest
+
+import store as store_module
+from store import Store
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Store(str(tmp_path / "store.db"))
+
+
+def test_sessions_keep_their_recordings_in_order(store):
+    store.add_session_files("tok", ["b.webm", "a.webm"])
+    store.add_session_files("tok", ["c.webm"])
+    assert store.session_exists("tok")
+    assert not store.session_exists("other")
+    assert not store.session_exists(None)
+    assert store.session_files("tok") == ["b.webm", "a.webm", "c.webm"]
+
+
+def test_forgotten_session_keeps_public_links(store):
+    store.add_session_files("tok", ["a.webm"])
+    store.get_or_create_link("a.webm", "link1")
+    assert store.forget_session("tok")
+    assert not store.session_exists("tok")
+    assert store.file_for_link("link1") == "a.webm"
+
+
+def test_public_link_is_created_once(store):
+    store.add_session_files("tok", ["a.webm"])
+    assert store.get_or_create_link("a.webm", "link1") == ("link1", True)
+    assert store.get_or_create_link("a.webm", "link2") == ("link1", False)
+    assert store.link_for_file("a.webm") == "link1"
+    assert store.file_for_link("link2") is None
+
+
+def test_deleting_a_recording_removes_its_links(store):
+    store.add_session_files("tok", ["a.webm", "b.webm"])
+    store.get_or_create_link("a.webm", "link1")
+    assert store.delete_recording("a.webm")
+    assert store.file_for_link("link1") is None
+    assert store.session_files("tok") == ["b.webm"]
+    assert not store.delete_recording("a.webm")
+
+
+def test_migration_from_json_runs_once(store, tmp_path):
+    sessions, links = tmp_path / "sessions.json", tmp_path / "links.json"
+    sessions.write_text(json.dumps({"tok": ["a.webm", "b.webm"]}))
+    links.write_text(json.dumps({"link1": "b.webm", "link2": "orphan.webm"}))
+    assert store.migrate_from_json(str(sessions), str(links))
+    assert store.session_files("tok") == ["a.webm", "b.webm"]
+    assert store.file_for_link("link1") == "b.webm"
+    assert store.file_for_link("link2") == "orphan.webm"
+
+    sessions.write_text(json.dumps({"tok": ["c.webm"]}))
+    assert not store.migrate_from_json(str(sessions), str(links))
+    assert store.session_files("tok") == ["a.webm", "b.webm"]
+
+
+# --- Gallery listing (file_index) ---
+@pytest.fixture
+def clock(monkeypatch):
+    """A time.time() that moves forward one second per call, so every write gets its own updated_at."""
+    now = [1_000_000.0]
+
+    def tick():
+        now[0] += 1
+        return now[0]
+
+    monkeypatch.setattr(store_module.time, "time", tick)
+    return now
+
+
+def all_pages(store, token, sort, descending, limit):
+    pages, after = [], None
+    while True:
+        rows = store.list_session_files(token, sort, descending, after, limit)
+        if not rows:
+            return pages
+        pages.append([r["filename"] for r in rows])
+        after = (rows[-1]["sort_value"], rows[-1]["filename"])
+
+
+@pytest.mark.parametrize("sort", ["created", "size", "duration", "name"])
+@pytest.mark.parametrize("descending", [True, False])
+def test_cursor_pages_cover_every_file_once(store, sort, descending):
+    names = [f"rec_{i:02d}.webm" for i in range(7)]
+    store.add_session_files("tok", names)  # One transaction: all share created_at
+    for i, name in enumerate(names):
+        # Sizes and durations with ties, so the filename tie-breaker matters.
+        store.save_media_index(name, 100 * (i % 3), 0, float(i % 2), [])
+
+    pages = all_pages(store, "tok", sort, descending, limit=3)
+    listed = [name for page in pages for name in page]
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sorted(listed) == names
+
+    rows = store.list_session_files("tok", sort, descending, limit=100)
+    assert [r["filename"] for r in rows] == listed
+    keys = [(r["sort_value"], r["filename"]) for r in rows]
+    assert keys == sorted(keys, reverse=descending)
+
+
+def test_listing_is_per_session(store):
+    store.add_session_files("a", ["a.webm"])
+    store.add_session_files("b", ["b.webm"])
+    assert [r["filename"] for r in store.list_session_files("a")] == ["a.webm"]
+    store.forget_session("a")
+    assert store.list_session_files("a") == []
+
+
+def test_version_changes_whenever_the_listing_would(store, clock):
+    versions = [store.session_files_version("tok")]
+    assert versions[0] == (0, 0)
+
+    def changed():
+        versions.append(store.session_files_version("tok"))
+        return versions[-1] != versions[-2]
+
+    store.add_session_files("tok", ["a.webm", "b.webm"])
+    assert changed() and versions[-1][0] == 2
+    store.save_media_index("a.webm", 10, 0, 1.5, [])
+    assert changed()
+    store.set_file_thumbnail("a.webm", "/thumbs/a/poster.jpg")
+    assert changed()
+    store.get_or_create_link("b.webm", "link1")
+    assert changed()
+    store.get_or_create_link("b.webm", "link2")  # Existing link: nothing changes
+    assert not changed()
+    store.delete_links_for_file("b.webm")
+    assert changed()
+    store.delete_recording("a.webm")
+    assert changed() and versions[-1][0] == 1
+    store.add_session_files("other", ["c.webm"])
+    assert not changed()
@@ -0,0 +1,140 @@
+# thumbnails.py
+# Poster image and scrub sprite sheet for a recording, from one ffmpeg pass.
+#
+# The video is sampled once every `interval` seconds (chosen so a recording
+# never needs more than MAX_TILES frames). The samples are split two ways:
+#   sprite.jpg  every sample at TILE_WIDTH px, tiled SPRITE_COLUMNS wide
+#   poster.jpg  one sample (POSTER_POSITION into the recording) at POSTER_WIDTH px
+# so the poster costs no extra decoding. When the recording has a keyframe at
+# least every `interval` seconds, only keyframes are decoded at all
+# (-skip_frame nokey), which makes the pass a small fraction of a full decode.
+#
+# Output layout (relative paths, as referenced by the indexes):
+#   poster.jpg, sprite.jpg,
+#   sprite.vtt   WebVTT thumbnail track (sprite.jpg#xywh=x,y,w,h per cue)
+#   sprite.json  the same grid for scripts: {"interval", "count", "columns", ...}
+
+import json
+import math
+import os
+
+from media import run_ffmpeg_progress
+
+TILE_WIDTH = 160
+DEFAULT_TILE_HEIGHT = 90 # When the source's size is unknown (16:9)
+MIN_INTERVAL = 1.0 # Seconds between samples, at least
+MAX_TILES = 100
+SPRITE_COLUMNS = 10
+POSTER_WIDTH = 480
+POSTER_POSITION = 0.1 # Fraction of the duration; skips the first seconds of screen picking
+JPEG_QUALITY = 5 # ffmpeg -q:v, 2 (best) .. 31
+
+THUMBNAIL_MIMETYPES = {
+    ".jpg": "image/jpeg",
+    ".vtt": "text/vtt",
+    ".json": "application/json",
+}
+
+
+def _even(n):
+    return max(2, int(round(n / 2)) * 2)
+
+
+def max_keyframe_gap(keyframes, duration):
+    """The longest stretch without a keyframe, counting from 0 to the first
+    keyframe and from the last one to the end. MediaRecorder places keyframes
+    irregularly, so the average spacing says little."""
+    times = sorted(keyframes)
+    edges = [0.0] + times + [max(duration, times[-1])]
+    return max(b - a for a, b in zip(edges, edges[1:]))
+
+
+def plan_sprite(meta, keyframes=None):
+    """Sampling and grid for a file described by `meta` (media.probe_media);
+    `keyframes` is its keyframe times, if known. Raises ValueError when the
+    file has no video or no known duration."""
+    meta = meta or {}
+    video = meta.get("video")
+    duration = meta.get("duration")
+    if not video:
+        raise ValueError("The recording has no video.")
+    if not duration or duration <= 0:
+        raise ValueError("The recording's duration is unknown.")
+    interval = max(MIN_INTERVAL, duration / MAX_TILES)
+    count = max(1, math.ceil(duration / interval))
+    width, height = video.get("width"), video.get("height")
+    tile_height = _even(TILE_WIDTH * height / width) if width and height else DEFAULT_TILE_HEIGHT
+    columns = min(count, SPRITE_COLUMNS)
+    return {
+        "duration": duration,
+        "interval": interval,
+        "count": count,
+        "columns": columns,
+        "rows": math.ceil(count / columns),
+        "width": TILE_WIDTH,
+        "height": tile_height,
+        "poster_index": min(int(count * POSTER_POSITION), count - 1),
+        # Keyframes alone sample the recording well enough when there is one per interval.
+        "keyframes_only": bool(keyframes) and max_keyframe_gap(keyframes, duration) <= interval,
+    }
+
+
+def thumbnails_command(ffmpeg_path, in_path, out_dir, plan):
+    cmd = [ffmpeg_path, "-hide_banner", "-loglevel", "error", "-y"]
+    if plan["keyframes_only"]:
+        cmd += ["-skip_frame", "nokey"]
+    cmd += ["-i", in_path]
+    graph = ";".join([
+        f"[0:v:0]fps=1/{plan['interval']:g},split=2[samples][candidates]",
+        f"[samples]scale={plan['width']}:{plan['height']}:flags=fast_bilinear,"
+        f"tile={plan['columns']}x{plan['rows']}[sprite]",
+        f"[candidates]select=eq(n\\,{plan['poster_index']}),scale={POSTER_WIDTH}:-2[poster]",
+    ])
+    cmd += ["-filter_complex", graph, "-an", "-sn", "-dn"]
+    for label, name, quality in (("sprite", "sprite.jpg", JPEG_QUALITY), ("poster", "poster.jpg", JPEG_QUALITY - 2)):
+        cmd += ["-map", f"[{label}]", "-frames:v", "1", "-q:v", str(quality),
+                "-f", "image2", "-update", "1", os.path.join(out_dir, name)]
+    return cmd
+
+
+def _timestamp(seconds):
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+
+def sprite_index(plan):
+    """The JSON index: the plan's grid plus the file names it refers to."""
+    return {
+        "sprite": "sprite.jpg",
+        "poster": "poster.jpg",
+        **{k: plan[k] for k in ("duration", "interval", "count", "columns", "rows", "width", "height")},
+    }
+
+
+def sprite_vtt(plan):
+    """A WebVTT thumbnail track: one cue per tile, pointing into sprite.jpg."""
+    lines = ["WEBVTT", ""]
+    w, h = plan["width"], plan["height"]
+    for i in range(plan["count"]):
+        start = i * plan["interval"]
+        end = min(start + plan["interval"], plan["duration"])
+        x, y = (i % plan["columns"]) * w, (i // plan["columns"]) * h
+        lines += [f"{_timestamp(start)} --> {_timestamp(end)}", f"sprite.jpg#xywh={x},{y},{w},{h}", ""]
+    return "\n".join(lines)
+
+
+def make_thumbnails(ffmpeg_path, in_path, out_dir, meta, keyframes=None, on_progress=None, timeout=None):
+    """Writes the poster, sprite sheet and both indexes for in_path into
+    out_dir (which must exist). Returns the JSON index."""
+    plan = plan_sprite(meta, keyframes)
+    run_ffmpeg_progress(thumbnails_command(ffmpeg_path, in_path, out_dir, plan), on_progress,
+                        timeout=timeout, op="thumbnails")
+    for name in ("sprite.jpg", "poster.jpg"):
+        if not os.path.exists(os.path.join(out_dir, name)):
+            raise RuntimeError(f"Thumbnail extraction produced no {name}.")
+    index = sprite_index(plan)
+    with open(os.path.join(out_dir, "sprite.json"), "w") as f:
+        json.dump(index, f)
+    with open(os.path.join(out_dir, "sprite.vtt"), "w") as f:
+        f.write(sprite_vtt(plan))
+    return index
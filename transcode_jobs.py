@@ -0,0 +1,235 @@
+# transcode_jobs.py
+# Background job queue for slow ffmpeg work such as MP4 conversion.
+#
+# Requests only submit a job and poll it; the work itself runs on a bounded
+# pool sized to the CPU count, each pool thread driving one ffmpeg process.
+# Job state lives in small JSON files, so every gunicorn worker can answer a
+# status query, and a per-job claim file makes concurrent requests for the
+# same output share one job instead of starting duplicate encodes.
+#
+# A failed job stays failed: submitting it again returns the failed state
+# until its retry time (exponential backoff), and after MAX_ATTEMPTS failures
+# for good, so a broken input can't start ffmpeg on every poll.
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows local development: no cross-process slot limit.
+    fcntl = None
+
+# How often progress updates are flushed to the state file.
+STATE_WRITE_INTERVAL = 1.0
+# A claim whose job hasn't written any state for this long is considered dead.
+STALE_CLAIM_SECONDS = 30 * 60
+# Failed jobs may be resubmitted after RETRY_BASE_SECONDS, doubling per failure,
+# up to MAX_ATTEMPTS runs in total.
+RETRY_BASE_SECONDS = 60
+MAX_ATTEMPTS = 3
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{20}$")
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        return True  # os.kill() would terminate the process on Windows; rely on the age check.
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TranscodeJobs:
+    """Bounded, de-duplicating background job runner with file-backed state."""
+
+    def __init__(self, state_dir, max_workers=None, logger=None):
+        self.state_dir = state_dir
+        self.slots_dir = os.path.join(state_dir, "slots")
+        os.makedirs(self.slots_dir, exist_ok=True)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.logger = logger
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="transcode")
+
+    @staticmethod
+    def job_id(kind, source, params=None):
+        """Deterministic id, so the same conversion always maps to the same job."""
+        raw = json.dumps([kind, source, params or {}], sort_keys=True)
+        return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+    # --- State files ---
+    def _state_path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def _claim_path(self, job_id):
+        return os.path.join(self.state_dir, f"{job_id}.claim")
+
+    def get(self, job_id):
+        if not job_id or not _JOB_ID_RE.match(job_id):
+            return None
+        try:
+            with open(self._state_path(job_id), "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def _write(self, job_id, state):
+        state["updated"] = time.time()
+        path = self._state_path(job_id)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    def _claim(self, job_id):
+        """Atomically claims job_id for this process. Returns False if a live
+        job already holds the claim."""
+        path = self._claim_path(job_id)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._claim_is_stale(job_id):
+                    return False
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def _claim_is_stale(self, job_id):
+        path = self._claim_path(job_id)
+        try:
+            claimed_at = os.path.getmtime(path)
+            with open(path, "r") as f:
+                pid = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            claimed_at, pid = 0, 0
+        state = self.get(job_id) or {}
+        last_seen = max(state.get("updated") or 0, claimed_at)
+        if pid and not _pid_alive(pid):
+            return True
+        return time.time() - last_seen > STALE_CLAIM_SECONDS
+
+    def _release(self, job_id):
+        try:
+            os.remove(self._claim_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def prune(self, max_age):
+        """Deletes state files of finished jobs older than max_age seconds.
+        Returns how many were removed."""
+        removed = 0
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.state_dir):
+            job_id, ext = os.path.splitext(entry.name)
+            if ext != ".json" or not _JOB_ID_RE.match(job_id):
+                continue
+            state = self.get(job_id)
+            if state and state.get("state") in ("done", "failed") and (state.get("updated") or 0) < cutoff:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    # --- Cross-process concurrency slots ---
+    def _acquire_slot(self, job_id, state):
+        """Blocks until one of max_workers slot locks is free, so the number of
+        concurrent encodes stays bounded across all gunicorn workers."""
+        if fcntl is None:
+            return None
+        while True:
+            for i in range(self.max_workers):
+                f = open(os.path.join(self.slots_dir, f"slot-{i}.lock"), "a")
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return f
+                except OSError:
+                    f.close()
+            self._write(job_id, state)  # heartbeat while queued
+            time.sleep(0.5)
+
+    @staticmethod
+    def _retry_at(attempts, finished):
+        """When a job that failed for the attempts-th time may run again, or None."""
+        if attempts >= MAX_ATTEMPTS:
+            return None
+        return finished + RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+
+    @staticmethod
+    def held_back(state):
+        """True if state is a failure that must not be retried yet."""
+        if not state or state.get("state") != "failed":
+            return False
+        retry_at = state.get("retry_at")
+        return retry_at is None or time.time() < retry_at
+
+    # --- Public API ---
+    def submit(self, job_id, work, info=None):
+        """Queues work(report) unless the same job is already queued or running,
+        or failed and isn't due for a retry (see RETRY_BASE_SECONDS).
+
+        `work` receives a report(**fields) callback for publishing progress
+        and may return a dict that is merged into the final job state.
+        Returns the current state of the job."""
+        previous = self.get(job_id)
+        if self.held_back(previous):
+            return previous
+        if not self._claim(job_id):
+            return self.get(job_id) or {"job_id": job_id, "state": "queued"}
+        previous = self.get(job_id)  # Another process may have finished a run since
+        if self.held_back(previous):
+            self._release(job_id)
+            return previous
+
+        attempts = (previous.get("attempts") or 1) + 1 if previous and previous.get("state") == "failed" else 1
+        state = {"job_id": job_id, "state": "queued", "progress": None, "created": time.time(), "attempts": attempts}
+        state.update(info or {})
+        self._write(job_id, state)
+        self._executor.submit(self._run, job_id, work, state)
+        return dict(state)
+
+    def _run(self, job_id, work, state):
+        slot = None
+        try:
+            slot = self._acquire_slot(job_id, state)
+            state.update(state="running", started=time.time())
+            self._write(job_id, state)
+            last_write = [time.monotonic()]
+
+            def report(**fields):
+                state.update(fields)
+                now = time.monotonic()
+                if now - last_write[0] >= STATE_WRITE_INTERVAL:
+                    last_write[0] = now
+                    self._write(job_id, state)
+
+            result = work(report) or {}
+            state.update(result)
+            state.update(state="done", progress=1.0, finished=time.time())
+        except Exception as e:
+            finished = time.time()
+            state.update(state="failed", error=str(e), finished=finished,
+                         retry_at=self._retry_at(state["attempts"], finished))
+            if self.logger:
+                self.logger.error(f"Job {job_id} failed: {e}")
+        finally:
+            self._write(job_id, state)
+            if slot is not None:
+                slot.close()  # closing the file drops the flock
+            self._release(job_id)